@@ -50,14 +50,6 @@ except:
     tkMessageBox.showerror("Error", "wxPython is not installed.\nThis application requires wxPython 2.5.3 or later.")
     exit(1)
 
-try:
-    import OpenGL
-except:
-    import Tkinter, tkMessageBox
-    Tkinter.Tk().withdraw()
-    tkMessageBox.showerror("Error", "PyOpenGL is not installed.\nThis application\nrequires PyOpenGL 3.0.1 or later.")
-    exit(1)
-
 if not __debug__:
     import warnings
     warnings.simplefilter('ignore', DeprecationWarning)
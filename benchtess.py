@@ -0,0 +1,150 @@
+#
+# Compares the native and GLU tessellators on the polygons in real BGLs.
+#
+# Usage: python -O benchtess.py "MSFS scenery location"
+#
+# Reads the old-style BGLs under the scenery location without writing any
+# output, recording each polygon that is passed to the tessellator. Then
+# tessellates each recorded polygon with both tessellators and reports the
+# time taken and the polygons for which the area covered differs.
+#
+
+from copy import copy, deepcopy
+from os import mkdir
+from os.path import abspath, join
+from shutil import rmtree
+from sys import argv, exit
+from tempfile import mkdtemp
+from timeit import default_timer
+
+import convbgl
+import convtess
+from convtess import GLU_TESS_BEGIN, GLU_TESS_VERTEX, GLU_TESS_COMBINE, GLU_TESS_BEGIN_DATA
+from convmain import Output, readbgl
+from convutil import FS2XError
+
+
+# Tessellate a recorded polygon.
+# Returns ([primitive of [x,y,z]] or None if failed, whether approximate, time)
+def run(tess, native):
+    job=copy(tess)
+    job.data=deepcopy(tess.template)
+    coords=dict([(id(data), xyz) for contour in tess.contours for (xyz, data) in contour])
+    prims=[]
+    moved=[]	# where combine gave back an existing vertex for a new point
+    job.callbacks={}
+    for (which, fn) in tess.callbacks.iteritems():
+        if which>=GLU_TESS_BEGIN_DATA:
+            job.callbacks[which]=record(which-6, fn, coords, prims, moved)
+        else:
+            job.callbacks[which]=record(which, fn, coords, prims, moved)
+    if GLU_TESS_BEGIN not in job.callbacks and GLU_TESS_BEGIN_DATA not in job.callbacks:
+        job.callbacks[GLU_TESS_BEGIN]=record(GLU_TESS_BEGIN, lambda mode: None, coords, prims, moved)
+    convtess.native=native
+    t=default_timer()
+    try:
+        if native:
+            convtess.nativetess(job)
+        else:
+            convtess.glutess(job)
+    except:
+        return (None, False, default_timer()-t)
+    return (prims, bool(moved), default_timer()-t)
+
+# Wrap a callback to note the coordinates of the vertices that it's given
+def record(which, fn, coords, prims, moved):
+    def callback(*args):
+        if which==GLU_TESS_BEGIN:
+            prims.append([])
+        elif which==GLU_TESS_VERTEX:
+            prims[-1].append(coords.get(id(args[0])))
+        result=fn(*args)
+        if which==GLU_TESS_COMBINE:
+            if id(result) not in coords:
+                coords[id(result)]=list(args[0])
+            elif args[1][2] is not None:
+                moved.append(result)	# output is at the existing vertex, not the crossing
+        return result
+    return callback
+
+# Area covered by the output of a tessellation
+def area(tess, prims):
+    normal=tess.normal
+    if normal==(0,0,0): normal=convtess.computenormal(tess.contours)
+    i=max(range(3), key=lambda j: abs(normal[j]))
+    (si,ti)=((i+1)%3, (i+2)%3)
+    a=0
+    for prim in prims:
+        if None in prim: return None
+        if tess.boundary:
+            loops=[prim]
+        else:
+            loops=[prim[j:j+3] for j in range(0, len(prim), 3)]
+        for loop in loops:
+            n=len(loop)
+            a+=abs(sum([loop[j][si]*loop[(j+1)%n][ti]-loop[(j+1)%n][si]*loop[j][ti] for j in range(n)]))*0.5
+    return a
+
+def status(percent, msg):
+    pass
+
+def log(msg):
+    pass
+
+def refresh():
+    pass
+
+
+if len(argv)!=2:
+    exit('Usage:\tpython -O benchtess.py "MSFS scenery location"')
+if convtess.GLU is None:
+    exit('PyOpenGL is not installed')
+fspath=abspath(unicode(argv[1]))
+
+# Settings as for a conversion of fspath. Nothing is written to xppath.
+tmp=mkdtemp()
+try:
+    mkdir(join(tmp, 'Custom Scenery'))
+    output=Output(fspath, None, join(tmp, 'Custom Scenery', 'benchtess'), False, 0, 10, status, log, refresh, None)
+except FS2XError, e:
+    exit('Error:\t%s' % e.msg)
+finally:
+    rmtree(tmp)
+settings=convbgl.scensettings(output)
+
+convtess.trace=[]
+bgls=0
+for (dirpath, dirnames, filenames) in output.inventory.walk(fspath):
+    for filename in filenames:
+        if filename.lower().endswith('.bgl'):
+            bglname=join(dirpath, filename)
+            readbgl(bglname, fspath, convbgl.bgltexdir(bglname, output.inventory), convbgl.AreaResult(settings), output.bglexe, convbgl.AreaScen)
+            bgls+=1
+jobs=convtess.trace
+convtess.trace=None
+print '%d polygons in %d BGLs' % (len(jobs), bgls)
+
+times=[0,0]
+failed=[0,0]
+approx=0
+differ=0
+for tess in jobs:
+    results=[]
+    for native in [False, True]:
+        (prims, moved, t)=run(tess, native)
+        times[native]+=t
+        if prims is None:
+            failed[native]+=1
+            results.append(None)
+        elif moved:
+            results.append(False)
+        else:
+            results.append(area(tess, prims))
+    if [r for r in results if r is False]:
+        approx+=1	# caller doesn't want crossings, so can't compare areas
+    elif results[0]!=results[1] and (None in results or abs(results[0]-results[1])>1e-6*max(results[0],results[1],1e-300)):
+        differ+=1
+print 'GLU:    %8.3fs, %d failed' % (times[0], failed[0])
+print 'Native: %8.3fs, %d failed' % (times[1], failed[1])
+print '%d polygons not compared because they cross themselves' % approx
+print '%d polygons differ' % differ
@@ -1,23 +1,20 @@
+from copy import copy
+from itertools import chain, izip
 from math import acos, atan, atan2, cos, fmod, floor, hypot, pow, sin, pi, radians, degrees
-from numpy import array, array_equal
+from numpy import array, array_equal, asarray, column_stack, empty, float32, frombuffer
 from os import listdir
 from os.path import basename, dirname, exists, join, normpath, pardir, splitext
 import struct
-from struct import unpack
 from sys import maxint
+from timeit import default_timer
 from traceback import print_exc
 import types
 
-from OpenGL.GL import GL_LINE_LOOP, GL_TRUE, GLfloat
-from OpenGL.GLU import *
-try:
-    # apparently older PyOpenGL version didn't define gluTessVertex
-    gluTessVertex
-except NameError:
-    from OpenGL import GLU
-    gluTessVertex = GLU._gluTessVertex
+from convtess import *
 
-from convutil import cirp, m2f, complexity, asciify, unicodeify, normalize, rgb2uv, cross, dot, AptNav, Object, Material, Texture, Point, Matrix, FS2XError, unique, groundfudge, effects
+from convclip import addholes, area2, cliptiles, tilebounds
+from convsimplify import simplify
+from convutil import cirp, m2f, complexity, asciify, unicodeify, normalize, rgb2uv, cross, dot, AptNav, Object, Material, Texture, Point, Polygon, Matrix, BGLFile, OpProfile, FS2XError, unique, storeobj, groundfudge, planarfudge, simplifyfudge, effects
 from convobjs import makegenquad, makegenmulti
 from convtaxi import taxilayout, Node, Link
 from convphoto import blueskyre
@@ -78,15 +75,15 @@ class TaxiwayName:
         self.name=name
         
                  
-# Read BGL header
+# Read BGL header. texdir is as returned by bgltexdir, and scen is the
+# ProcScen class to interpret areas with
 class Parse:
-    def __init__(self, bgl, srcfile, output):
+    def __init__(self, bgl, srcfile, output, texdir, scen=None):
         if output.debug: output.debug.write('\nFile: %s\n' % srcfile.encode("latin1",'replace'))
         name=basename(srcfile)
-        texdir=None
         for section in [42,46,54,58,102,114]:
             bgl.seek(section)
-            (secbase,)=unpack('<I',bgl.read(4))
+            (secbase,)=bgl.unpack('<I')
             if secbase:
                 bgl.seek(secbase)
                 if section==42 or section==46:
@@ -101,69 +98,27 @@ class Parse:
                     old=False
                     rrt=False
                     anim=False
-                    first=True
                     gencache={}	# cache of generic building names, by args
-                    objcache=[]	# objects generated in this BGL, for dupe detection
-                    if not texdir:
-                        texdir=normpath(join(dirname(srcfile), pardir))
-                        # For case-sensitive filesystems
-                        for d in listdir(texdir):
-                            if d.lower()=='texture':
-                                texdir=maketexdict(join(texdir, d))
-                                break
-                        else:
-                            texdir=None
-                    while True:
-                        # LatBand
-                        posl=bgl.tell()
-                        (c,)=unpack('<B', bgl.read(1))
-                        if not c in [0, 21]:
-                            if output.debug: output.debug.write("!Bogus LatBand %2x\n" % c)
-                            raise struct.error	# wtf?
-                        if c==0:
-                            break
-                        (foo,off)=unpack('<Ii', bgl.read(8))
-                        bgl.seek(secbase+off)
-                        while True:
-                            # Header
-                            posa=bgl.tell()
+                    if output.areapool:
+                        areas=poolareas(bgl, secbase, srcfile, texdir, output, gencache)
+                    else:
+                        areas=runareas(bgl, secbase, srcfile, texdir, output, gencache, scen or ProcScen)
+                    for (posa, flags) in areas:
+                        if not flags:
+                            output.log("Can't parse area %x in file %s" % (posa, name))
+                            continue
+                        if flags[0]:
+                            old=True
                             if __debug__:
-                                if output.debug: output.debug.write("----\nArea %x\n" % posa)
-                            (c,)=unpack('<B', bgl.read(1))
-                            bgl.read(9)
-                            if c==0:
-                                break
-                            elif c in [6,9,12,14]:
-                                (l,)=unpack('<I',bgl.read(4))
-                            elif c in [5,8,11,13]:
-                                (l,)=unpack('<H',bgl.read(2))
-                            elif c in [4,7,10]:
-                                (l,)=unpack('<B',bgl.read(1))
-                            else:
-                                if output.debug: output.debug.write("!Bogus area type %x\n"%c)
-                                raise struct.error	# wtf?
-                            try:
-                                output.refresh()
-                                p=ProcScen(bgl, posa+l, 1.0, None, srcfile, texdir, output, firstarea=first, gencache=gencache, objcache=objcache)
-                                if p.old:
-                                    old=True
-                                    if __debug__:
-                                        if output.debug: output.debug.write("Pre-FS2002\n")
-                                if p.rrt:
-                                    rrt=True
-                                    if __debug__:
-                                        if output.debug: output.debug.write("Old-style rr\n")
-                                if p.anim:
-                                    anim=True
-                                    if __debug__:
-                                        if output.debug: output.debug.write("Animation\n")
-                                first=False
-                            except:
-                                output.log("Can't parse area %x in file %s" % (posa, name))
-                                if output.debug: print_exc(None, output.debug)
-                                    
-                            bgl.seek(posa+l)
-                        bgl.seek(posl+9)
+                                if output.debug: output.debug.write("Pre-FS2002\n")
+                        if flags[1]:
+                            rrt=True
+                            if __debug__:
+                                if output.debug: output.debug.write("Old-style rr\n")
+                        if flags[2]:
+                            anim=True
+                            if __debug__:
+                                if output.debug: output.debug.write("Animation\n")
                     if anim:
                         output.log("Skipping animation in file %s" % name)
                     if old:
@@ -175,13 +130,13 @@ class Parse:
                     while True:
                         # LatBand
                         posl=bgl.tell()
-                        (c,)=unpack('<B', bgl.read(1))
+                        (c,)=bgl.unpack('<B')
                         if not c in [0, 21]:
                             if output.debug: output.debug.write("!Bogus LatBand %2x\n" % c)
                             raise struct.error	# wtf?
                         if c==0:
                             break
-                        (foo,off)=unpack('<Ii', bgl.read(8))
+                        (foo,off)=bgl.unpack('<Ii')
                         bgl.seek(secbase+off)
                         try:
                             ProcMisc(bgl, srcfile, output)
@@ -190,9 +145,89 @@ class Parse:
                         bgl.seek(posl+9)
 
 
+# Operand decoders for variable-length opcodes. Each returns the parsed
+# operands, leaving bgl at the next instruction.
+
+def reslist(bgl, cmd):		# 1a
+    (index,count)=bgl.unpack('<2H')
+    return (index, [bgl.unpack('<3h') for i in range(count)])
+
+def taximarkings(bgl, cmd):		# 1f:TaxiMarkings
+    (size,)=bgl.unpack('<H')
+    bgl.seek(size-4,1)
+    return ()
+
+def facet(bgl, cmd):		# 1d:Face, 2a:GFaceT, 3e:FaceT
+    (count,)=bgl.unpack('<H')
+    if cmd==0x1d: bgl.read(6)	# point
+    (fnx,fny,fnz)=bgl.unpack('<3h')
+    if cmd!=0x1d: bgl.read(4)	# dot_ref
+    return (fnx/32767.0, fny/32767.0, fnz/32767.0, bgl.unpack('<%dH' % count))
+
+def facettmap(bgl, cmd):	# 20:FaceTTMap, 7a:GFaceTTMap
+    (count,fnx,fny,fnz,)=bgl.unpack('<H3h')
+    bgl.read(4)
+    return (fnx/32767.0, fny/32767.0, fnz/32767.0, [bgl.unpack('<H2h') for i in range(count)])
+
+def greslist(bgl, cmd):		# 29
+    (index,count)=bgl.unpack('<2H')
+    return (index, [bgl.unpack('<6h') for i in range(count)])
+
+def texture2(bgl, cmd):		# 43
+    (size,dummy,flags,dummy,dummy)=bgl.unpack('<HHBBI')
+    tex=bgl.read(size-12)
+    # This is often incorrectly implemented - texture name can overrun. So read on up to first non-null.
+    while '\0' not in tex:
+        # Hope we're not at end of area - cos this will overrun.
+        c=bgl.read(1)
+        if not c: raise struct.error
+        tex=tex+c
+    return (flags, tex.split('\0')[0].rstrip())
+
+def ifvis(bgl, cmd):		# 62:IfVis, 70:AreaSense
+    (off,count)=bgl.unpack('<hH')
+    bgl.seek((cmd==0x70 and 4 or 2)*count,1)	# skip
+    return ()
+
+def vertexlist(bgl, cmd):	# b5
+    (count,)=bgl.unpack('<H')
+    bgl.read(4)
+    data=bgl.read(32*count)
+    if len(data)<32*count: raise struct.error
+    return (frombuffer(data, '<f4').astype(float).reshape(count, 8),)	# array of (x,y,z, nx,ny,nz, tu,tv)
+
+def materiallist(bgl, cmd):	# b6
+    (count,dummy)=bgl.unpack('<HI')
+    mats=[]
+    for i in range(count):
+        (dr,dg,db,da, ar,ag,ab,aa)=bgl.unpack('<8f')
+        bgl.read(16*2+4)	# specular, emissive ignored according to BGLFP.doc; specular power
+        mats.append((ar,ag,ab,da))
+    return (mats,)
+
+def texturelist(bgl, cmd):	# b7
+    (count,)=bgl.unpack('<H')
+    bgl.read(4)
+    texs=[]
+    for i in range(count):
+        (cls,)=bgl.unpack('<I')
+        bgl.read(12)
+        texs.append((cls, bgl.read(64).rstrip(' \0')))
+    return (texs,)
+
+def drawtrilist(bgl, cmd):	# b9
+    (vbase,vcount,icount)=bgl.unpack('<3H')
+    return (vbase, vcount, bgl.unpack('<%dH' % icount))
+
+def drawlinelist(bgl, cmd):	# ba
+    (base,vcount,icount)=bgl.unpack('<3H')
+    bgl.seek(2*icount,1)
+    return ()
+
+
 # handle section 9 area and 10 library. libname!=None if this is a library
 class ProcScen:
-    def __init__(self, bgl, enda, scale, libname, srcfile, texdir, output, scen=None, tran=None, firstarea=True, gencache=None, objcache=None):
+    def __init__(self, bgl, enda, scale, libname, srcfile, texdir, output, scen=None, tran=None, firstarea=True, gencache=None):
 
         self.old=False	# Old style scenery found and skipped
         self.rrt=False	# Old style runways/roads found and skipped
@@ -214,26 +249,25 @@ class ProcScen:
         self.output=output
         self.firstarea=firstarea
         self.gencache=gencache
-        self.objcache=objcache
 
         self.start=bgl.tell()
         if tran: self.tran=self.start+tran	# Location of TRAN table
         if scen:
             # Decode SCEN table
             bgl.seek(self.start+scen)
-            (count,)=unpack('<H', bgl.read(2))
+            (count,)=bgl.unpack('<H')
             scen=self.start+scen+2
             self.scen=[None for i in range(count)]
             for i in range(count):
                 bgl.seek(scen+i*12)
-                (out,child,peer,size,offset)=unpack('<hhhhi', bgl.read(12))
+                (out,child,peer,size,offset)=bgl.unpack('<hhhhi')
                 # Child and Peer are offsets; convert to scene nos
                 if child!=-1:
                     bgl.seek(scen+child*12)
-                    (child,)=unpack('<h',bgl.read(2))
+                    (child,)=bgl.unpack('<h')
                 if peer!=-1:
                     bgl.seek(scen+peer*12)
-                    (peer,)=unpack('<h',bgl.read(2))
+                    (peer,)=bgl.unpack('<h')
                 # Convert offsets to file positions
                 self.scen[out]=(child, peer, size, scen+i*12+offset, -1)
             # Invert Child/Peer pointers to get parents
@@ -252,7 +286,7 @@ class ProcScen:
                 for i in range(count):
                     (child,peer,size,posa,parent)=self.scen[i]
                     bgl.seek(posa)
-                    (cmd,src,dst)=unpack('<3H', bgl.read(6))
+                    (cmd,src,dst)=bgl.unpack('<3H')
                     c="%2d: %2d %2d %2d -> %2x " %(i, child, peer, parent, cmd)
                     if cmd==0xc6 and size==6:
                         c+="%2d %2d\n" % (src, dst)
@@ -267,7 +301,7 @@ class ProcScen:
                 for i in range(count):
                     m=[]
                     for j in range(4):
-                        (a,b,c,d)=unpack('<4f', bgl.read(16))
+                        (a,b,c,d)=bgl.unpack('<4f')
                         m.append([a,b,c,d])
                     self.debug.write("%s = %d\n" % (Matrix(m), i))
             bgl.seek(self.start)
@@ -304,8 +338,16 @@ class ProcScen:
         self.effectdat={}	# ((x,y,z), (effect, s)) by (name, loc, layer, alt, altmsl, matrix, scale, None)
         self.keys=[]		# ordered list of keys for indexing the above
         self.polydat=[]		# ((points, layer, heading, scale, Texture))
+        self.vertices=0		# Generated geometry, for OpProfile
+        self.polygons=0
+        self.vtxgen=0		# Bumped when vtx changes
+        self.memo={}		# (events, exit state, entry tex & mat) or None by (target, entry state) - see enter()
+        self.rec=None		# [key, stack depth, pure?, events, keep] while recording a call
 
         self.neednight=False
+        self.nightread=False	# Day pass has just read the time of day
+        self.nightfork=None	# (position, state) to resume the night pass from - see fork()
+        self.nightmark=0	# Polygons generated by the night pass start here
         self.dayloc=None
         self.dayobjdat={}        
         self.daylightdat={}        
@@ -345,119 +387,8 @@ class ProcScen:
             }
         self.setseason()
 
-        cmds={0x02:self.NOP,
-              0x05:self.Surface,
-              0x06:self.SPnt,
-              0x07:self.CPnt,
-              0x08:self.Closure,
-              0x0d:self.Jump,
-              0x0e:self.DefRes,
-              0x0f:self.StrRes,
-              0x10:self.CntRes,    
-              0x14:self.SColor,
-              0x17:self.TextureEnable,
-              0x18:self.Texture,
-              0x1a:self.ResList,
-              0x1b:self.Jump,
-              0x1c:self.IfIn2,
-              0x1d:self.FaceT,
-              0x1e:self.Haze,
-              0x1f:self.TaxiMarkings,
-              0x20:self.FaceTTMap,
-              0x21:self.IfIn3,
-              0x22:self.Return,
-              0x23:self.Call,
-              0x24:self.IfIn1,
-              0x25:self.SeparationPlane,
-              0x26:self.SetWrd,
-              0x29:self.GResList,
-              0x2a:self.FaceT,
-              0x2b:self.Call32,
-              0x2d:self.SColor24,
-              0x2e:self.LColor24,
-              0x2f:self.Scale,
-              0x30:self.NOPh,
-              0x32:self.Call,
-              0x33:self.Instance,
-              0x34:self.SuperScale,
-              0x35:self.PntRow,
-              0x37:self.Point,
-              0x38:self.Concave,
-              0x39:self.IfMsk,
-              0x3b:self.VInstance,
-              0x3c:self.Position,
-              0x3e:self.FaceT,
-              0x40:self.ShadowVPosition,
-              0x42:self.TextureRunway,
-              0x43:self.Texture2,
-              0x44:self.TextureRunway,
-              0x4c:self.VScale,
-              0x4d:self.MoveL2G,
-              0x4e:self.MoveL2G,
-              0x46:self.PointVICall,
-              0x49:self.Building,
-              0x3f:self.NOPh,
-              0x50:self.SColor,
-              0x51:self.LColor,
-              0x52:self.SColor,
-              0x55:self.SurfaceType,
-              0x5d:self.TextureRepeat,
-              0x5f:self.IfSizeV,
-              0x62:self.IfVis,
-              0x63:self.LibraryCall,
-              0x69:self.RoadStart,
-              0x6a:self.RoadCont,
-              0x6b:self.RiverStart,
-              0x6c:self.RiverCont,
-              0x6d:self.IfSizeV,
-              0x6e:self.TaxiwayStart,
-              0x6f:self.RoadCont,
-              0x70:self.AreaSense,
-              0x73:self.Jump,
-              0x74:self.AddCat,
-              0x75:self.Call,
-              0x76:self.NOP,
-              0x77:self.ScaleAGL,
-              0x7a:self.FaceTTMap,
-              0x7d:self.NOP,
-              0x80:self.ResPnt,
-              0x81:self.NOPh,
-              0x83:self.ReScale,
-              0x88:self.Jump32,
-              0x89:self.NOPi,
-              0x8a:self.Call32,
-              0x8b:self.AddCat32,
-              0x8f:self.NOPi,
-              0x93:self.NOPh,
-              0x95:self.CrashIndirect,
-              0x96:self.CrashStart,
-              0x9e:self.Interpolate,
-              0x9f:self.NOPi,
-              0xa0:self.Object,
-              0xa4:self.NOPh,
-              0xa6:self.TargetIndicator,
-              0xa7:self.SpriteVICall,
-              0xa8:self.TextureRoadStart,
-              0xaa:self.NewRunway,
-              0xad:self.Animate,
-              0xae:self.TransformEnd,
-              0xac:self.ZBias,
-              0xaf:self.TransformMatrix,
-              0xb1:self.Tag,
-              0xb2:self.Light,
-              0xb3:self.IfInF1,
-              0xb4:self.NOPi,
-              0xb5:self.VertexList,
-              0xb6:self.MaterialList,
-              0xb7:self.TextureList,
-              0xb8:self.SetMaterial,
-              0xb9:self.DrawTriList,
-              0xba:self.DrawLineList,
-              0xbc:self.NOPi,
-              0xbd:self.NOP,
-              0xc4:self.SetMatrixIndirect,
-              }
-
+        code=bgl.code	# decoded instructions for this file, shared by all areas and calls
+        prof=output.opprof
         while True:
             pos=bgl.tell()
             if pos>=self.enda:
@@ -466,12 +397,14 @@ class ProcScen:
             elif pos<self.start:
                 # Underrun - just return if in a call eg ESGJ2K2
                 self.cmd=0x22
+                (handler, ops, nextpos)=(ProcScen.opcodes[0x22][0], (), pos)
                 if self.debug: self.debug.write("!Underrun at %x start=%x\n" % (pos, self.start))
+            elif pos in code:
+                (self.cmd, handler, ops, nextpos)=code[pos]
             else:
-                (self.cmd,)=unpack('<H',bgl.read(2))
+                (self.cmd, handler, ops, nextpos)=code[pos]=self.decode()
             if self.cmd==0 or (self.cmd==0x22 and not self.stack):
                 if self.donight():
-                    bgl.seek(self.start)
                     continue
                 self.makeobjs()
                 if self.debug:
@@ -481,13 +414,26 @@ class ProcScen:
                         self.debug.write("!Unbalanced matrix:\n%s\n" % (
                             self.matrix[i]))
                 return
-            elif self.cmd in cmds:
+            elif handler:
                 if __debug__:
                     if self.debug: self.debug.write("%x: cmd %02x %s\n" % (
-                        pos, self.cmd, cmds[self.cmd].__name__))
-                cmds[self.cmd]
+                        pos, self.cmd, handler.__name__))
+                if self.rec and not handler in ProcScen.memopure:
+                    self.rec[2]=False
+                if nextpos is None:	# handler reads its own operands
+                    bgl.seek(pos+2)
+                    ops=()
+                else:
+                    bgl.seek(nextpos)
+                if prof:
+                    (t, vertices, polygons)=(default_timer(), self.vertices, self.polygons)
+                    handler(self, *ops)
+                    prof.add(self.srcfile, self.cmd, handler.__name__, default_timer()-t, (nextpos or bgl.tell())-pos, self.vertices-vertices, self.polygons-polygons)
+                else:
+                    handler(self, *ops)
+                if self.nightread:
+                    self.branchnight(handler, ops, nextpos)
             elif self.donight():
-                bgl.seek(self.start)
                 continue
             else:
                 self.makeobjs()	# Try to go with what we've got so far
@@ -495,16 +441,75 @@ class ProcScen:
                 raise struct.error
 
 
+    # Decode the instruction at the current position into
+    # (opcode, handler, operands, next position)
+    def decode(self):
+        (cmd,)=self.bgl.unpack('<H')
+        if not cmd in ProcScen.opcodes:
+            return (cmd, None, None, None)
+        (handler, fmt)=ProcScen.opcodes[cmd]
+        if fmt is None:
+            return (cmd, handler, None, None)
+        elif isinstance(fmt, str):
+            ops=self.bgl.unpack(fmt)
+        else:
+            ops=fmt(self.bgl, cmd)
+        return (cmd, handler, ops, self.bgl.tell())
+
+    # The day pass has just read the time of day. If this is a conditional
+    # whose outcome differs at night then fork the night pass here, otherwise
+    # carry on. Anything else that reads it needs a full night pass.
+    def branchnight(self, handler, ops, nextpos):
+        self.nightread=False
+        if not handler in ProcScen.branches:
+            self.neednight=True	# with no nightfork
+            return
+        daypos=self.bgl.tell()
+        self.vars[0x28c]=4
+        self.bgl.seek(nextpos)
+        handler(self, *ops)
+        nightpos=self.bgl.tell()
+        self.vars[0x28c]=1
+        self.bgl.seek(daypos)
+        if nightpos!=daypos:
+            self.fork(nightpos)
+
+    # Snapshot interpreter state for the night pass to resume from at pos.
+    # Everything generated so far is common to day and night.
+    def fork(self, pos):
+        if __debug__:
+            if self.debug: self.debug.write("Fork night at %x\n" % pos)
+        state=dict(self.__dict__)
+        for k in ProcScen.shared: state.pop(k, None)
+        for k in ['stack', 'matrix', 'tex', 'mat', 'vtx', 'idx', 'nodes', 'links', 'polydat']:
+            state[k]=copy(state[k])
+        for k in ['objdat', 'lightdat', 'effectdat']:
+            state[k]=dict([(key, list(v)) for (key, v) in state[k].iteritems()])
+        state['vars']=dict(self.vars)
+        state['vars'][0x28c]=4
+        self.nightfork=(pos, state)
+        self.neednight=True
+
     def donight(self):
         if self.neednight and self.vars[0x28c]==1:
             if __debug__:
                 if self.debug: self.debug.write("Night\n")
-            self.vars[0x28c]=4
             self.dayloc=self.loc
             self.dayobjdat=self.objdat
             self.daylightdat=self.lightdat
             self.dayeffectdat=self.effectdat
             self.daypolydat=self.polydat
+            self.vtxgen+=1
+            self.rec=None
+            if self.nightfork:
+                (pos, state)=self.nightfork
+                self.nightfork=None
+                self.__dict__.update(state)
+                self.nightmark=len(self.polydat)
+                self.bgl.seek(pos)
+                return True
+            # Otherwise interpret the whole area again
+            self.vars[0x28c]=4
             self.objdat={}
             self.lightdat={}
             self.effectdat={}
@@ -532,6 +537,8 @@ class ProcScen:
             self.haze=0		# Whether palette-based transparency. 0=none
             self.zbias=0	# Polygon offsetting
             self.concave=False
+            self.nightmark=0
+            self.bgl.seek(self.start)
             return True
         return False
 
@@ -568,12 +575,7 @@ class ProcScen:
     def Surface(self):		# 05
         self.surface=True	# StrRes/CntRes does surface not lines
 
-    def SPnt(self):		# 06
-        (sx,sy,sz)=unpack('<hhh', self.bgl.read(6))
-        self.old=True
-
-    def CPnt(self):		# 07
-        (cx,cy,cz)=unpack('<hhh', self.bgl.read(6))
+    def SPnt(self):		# 06:SPnt, 07:CPnt
         self.old=True
 
     def Closure(self):		# 08
@@ -589,7 +591,7 @@ class ProcScen:
         self.idx=[]
         self.surface=False
         (key,mat)=self.makekey()
-        if not key in self.objdat and self.makepoly(False, vtx):	# don't generate poly if there's already geometry here
+        if self.trypoly(key, False, vtx):	# don't generate poly if there's already geometry here
             return
         if self.concave:
             (vtx,idx)=subdivide(vtx)
@@ -606,42 +608,33 @@ class ProcScen:
         if dot((x,y,z), (nx,ny,nz))>0:	# arbitrary normal from last point
             idx.reverse()
         mat.poly=True	# This command sort-of implies ground-level
-        if not key in self.objdat:
-            self.objdat[key]=[]
-            self.keys.append(key)
-        self.objdat[key].append((mat, vtx, idx))
+        self.addtris(key, mat, vtx, idx)
         self.checkmsl()
         
-    def Jump(self):		# 0d, 1b: IfInBoxRawPlane, 73: IfInBoxP
-        (off,)=unpack('<h', self.bgl.read(2))
+    def Jump(self, off):	# 0d, 1b: IfInBoxRawPlane, 73: IfInBoxP
         if not off: raise struct.error	# infloop
         self.bgl.seek(off-4,1)
 
-    def DefRes(self):		# 0e
-        (i)=unpack('<H',self.bgl.read(2))
-        self.vtx[i]=unpack('<3h', self.bgl.read(6))+(0,1,0,0,0)
+    def DefRes(self, i, x, y, z):	# 0e
+        self.vtx[i]=(x,y,z,0,1,0,0,0)
+        self.vtxgen+=1
 
-    def StrRes(self):		# 0f
-        (i,)=unpack('<H',self.bgl.read(2))
+    def StrRes(self, i):	# 0f
         self.idx=[i]
 
-    def CntRes(self):		# 10
-        (i,)=unpack('<H',self.bgl.read(2))
+    def CntRes(self, i):	# 10
         self.idx.append(i)	# wait for closure
         
-    def SColor(self):	# 14:Scolor, 50:GColor, 52:NewSColor
-        (c,)=unpack('H', self.bgl.read(2))
+    def SColor(self, c):	# 14:Scolor, 50:GColor, 52:NewSColor
         self.mat=[Material(self.output.xpver, self.unicol(c))]
         self.m=0
         
-    def TextureEnable(self):	# 17
-        (c,)=unpack('<H', self.bgl.read(2))
+    def TextureEnable(self, c):	# 17
         if not c: self.t=None
 
-    def Texture(self):		# 18
+    def Texture(self, c1, x, c2, y, tex):	# 18
         self.surface=True	# StrRes/CntRes does surface not lines
-        (c,x,c,y)=unpack('<4h', self.bgl.read(8))
-        tex=self.bgl.read(14).rstrip(' \0')
+        tex=tex.rstrip(' \0')
         l=tex.find('.')
         if l!=-1:	# Sometimes formatted as 8.3 with spaces
             tex=tex[:l].rstrip(' \0')+tex[l:]
@@ -653,23 +646,16 @@ class ProcScen:
                 self.debug.write("%s\n" % self.tex[0])
                 if x or y: self.debug.write("!Tex offsets %d,%d\n" % (x,y))
         
-    def ResList(self):		# 1a
-        (index,count)=unpack('<2H', self.bgl.read(4))
-        for i in range(index,index+count):
-            self.vtx[i]=unpack('<3h', self.bgl.read(6))+(0,1,0,0,0)
-
-    def IfInBoxRawPlane(self):	# 1b
-        # Skip
-        (off,)=unpack('<h', self.bgl.read(2))
-        if not off: raise struct.error	# infloop
-        self.bgl.seek(off-4,1)
-        
-    def IfIn2(self):		# 1c
-        var=[0,0]
-        mins=[0,0]
-        maxs=[0,0]
-        (off, var[0], mins[0], maxs[0],
-         var[1], mins[1], maxs[1])=unpack('<7h', self.bgl.read(14))
+    def ResList(self, index, pts):	# 1a
+        self.vtxgen+=1
+        for i in range(len(pts)):
+            (x,y,z)=pts[i]
+            self.vtx[index+i]=(x,y,z,0,1,0,0,0)
+
+    def IfIn2(self, off, var0, min0, max0, var1, min1, max1):	# 1c
+        var=[var0,var1]
+        mins=[min0,min1]
+        maxs=[max0,max1]
         for i in range(2):
             if var[i]==0x346:
                 self.complexity=complexity(mins[i])
@@ -680,26 +666,18 @@ class ProcScen:
                 self.bgl.seek(off-22,1)
                 break
 
-    def Haze(self):		# 1e:Haze
-        (self.haze,)=unpack('<H', self.bgl.read(2))
+    def Haze(self, haze):	# 1e:Haze
+        self.haze=haze
         
     def TaxiMarkings(self):	# 1f
         # ignored - info should now be in FS2004-style BGL
         self.rrt=True
-        (size,)=unpack('<H', self.bgl.read(2))
-        self.bgl.seek(size-4,1)
         
-    def FaceTTMap(self):	# 20:FaceTTMap, 7a:GFaceTTMap
-        (count,fnx,fny,fnz,)=unpack('<H3h', self.bgl.read(8))
-        if count<=4: self.concave=False	# Don't bother
-        fnx /= 32767.0
-        fny /= 32767.0
-        fnz /= 32767.0
-        self.bgl.read(4)
+    def FaceTTMap(self, fnx, fny, fnz, pts):	# 20:FaceTTMap, 7a:GFaceTTMap
+        if len(pts)<=4: self.concave=False	# Don't bother
         vtx=[]
         maxy=-maxint
-        for i in range(count):
-            (idx,tu,tv)=unpack('<H2h', self.bgl.read(6))
+        for (idx,tu,tv) in pts:
             (x,y,z,nx,ny,nz,c,c)=self.vtx[idx]
             maxy=max(maxy,y)
             if self.billboard:
@@ -713,7 +691,7 @@ class ProcScen:
                 if self.debug: self.debug.write("Photoscenery\n")
             return	# handled in ProcPhoto
         (key,mat)=self.makekey()
-        if not key in self.objdat and self.makepoly(True, vtx):	# don't generate poly if there's already geometry here
+        if self.trypoly(key, True, vtx):	# don't generate poly if there's already geometry here
             return
         if self.concave:
             (vtx,idx)=subdivide(vtx)
@@ -731,19 +709,13 @@ class ProcScen:
             idx.reverse()
         if maxy+self.alt <= groundfudge:
             mat.poly=True
-        if not key in self.objdat:
-            self.objdat[key]=[]
-            self.keys.append(key)
-        self.objdat[key].append((mat, vtx, idx))
+        self.addtris(key, mat, vtx, idx)
         self.checkmsl()
         
-    def IfIn3(self):		# 21
-        var=[0,0,0]
-        mins=[0,0,0]
-        maxs=[0,0,0]
-        (off, var[0], mins[0], maxs[0],
-         var[1], mins[1], maxs[1],
-         var[2], mins[2], maxs[2])=unpack('<10h', self.bgl.read(20))
+    def IfIn3(self, off, var0, min0, max0, var1, min1, max1, var2, min2, max2):	# 21
+        var=[var0,var1,var2]
+        mins=[min0,min1,min2]
+        maxs=[max0,max1,max2]
         for i in range(3):
             if var[i]==0x346:
                 self.complexity=complexity(mins[i])
@@ -761,15 +733,14 @@ class ProcScen:
             if __debug__:
                 if self.debug: self.debug.write("Now\n%s\n" % self.matrix[-1])
         self.bgl.seek(off)
+        if self.rec and len(self.stack)<self.rec[1]: self.endrec()
 
-    def Call(self):		# 23:Call, 32:PerspectiveCall/AddObj, 75:AddMnt
-        (off,)=unpack('<h', self.bgl.read(2))
+    def Call(self, off):	# 23:Call, 32:PerspectiveCall/AddObj, 75:AddMnt
         if not off: raise struct.error	# infloop
         self.precall(False)
-        self.bgl.seek(off-4,1)
+        self.enter(off-4)
 
-    def IfIn1(self):		# 24
-        (off, var, vmin, vmax)=unpack('<4h', self.bgl.read(8))
+    def IfIn1(self, off, var, vmin, vmax):	# 24
         if vmin>vmax:	# Sigh. Seen in TFFR
             foo=vmax
             vmax=vmin
@@ -787,35 +758,27 @@ class ProcScen:
             if not off: raise struct.error	# infloop
             self.bgl.seek(off-10,1)
 
-    def SeparationPlane(self):	# 25
+    def SeparationPlane(self, off, nx, ny, nz, dist):	# 25
         # Used for animating distance. Skip
-        (off,nx,ny,nz,dist)=unpack('<4hi', self.bgl.read(12))
+        pass
         #self.precall(self.matrix[-1])
         #self.bgl.seek(off-14,1)
 
-    def SetWrd(self):		# 26
-        (var,val)=unpack('<2h',self.bgl.read(4))
+    def SetWrd(self, var, val):	# 26
         self.vars[var]=val
 
-    def GResList(self):		# 29
-        (index,count)=unpack('<2H', self.bgl.read(4))
-        for i in range(index,index+count):
-            (x,y,z,nx,ny,nz)=unpack('<6h', self.bgl.read(12))
-            self.vtx[i]=(x,y,z, nx/32767.0,ny/32767.0,nz/32767.0, 0,0)
+    def GResList(self, index, pts):	# 29
+        self.vtxgen+=1
+        for i in range(len(pts)):
+            (x,y,z,nx,ny,nz)=pts[i]
+            self.vtx[index+i]=(x,y,z, nx/32767.0,ny/32767.0,nz/32767.0, 0,0)
 
-    def FaceT(self):		# 1d:Face, 2a:GFaceT, 3e:FaceT
-        (count,)=unpack('<H', self.bgl.read(2))
-        if self.cmd==0x1d: self.bgl.read(6)	# point
-        (fnx,fny,fnz)=unpack('<3h', self.bgl.read(6))
+    def FaceT(self, fnx, fny, fnz, idxs):	# 1d:Face, 2a:GFaceT, 3e:FaceT
+        count=len(idxs)
         if count<=4: self.concave=False	# Don't bother
-        fnx /= 32767.0
-        fny /= 32767.0
-        fnz /= 32767.0
-        if self.cmd!=0x1d: self.bgl.read(4)	# dot_ref
         vtx=[]
         maxy=-maxint
-        for i in range(count):
-            (idx,)=unpack('<H', self.bgl.read(2))
+        for idx in idxs:
             (x,y,z,nx,ny,nz,c,c)=self.vtx[idx]
             maxy=max(maxy,y)
             if self.billboard:
@@ -826,7 +789,7 @@ class ProcScen:
                 vtx.append((x,y,z, fnx,fny,fnz, x*self.scale/256, z*self.scale/256))
         if count<3: return	# wtf?
         (key,mat)=self.makekey(self.cmd!=0x1d)
-        if not key in self.objdat and self.makepoly(False, vtx):	# don't generate poly if there's already geometry here
+        if self.trypoly(key, False, vtx):	# don't generate poly if there's already geometry here
             return
         if self.concave:
             self.concave=False
@@ -847,14 +810,10 @@ class ProcScen:
             idx.reverse()
         if maxy+self.alt <= groundfudge:
             mat.poly=True
-        if not key in self.objdat:
-            self.objdat[key]=[]
-            self.keys.append(key)
-        self.objdat[key].append((mat, vtx, idx))
+        self.addtris(key, mat, vtx, idx)
         self.checkmsl()
         
-    def SColor24(self):		# 2d: SColor24
-        (r,a,g,b)=unpack('4B', self.bgl.read(4))
+    def SColor24(self, r, a, g, b):	# 2d: SColor24
         if a==0xf0:	# unicol
             self.mat=[Material(self.output.xpver, self.unicol(0xf000+r))]
             self.m=0
@@ -867,8 +826,7 @@ class ProcScen:
             self.mat=[Material(self.output.xpver, (r/255.0,g/255.0,b/255.0))]
             self.m=0
         
-    def LColor24(self):		# 2e: SColor24
-        (r,a,g,b)=unpack('4B', self.bgl.read(4))
+    def LColor24(self, r, a, g, b):	# 2e: SColor24
         if a==0xf0:	# unicol
             self.lightcol=self.unicol(0xf000+r)
         elif (0xb0 <= a <= 0xb7) or (0xe0 <= a <= 0xe7):
@@ -881,7 +839,7 @@ class ProcScen:
     def Scale(self):		# 2f
         self.makename()
         self.bgl.read(8)	# jump,range (LOD) (may be 0),size,reserved
-        (scale,)=unpack('<I', self.bgl.read(4))
+        (scale,)=self.bgl.unpack('<I')
         self.scale=65536.0/scale
         (lat,lon,self.altmsl)=self.LLA()
         self.alt=0
@@ -897,8 +855,7 @@ class ProcScen:
                 if self.debug: self.debug.write("!Bogus Location %s\n" % Point(lat,lon))
             self.loc=None
 
-    def Instance(self):		# 33
-        (off,p,b,h)=unpack('<h3H', self.bgl.read(8))
+    def Instance(self, off, p, b, h):	# 33
         if not off: raise struct.error	# infloop
         self.precall(True)
         p=p*360/65536.0
@@ -919,18 +876,15 @@ class ProcScen:
         self.matrix.append(newmatrix)
         if __debug__:
             if self.debug: self.debug.write("Now\n%s\n" % self.matrix[-1])
-        self.bgl.seek(off-10,1)
+        self.enter(off-10)
 
-    def SuperScale(self):	# 34
-        self.bgl.read(6)	# jump,range (LOD) (may be 0),size
-        (scale,)=unpack('<H', self.bgl.read(2))
+    def SuperScale(self, scale):	# 34
         if scale>31:
             self.scale=65536.0/self.getvar(scale)
         else:
             self.scale=1.0/pow(2,16-scale)
         
-    def PntRow(self):		# 35
-        (sx,sy,sz,ex,ey,ez,count)=unpack('<6hH', self.bgl.read(14))
+    def PntRow(self, sx, sy, sz, ex, ey, ez, count):	# 35
         if count>1:
             dx=(ex-sx)/(count-1.0)
             dy=(ey-sy)/(count-1.0)
@@ -938,20 +892,13 @@ class ProcScen:
         else:
             dx=dy=dz=0
         (key,mat)=self.makekey(False)
-        if not key in self.lightdat:
-            self.lightdat[key]=[]
-            self.keys.append(key)
         for i in range(count):
-            self.lightdat[key].append(((sx+i*dx,sy+i*dy,sz+i*dz), self.lightcol))
+            self.addlight(key, (sx+i*dx,sy+i*dy,sz+i*dz), self.lightcol)
         self.checkmsl()
         
-    def Point(self):		# 37
-        (x,y,z)=unpack('<3h', self.bgl.read(6))
+    def Point(self, x, y, z):	# 37
         (key,mat)=self.makekey(False)
-        if not key in self.lightdat:
-            self.lightdat[key]=[]
-            self.keys.append(key)
-        self.lightdat[key].append(((x,y,z), self.lightcol))
+        self.addlight(key, (x,y,z), self.lightcol)
         if __debug__:
             if self.debug: self.debug.write("%s %s\n" % ((x,y,z), self.lightcol))
         self.checkmsl()
@@ -959,16 +906,13 @@ class ProcScen:
     def Concave(self):		# 38
         self.concave=True
 
-    def IfMsk(self):		# 39
-        (off, var)=unpack('<2h', self.bgl.read(4))
-        (mask,)=unpack('<H', self.bgl.read(2))
+    def IfMsk(self, off, var, mask):	# 39
         val=self.getvar(var)
         if val&mask==0:
             if not off: raise struct.error	# infloop
             self.bgl.seek(off-8,1)
 
-    def VInstance(self):	# 3b
-        (off,var)=unpack('<hH', self.bgl.read(4))
+    def VInstance(self, off, var):	# 3b
         if not off: raise struct.error	# infloop
         self.precall(True)
         p=self.getvar(var)
@@ -989,7 +933,7 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("Now\n%s\n" % self.matrix[-1])
         self.matrix.append(newmatrix)
-        self.bgl.seek(off-6,1)
+        self.enter(off-6)
 
     def Position(self):		# 3c
         self.makename()
@@ -1018,9 +962,6 @@ class ProcScen:
             if self.debug: self.debug.write("!Bogus Location %s\n" % Point(lat,lon))
         self.checkmsl()
 
-    def ShadowVPosition(self):	# 40
-        self.bgl.read(10)	# ignore
-        
     def TextureRunway(self):	# 42: PolygonRunway, 44:TextureRunway
         # ignored - info should now be in FS2004-style BGL
         #self.old=True
@@ -1034,7 +975,7 @@ class ProcScen:
             if __debug__:
                 if self.debug: self.debug.write("!Bogus Runway location %s\n"%cloc)
             raise struct.error
-        (heading, length, width, markers, identifiers, surface_lights, specials, surface_type, threshold_flags, base_threshold, base_blast_pad, recip_threshold, recip_blast_pad)=unpack('<HHHBBBBBBHHHH', self.bgl.read(20))
+        (heading, length, width, markers, identifiers, surface_lights, specials, surface_type, threshold_flags, base_threshold, base_blast_pad, recip_threshold, recip_blast_pad)=self.bgl.unpack('<HHHBBBBBBHHHH')
         heading *= 360.0 / 65536
         length=length/m2f	# includes displaced threshold
         width=width/m2f
@@ -1087,7 +1028,7 @@ class ProcScen:
         tdzl=[0,0]
         reil=[0,0]
         for end in [0,1]:
-            (flags, system, strobes, vasi_system, vasi_angle, vasi_x, vasi_z, vasi_spacing)=unpack('<BBBBHHHH', self.bgl.read(12))
+            (flags, system, strobes, vasi_system, vasi_angle, vasi_x, vasi_z, vasi_spacing)=self.bgl.unpack('<BBBBHHHH')
             # ignore vasi - hope it's specified in XML
             if flags&5:
                 reil[end]=1
@@ -1112,15 +1053,9 @@ class ProcScen:
             tdzl[end], reil[end])
         self.output.misc.append((100, cloc, [AptNav(100, txt)]))
 
-    def Texture2(self):		# 43
+    def Texture2(self, flags, tex):	# 43
         self.surface=True	# StrRes/CntRes does surface not lines
-        (size,dummy,flags,dummy,dummy)=unpack('<HHBBI', self.bgl.read(10))
-        tex=self.bgl.read(size-12)
-        # This is often incorrectly implemented - texture name can overrun. So read on up to first non-null.
-        while '\0' not in tex:
-            # Hope we're not at end of area - cos this will overrun.
-            tex=tex+self.bgl.read(1)
-        tex=findtex(tex.split('\0')[0].rstrip(), self.texdir, self.output.addtexdir)
+        tex=findtex(tex, self.texdir, self.output.addtexdir)
         if tex and flags&128:
             (lit,ext)=splitext(tex)
             lit=findtex(lit+'_lm', self.texdir, self.output.addtexdir)
@@ -1131,8 +1066,7 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("%s\n" % self.tex[0])
         
-    def PointVICall(self):	# 46
-        (off,x,y,z,p,vp,b,vb,h,vh)=unpack('<4h6H', self.bgl.read(20))
+    def PointVICall(self, off, x, y, z, p, vp, b, vb, h, vh):	# 46
         if not off: raise struct.error	# infloop
         #if __debug__:
         #    if self.debug: self.debug.write("PointVICall %d %d %d %d %d %d %d %d %d\n" % (x,y,z,p,vp,b,vb,h,vh))
@@ -1156,11 +1090,9 @@ class ProcScen:
         self.matrix.append(newmatrix)
         if __debug__:
             if self.debug: self.debug.write("Now\n%s\n" % self.matrix[-1])
-        self.bgl.seek(off-22,1)
+        self.enter(off-22)
 
-    def Building(self):		# 49
-        (info,codes,x,y,z,stories,
-         size_x,size_z)=unpack('<8h', self.bgl.read(16))
+    def Building(self, info, codes, x, y, z, stories, size_x, size_z):	# 49
         incx=incz=0
         heights=[stories*4,0,0,4]
         texs=[0,0,0,0]
@@ -1180,53 +1112,35 @@ class ProcScen:
             incx=incz=pi*22.5/180
         else:
             roof=0
-        newobj=None
-        name="%s-generic-%d" % (asciify(basename(self.srcfile)[:-4]), len(self.gencount)+1)
         if typ==3:
-            foo=(8,size_x, size_z, tuple(heights), tuple(texs))
-            if foo in self.gencache:
-                name=self.gencache[foo]
-            else:
-                newobj=makegenmulti(name, self.output, *foo)
+            name=self.genericobj((8,size_x, size_z, tuple(heights), tuple(texs)))
         else:
-            foo=(size_x, size_z, incx, incz, tuple(heights), tuple(texs), roof)
-            if foo in self.gencache:
-                name=self.gencache[foo]
-            else:
-                newobj=makegenquad(name, self.output, *foo)
-        if newobj:
-            self.output.objdat[name]=[newobj]
-            self.gencache[foo]=name
+            name=self.genericobj((size_x, size_z, incx, incz, tuple(heights), tuple(texs), roof))
         if self.matrix[-1]:
             heading=self.matrix[-1].heading()	# not really
             # handle translation
-            loc=self.loc.biased(self.matrix[-1].m[3][0]*self.scale,
-                                -self.matrix[-1].m[3][2]*self.scale)
+            loc=self.loc.biased(self.matrix[-1].rows[3][0]*self.scale,
+                                -self.matrix[-1].rows[3][2]*self.scale)
         else:
             heading=0
             loc=self.loc
         self.output.objplc.append((loc, heading, self.complexity, name, 1))
             
-    def VScale(self):		# 4c
+    def VScale(self, scale, var):	# 4c
         # ignore and hope another command sets location
-        self.bgl.read(8)	# jump,range (LOD) (may be 0),size,reserved
-        (scale,var)=unpack('<Ih', self.bgl.read(6))
         self.scale=65536.0/scale
         self.loc=None
 
-    def MoveL2G(self):		# 4d:MoveL2G, 4e:MoveG2L
-        (to, fr)=unpack('<2H', self.bgl.read(4))
+    def MoveL2G(self, to, fr):	# 4d:MoveL2G, 4e:MoveG2L
         val=self.getvar(fr)
         self.vars[to]=val
         if __debug__:
             if self.debug: self.debug.write("%x<-%x = %d\n" % (to, fr, val))
         
-    def LColor(self):		# 51
-        (c,)=unpack('H', self.bgl.read(2))
+    def LColor(self, c):	# 51
         self.lightcol=self.unicol(c)
 
-    def SurfaceType(self):	# 55
-        (sfc, x, z, alt)=unpack('<Hhhh', self.bgl.read(8))
+    def SurfaceType(self, sfc, x, z, alt):	# 55
         if sfc!=0: return
         # Smooth surface
         if self.matrix[-1]:
@@ -1239,23 +1153,12 @@ class ProcScen:
             if self.debug: self.debug.write("SurfaceType %d (%dx%d) %d\n" % (
                 sfc, length, width, alt))
 
-    def TextureRepeat(self):	# 5d
-        (x,c,y)=unpack('<3h', self.bgl.read(6))
+    def TextureRepeat(self, x, c, y):	# 5d
         self.t=0
         if __debug__:
             if self.debug and (x or y): self.debug.write("!Tex offsets %d,%d\n" % (x,y))
         
-    def IfSizeV(self):		# 5f:IfSizeV, 6d:IfSizeH
-        # Go for max detail and let X-Plane remove based on it's own heuristics
-        (off, a, b)=unpack('<3h', self.bgl.read(6))
-
-    def IfVis(self):		# 62
-        # Go for max detail and let X-Plane remove based on it's own heuristics
-        (off, count)=unpack('<hH', self.bgl.read(4))
-        self.bgl.seek(2*count,1)
-
-    def LibraryCall(self):	# 63
-        (off,a,b,c,d)=unpack('<hIIII', self.bgl.read(18))
+    def LibraryCall(self, off, a, b, c, d):	# 63
         name="%08x%08x%08x%08x" % (a,b,c,d)
         if name in self.output.friendly:
             friendly=self.output.friendly[name]
@@ -1267,8 +1170,8 @@ class ProcScen:
             heading=self.matrix[-1].heading()	# not really
             scale=self.matrix[-1].scale()*self.scale
             # handle translation
-            loc=self.loc.biased(self.matrix[-1].m[3][0]*scale,
-                                -self.matrix[-1].m[3][2]*scale)
+            loc=self.loc.biased(self.matrix[-1].rows[3][0]*scale,
+                                -self.matrix[-1].rows[3][2]*scale)
         else:
             heading=0
             scale=self.scale
@@ -1277,7 +1180,7 @@ class ProcScen:
             if self.debug: self.debug.write("LibraryCall %s %s %.2f %.2f\n%s\n" % (name,friendly,heading,scale,self.matrix[-1]))
         if self.libname:
             # recursive call in library
-            (mdlformat, bglname, realfile, offset, size, name, libscale)=self.output.libobj[name]
+            (mdlformat, bglname, realfile, offset, size, name, libscale)=self.output.findlib(name)
             if bglname==self.srcfile:
                 # Hack: Just include in library objects defined in same file
                 self.start=min(self.start,offset)
@@ -1306,8 +1209,7 @@ class ProcScen:
         elif self.alt:
             self.output.log('Non-zero altitude (%sm) for object %s at (%12.8f, %13.8f) in %s' % (round(self.alt,2), friendly, self.loc.lat, self.loc.lon, self.comment))
 
-    def RoadStart(self):	# 69
-        (width,x,y,z)=unpack('<hhhh', self.bgl.read(8))
+    def RoadStart(self, width, x, y, z):	# 69
         width=width*self.scale*2
         if width>=10 or width<=-10:	# arbitrary
             self.linktype=('VEHICLE', width, 'TRUE')
@@ -1316,8 +1218,7 @@ class ProcScen:
         if not (-1<width<=1):
             self.nodes.append(TaxiwayPoint(self.loc.biased(x*self.scale, z*self.scale)))
 
-    def RoadCont(self):		# 6a:RoadCont, 6f:TaxiwayCont
-        (x,y,z)=unpack('<hhh', self.bgl.read(6))
+    def RoadCont(self, x, y, z):	# 6a:RoadCont, 6f:TaxiwayCont
         (type, width, centerline)=self.linktype
         if type and not (-1<=width<=1):
             node=self.loc.biased(x*self.scale, z*self.scale)
@@ -1325,26 +1226,11 @@ class ProcScen:
                 self.nodes.append(TaxiwayPoint(node))
                 self.links.append(TaxiwayPath(type, width, centerline, len(self.nodes)-2,len(self.nodes)-1))
 
-    def RiverStart(self):	# 6b
-        # ignored
-        self.bgl.seek(8,1)
-        
-    def RiverCont(self):	# 6c
-        # ignored
-        self.bgl.seek(6,1)
-
-    def TaxiwayStart(self):	# 6e
-        (width,x,y,z)=unpack('<hhhh', self.bgl.read(8))
+    def TaxiwayStart(self, width, x, y, z):	# 6e
         self.linktype=('TAXI', width*self.scale*2, 'FALSE')
         self.nodes.append(TaxiwayPoint(self.loc.biased(x*self.scale, z*self.scale)))
 
-    def AreaSense(self):	# 70
-        # Assume inside
-        (off,n)=unpack('<hH', self.bgl.read(4))
-        self.bgl.seek(4*n,1)	# skip
-
-    def AddCat(self):		# 74
-        (off,cat)=unpack('<2h', self.bgl.read(4))
+    def AddCat(self, off, cat):	# 74
         if not off: raise struct.error	# infloop
         self.precall(False)
         if __debug__:
@@ -1355,7 +1241,7 @@ class ProcScen:
     def ScaleAGL(self):		# 77
         self.makename()
         self.bgl.read(8)	# jump,range (LOD) (may be 0),size,reserved
-        (scale,)=unpack('<I', self.bgl.read(4))
+        (scale,)=self.bgl.unpack('<I')
         self.scale=65536.0/scale
         (lat,lon,self.alt)=self.LLA()
         self.altmsl=0
@@ -1371,24 +1257,18 @@ class ProcScen:
                 if self.debug: self.debug.write("!Bogus Location %s\n" % Point(lat,lon))
             self.loc=None
         
-    def ResPnt(self):		# 80
-        (idx,)=unpack('<H', self.bgl.read(2))
+    def ResPnt(self, idx):	# 80
         (x,y,z,c,c,c,c,c)=self.vtx[idx]
         (key,mat)=self.makekey(False)
-        if not key in self.lightdat:
-            self.lightdat[key]=[]
-            self.keys.append(key)
-        self.lightdat[key].append(((x,y,z), self.lightcol))
+        self.addlight(key, (x,y,z), self.lightcol)
         self.checkmsl()
         
-    def Call32(self):		# 2b:AddObj32, 8a:Call32
-        (off,)=unpack('<i', self.bgl.read(4))
+    def Call32(self, off):	# 2b:AddObj32, 8a:Call32
         if not off: raise struct.error	# infloop
         self.precall(False)
-        self.bgl.seek(off-6,1)
+        self.enter(off-6)
 
-    def AddCat32(self):		# 8b
-        (off,cat)=unpack('<ih', self.bgl.read(6))
+    def AddCat32(self, off, cat):	# 8b
         if not off: raise struct.error	# infloop
         self.precall(False)
         if __debug__:
@@ -1396,24 +1276,16 @@ class ProcScen:
         self.layer=cat
         self.bgl.seek(off-8,1)
 
-    def ReScale(self):		# 83
-        self.bgl.read(6)	# jump,range (LOD) (may be 0),size
-        (scale,)=unpack('<I', self.bgl.read(4))
+    def ReScale(self, scale):	# 83
         #print hex(self.bgl.tell()),self.scale, scale, 65536.0/scale, scale/65536.0
         self.scale=self.scale*65536.0/scale
 
-    def Jump32(self):		# 88
-        (off,)=unpack('<i', self.bgl.read(4))
+    def Jump32(self, off):	# 88
         if not off: raise struct.error	# infloop
         self.bgl.seek(off-6,1)
 
-    def CrashIndirect(self):	# 95
-        # Ignore - we'll see the drawing code anyway
-        self.bgl.read(8)
-
-    def CrashStart(self):	# 96
+    def CrashStart(self, off):	# 96
         # Skip real crash code
-        (off,)=unpack('<h', self.bgl.read(2))
         if not off: raise struct.error	# infloop
         self.bgl.seek(off-4,1)
         
@@ -1422,10 +1294,9 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("!Interpolate\n")
         self.anim=True
-        self.bgl.read(18)
 
     def Object(self):		# a0
-        (size,typ)=unpack('<HH', self.bgl.read(4))
+        (size,typ)=self.bgl.unpack('<HH')
         roof=0
         if typ==4:
             # flat
@@ -1433,7 +1304,7 @@ class ProcScen:
              bottom_texture,size_bot_y,tindex_bot_x,tindex_bot_z,
              window_texture,size_win_y,tindex_win_x,tindex_win_y,tindex_win_z,
              top_texture,size_top_y,tindex_top_x,tindex_top_z,
-             roof_texture,tindex_roof_x,tindex_roof_z)=unpack('<18H', self.bgl.read(36))
+             roof_texture,tindex_roof_x,tindex_roof_z)=self.bgl.unpack('<18H')
             roof=0
             size_x *= self.scale
             size_z *= self.scale
@@ -1446,7 +1317,7 @@ class ProcScen:
              bottom_texture,size_bot_y,tindex_bot_x,tindex_bot_z,
              window_texture,size_win_y,tindex_win_x,tindex_win_y,tindex_win_z,
              top_texture,size_top_y,tindex_top_x,tindex_top_z,
-             roof_texture,tindex_roof_x,tindex_roof_z,size_roof_y,tindex_roof_y)=unpack('<20H', self.bgl.read(40))
+             roof_texture,tindex_roof_x,tindex_roof_z,size_roof_y,tindex_roof_y)=self.bgl.unpack('<20H')
             roof=1
             size_x *= self.scale
             size_z *= self.scale
@@ -1460,7 +1331,7 @@ class ProcScen:
              window_texture,size_win_y,tindex_win_x,tindex_win_y,tindex_win_z,
              top_texture,size_top_y,tindex_top_x,tindex_top_z,
              roof_texture,tindex_roof_x,tindex_roof_z,size_roof_y,
-             tindex_gable_y,gable_texture,tindex_gable_z)=unpack('<22H', self.bgl.read(44))
+             tindex_gable_y,gable_texture,tindex_gable_z)=self.bgl.unpack('<22H')
             roof=2
             size_x *= self.scale
             size_z *= self.scale
@@ -1475,7 +1346,7 @@ class ProcScen:
              top_texture,size_top_y,tindex_top_x,tindex_top_z,
              roof_texture,tindex_roof_x,tindex_roof_z,size_roof_y,
              tindex_gable_y,gable_texture,tindex_gable_z,
-             face_texture,tindex_face_x,tindex_face_y)=unpack('<25H', self.bgl.read(50))
+             face_texture,tindex_face_x,tindex_face_y)=self.bgl.unpack('<25H')
             roof=3
             size_x *= self.scale
             size_z *= self.scale
@@ -1488,7 +1359,7 @@ class ProcScen:
              bottom_texture,size_bot_y,tindex_bot_x,tindex_bot_z,
              window_texture,size_win_y,tindex_win_x,tindex_win_y,tindex_win_z,
              top_texture,size_top_y,tindex_top_x,tindex_top_z,
-             roof_texture,tindex_roof_x,tindex_roof_z)=unpack('<20H', self.bgl.read(40))
+             roof_texture,tindex_roof_x,tindex_roof_z)=self.bgl.unpack('<20H')
             roof=0
             size_x=self.scale*base_size_x
             size_z=self.scale*base_size_z
@@ -1503,7 +1374,7 @@ class ProcScen:
              bottom_texture,size_bot_y,tindex_bot_x,
              window_texture,size_win_y,tindex_win_x,tindex_win_y,
              top_texture,size_top_y,tindex_top_x,
-             roof_texture,size_roof_y,tindex_roof_x,tindex_roof_yz)=unpack('<BB16H', self.bgl.read(34))
+             roof_texture,size_roof_y,tindex_roof_x,tindex_roof_yz)=self.bgl.unpack('<BB16H')
             roof=1
             size_x *= self.scale
             size_z *= self.scale
@@ -1513,7 +1384,7 @@ class ProcScen:
         elif typ==0x209:
             # windsock
             self.bgl.seek(size-8,1)
-            (lit,)=unpack('<H', self.bgl.read(2))
+            (lit,)=self.bgl.unpack('<H')
             if lit: lit=1
             self.output.misc.append((19, self.loc, [AptNav(19, '%12.8f %13.8f %d Windsock' %(self.loc.lat, self.loc.lon, lit))]))
             return
@@ -1540,28 +1411,15 @@ class ProcScen:
         if self.matrix[-1]:
             heading=self.matrix[-1].heading()	# not really
             # handle translation
-            loc=self.loc.biased(self.matrix[-1].m[3][0]*self.scale,
-                                -self.matrix[-1].m[3][2]*self.scale)
+            loc=self.loc.biased(self.matrix[-1].rows[3][0]*self.scale,
+                                -self.matrix[-1].rows[3][2]*self.scale)
         else:
             heading=0
             loc=self.loc
-        newobj=None
-        name="%s-generic-%d" % (asciify(basename(self.srcfile)[:-4]), len(self.gencount)+1)
         if typ in [10,11]:
-            foo=(sides, size_x, size_z, tuple(heights), tuple(texs))
-            if foo in self.gencache:
-                name=self.gencache[foo]
-            else:
-                newobj=makegenmulti(name, self.output, *foo)
+            name=self.genericobj((sides, size_x, size_z, tuple(heights), tuple(texs)))
         else:
-            foo=(size_x, size_z, incx, incz, tuple(heights), tuple(texs), roof)
-            if foo in self.gencache:
-                name=self.gencache[foo]
-            else:
-                newobj=makegenquad(name, self.output, *foo)
-        if newobj:
-            self.output.objdat[name]=[newobj]
-            self.gencache[foo]=name
+            name=self.genericobj((size_x, size_z, incx, incz, tuple(heights), tuple(texs), roof))
         self.output.objplc.append((loc, heading, self.complexity, name, 1))
         if self.altmsl:
             pass
@@ -1569,11 +1427,7 @@ class ProcScen:
         elif self.alt:
             self.output.log('Non-zero altitude (%sm) for generic building %s at (%12.8f, %13.8f) in %s' % (round(self.alt,2), name, self.loc.lat, self.loc.lon, self.comment))
 
-    def TargetIndicator(self):	# a6 - used by Aerosoft
-        (x,y,z)=unpack('<3h', self.bgl.read(6))
-
-    def SpriteVICall(self):	# a7
-        (off,x,y,z,p,b,h,vp,vb,vh)=unpack('<4h6H', self.bgl.read(20))
+    def SpriteVICall(self, off, x, y, z, p, b, h, vp, vb, vh):	# a7
         if not off: raise struct.error	# infloop
         self.precall(True)
         newmatrix=Matrix()
@@ -1590,10 +1444,9 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("Now\n%s\n" % self.matrix[-1])
         self.billboard=True
-        self.bgl.seek(off-22,1)
+        self.enter(off-22)
 
-    def TextureRoadStart(self):	# a8
-        (style,width,x,y,z)=unpack('<Hhhhh', self.bgl.read(10))
+    def TextureRoadStart(self, style, width, x, y, z):	# a8
         width=width*self.scale*2	# width is in [m]?, ie not scaled?
         if style<=1 and -1<=width<=-1:		# arbitrary - centreline only
             self.linktype=('TAXI', width, 'TRUE')
@@ -1615,7 +1468,7 @@ class ProcScen:
     def NewRunway(self):	# aa
         # runways should now be in FS2004-style BGL. But this command is
         # sometimes used to put back lights on an excluded runway
-        (size,op)=unpack('<HB', self.bgl.read(3))
+        (size,op)=self.bgl.unpack('<HB')
         endop=self.bgl.tell()+size-5
         (lat,lon,alt)=self.LLA()
         cloc=Point(lat,lon)
@@ -1623,7 +1476,7 @@ class ProcScen:
             if __debug__:
                 if self.debug: self.debug.write("!Bogus Runway location %s\n"%cloc)
             raise struct.error
-        (heading, length, width, markers, surface_type, surface_lights, identifiers)=unpack('<HHHHBBB', self.bgl.read(11))
+        (heading, length, width, markers, surface_type, surface_lights, identifiers)=self.bgl.unpack('<HHHHBBB')
         heading *= 360.0 / 65536
         length=length/m2f	# includes displaced threshold
         width=width/m2f
@@ -1679,24 +1532,24 @@ class ProcScen:
         tdzl=[0,0]
         reil=[0,0]
         while self.bgl.tell()<endop:
-            (op,foo)=unpack('<BB', self.bgl.read(2))
+            (op,foo)=self.bgl.unpack('<BB')
             if op==2:
-                (foo,)=unpack('<H', self.bgl.read(2))
+                (foo,)=self.bgl.unpack('<H')
                 displaced[0]=foo/m2f
             elif op==3:
-                (foo,)=unpack('<H', self.bgl.read(2))
+                (foo,)=self.bgl.unpack('<H')
                 displaced[1]=foo/m2f
             elif op==4 or op==8:
-                (foo,)=unpack('<H', self.bgl.read(2))
+                (foo,)=self.bgl.unpack('<H')
                 overrun[0]=foo/m2f
             elif op==5 or op==9:
-                (foo,)=unpack('<H', self.bgl.read(2))
+                (foo,)=self.bgl.unpack('<H')
                 overrun[1]=foo/m2f
             elif op==10 or op==11:
-                (foo,)=unpack('<H', self.bgl.read(2))
+                (foo,)=self.bgl.unpack('<H')
                 distance=1
             elif op==6 or op==7:
-                (flags,system,strobes,vasi_system,vasi_angle,vasi_x,vasi_z,vasi_spacing)=unpack('<BBBBHHHH', self.bgl.read(12))
+                (flags,system,strobes,vasi_system,vasi_angle,vasi_x,vasi_z,vasi_spacing)=self.bgl.unpack('<BBBBHHHH')
                 # ignore vasi - hope it's specified in XML
                 if flags&5:
                     reil[op-6]=1
@@ -1726,15 +1579,14 @@ class ProcScen:
             tdzl[end], reil[end])
         self.output.misc.append((100, cloc, [AptNav(100, txt)]))
 
-    def ZBias(self):	# ac
-        (self.zbias,)=unpack('<H', self.bgl.read(2))
+    def ZBias(self, zbias):	# ac
+        self.zbias=zbias
 
     # opcodes ad to bd new in FS2002
 
-    def Animate(self):		# ad
+    def Animate(self, x, y, z):	# ad
         # Just make a static translation matrix
         self.anim=True
-        (c,c,c,c,x,y,z)=unpack('<4i3f', self.bgl.read(28))
         newmatrix=Matrix()
         newmatrix=newmatrix.offset(x,y,z)
         if __debug__:
@@ -1752,9 +1604,7 @@ class ProcScen:
     def TransformEnd(self):	# ae
         self.matrix.pop()
         
-    def TransformMatrix(self):	# af
-        (x,y,z)=unpack('<3f', self.bgl.read(12))
-        (q00,q01,q02, q10,q11,q12, q20,q21,q22)=unpack('<9f',self.bgl.read(36))
+    def TransformMatrix(self, x, y, z, q00, q01, q02, q10, q11, q12, q20, q21, q22):	# af
         newmatrix=Matrix([[q00,q01,q02,0],
                           [q10,q11,q12,0],
                           [q20,q21,q22,0],
@@ -1771,25 +1621,17 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("Now\n%s\n" % self.matrix[-1])
 
-    def Tag(self):	# b1
-        self.bgl.read(20).rstrip(' \0')	# what's this for?
-        
-    def Light(self):		# b2
-        (typ,x,y,z,intens,i,i,b,g,r,a,i,i,i)=unpack('<HfffIffBBBBfff', self.bgl.read(42))
+    def Light(self, typ, x, y, z, intens, b, g, r, a):	# b2
         # Typical intensities are 20 and 40 - so say 40=max
         if intens<40:
             intens /= 40.0 * 255.0
         else:
             intens=1/255.0
         (key,mat)=self.makekey(False)
-        if not key in self.lightdat:
-            self.lightdat[key]=[]
-            self.keys.append(key)
-        self.lightdat[key].append(((x,y,z), (r*intens,g*intens,b*intens)))
+        self.addlight(key, (x,y,z), (r*intens,g*intens,b*intens))
         self.checkmsl()
         
-    def IfInF1(self):		# b3
-        (off, var, vmin, vmax)=unpack('<2h2f', self.bgl.read(12))
+    def IfInF1(self, off, var, vmin, vmax):	# b3
         if vmin>vmax:	# Sigh. Seen in TFFR
             foo=vmax
             vmax=vmin
@@ -1802,37 +1644,25 @@ class ProcScen:
             if not off: raise struct.error	# infloop
             self.bgl.seek(off-10,1)
 
-    def VertexList(self):	# b5
-        self.vtx=[]
-        (count,)=unpack('<H', self.bgl.read(2))
-        self.bgl.read(4)
-        for i in range(count):
-            self.vtx.append(unpack('<8f', self.bgl.read(32)))
+    def VertexList(self, vtx):	# b5
+        self.vtx=vtx.copy()	# DefRes etc write into this, so don't share the decoded operand
+        self.vtxgen+=1
 
-    def MaterialList(self):	# b6
-        (count,dummy)=unpack('<HI', self.bgl.read(6))
+    def MaterialList(self, mats):	# b6
         self.mat=[]
         self.m=None
-        for i in range(count):
-            (dr,dg,db,da)=unpack('<4f', self.bgl.read(16))
-            (ar,ag,ab,aa)=unpack('<4f', self.bgl.read(16))
-            self.bgl.read(16*2)			# specular, emissive ignored according to BGLFP.doc
-            (p,)=unpack('<f', self.bgl.read(4))	# specular power
+        for (ar,ag,ab,da) in mats:
             # according to BGLFP.doc ambient is ignored. But in practice seems to hold fallback color for textured materials,
             # and holds same r,g,b values as diffuse for untextured materials. Which makes it a better choice.
             self.mat.append(Material(self.output.xpver, (ar,ag,ab), alphacutoff=(1-da or None)))
         if __debug__:
             if self.debug: self.debug.write("%d materials\n" % len(self.mat))
 
-    def TextureList(self):	# b7
+    def TextureList(self, texs):	# b7
         self.tex=[]
         self.t=None
-        (count,)=unpack('<H', self.bgl.read(2))
-        self.bgl.read(4)
-        for i in range(count):
-            (cls,)=unpack('<I', self.bgl.read(4))
-            self.bgl.read(12)
-            tex=findtex(self.bgl.read(64).rstrip(' \0'), self.texdir, self.output.addtexdir)
+        for (cls, tex) in texs:
+            tex=findtex(tex, self.texdir, self.output.addtexdir)
             if not cls&0x700 or not self.tex[-1]:
                 pass	# Not a multitexture, or no primary texture
             elif cls==0x100:			# NightMap: Blends with diffuse texture
@@ -1847,8 +1677,8 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("%d textures\n" % len(self.tex))
 
-    def SetMaterial(self):	# b8
-        (self.m,self.t)=unpack('<2h', self.bgl.read(4))
+    def SetMaterial(self, m, t):	# b8
+        (self.m,self.t)=(m,t)
         if self.m>=len(self.mat):
             if __debug__:
                 if self.debug: self.debug.write("Bad material %d/%d\n"%(self.m,len(self.mat)))
@@ -1860,48 +1690,37 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("%s: %s\t%s: %s\n" % (self.m, self.m is not None and self.mat[self.m], self.t, self.t is not None and self.tex[self.t]))
         
-    def DrawTriList(self):	# b9
-        idx=[]
-        (vbase,vcount,icount)=unpack('<3H', self.bgl.read(6))
-        if __debug__: self.debug.write("%d, %d, %d\n" % (vbase,vcount,icount))
-        vtx=self.vtx[vbase:vbase+vcount]
-        idx=unpack('<%dH' % icount, self.bgl.read(2*icount))
+    def DrawTriList(self, vbase, vcount, idx):	# b9
+        if __debug__:
+            if self.debug: self.debug.write("%d, %d, %d\n" % (vbase,vcount,len(idx)))
+        vtx=array(self.vtx[vbase:vbase+vcount], float).reshape(-1,8)	# copy, in case of later DefRes
         (key,mat)=self.makekey()
-        if not key in self.objdat and self.makepoly(True, vtx, idx):	# don't generate poly if there's already geometry here
+        if self.trypoly(key, True, vtx, idx):	# don't generate poly if there's already geometry here
             return
-        maxy=-maxint
-        for (x,y,z,nx,ny,nz,tu,tv) in vtx:
-            maxy=max(maxy,y)
-        if maxy+self.alt <= groundfudge:
+        if not len(vtx) or vtx[:,1].max()+self.alt <= groundfudge:
             mat.poly=True
-        if not key in self.objdat:
-            self.objdat[key]=[]
-            self.keys.append(key)
-        self.objdat[key].append((mat, vtx, idx))
+        self.addtris(key, mat, vtx, idx)
         self.checkmsl()
 
     def DrawLineList(self):	# ba
-        (base,vcount,icount)=unpack('<3H', self.bgl.read(6))
         self.old=True
-        self.bgl.seek(2*icount,1)
         
     # opcodes c0 and above new in FS2004
 
-    def SetMatrixIndirect(self):	# c4
+    def SetMatrixIndirect(self, scene):	# c4
         # n=index into SCEN section of MDL file
-        (scene,)=unpack('<H', self.bgl.read(2))
         pos=self.bgl.tell()
         self.matrix[-1]=Matrix()
 
         while scene!=-1:
             (child,peer,size,posa,parent)=self.scen[scene]
             self.bgl.seek(posa)		# Into ANIC section
-            (cmd,src,dst)=unpack('<3H', self.bgl.read(6))
+            (cmd,src,dst)=self.bgl.unpack('<3H')
             if cmd==0xc6 and size==6:
                 self.bgl.seek(self.tran+src*64)
                 m=[]
                 for j in range(4):
-                    (a,b,c,d)=unpack('<4f',self.bgl.read(16))
+                    (a,b,c,d)=self.bgl.unpack('<4f')
                     m.append([a,b,c,d])
                 # Matrices don't appear to nest - hence [-1]
                 self.matrix[-1]=self.matrix[-1]*Matrix(m)
@@ -1923,28 +1742,24 @@ class ProcScen:
     
     def NOP(self):
         # 02:NOOP, 76:BGL, 7d:Perspective, bd:EndVersion
-        pass
-
-    def NOPh(self):
         # 30:Brightness, 3f:ShadowCall, 81:AntiAlias, 93: Specular?, a4:VAlpha
-        self.bgl.read(2)
-
-    def NOPi(self):
         # 89:VarBase32, 8f:Alpha, 9f:Override, b4: TextureSize, bc:BGLVersion
-        self.bgl.read(4)
+        # 40:ShadowVPosition, 5f:IfSizeV, 62:IfVis, 6b:RiverStart, 6c:RiverCont,
+        # 6d:IfSizeH, 70:AreaSense, 95:CrashIndirect, a6:TargetIndicator, b1:Tag - operands ignored
+        pass
 
 
     # Helpers
 
     # helper to read lat, lon, alt
     def LLA(self):
-        (lo,hi)=unpack('<Hi',self.bgl.read(6))
+        (lo,hi)=self.bgl.unpack('<Hi')
         if hi>=0:
             lat=hi+lo/65536.0
         else:
             lat=-(~hi+(~lo+1)/65536.0)
         lat=lat*360/cirp
-        (lo,hi)=unpack('<Hi',self.bgl.read(6))
+        (lo,hi)=self.bgl.unpack('<Hi')
         if hi>=0:
             lon=hi+lo/65536.0
         else:
@@ -1952,25 +1767,102 @@ class ProcScen:
         lon=lon*360.0/0x100000000
         if lon>180: lon-=360
         
-        (lo,hi)=unpack('<Hi',self.bgl.read(6))
+        (lo,hi)=self.bgl.unpack('<Hi')
         if hi>=0:
             alt=hi+lo/65536.0
         else:
             alt=-(~hi+(~lo+1)/65536.0)
 
         if __debug__:
-            self.debug.write("New location: %s %.3f\n" % (Point(lat,lon), alt))
+            if self.debug: self.debug.write("New location: %s %.3f\n" % (Point(lat,lon), alt))
         return lat,lon,alt
 
 
     # Stack return data prior to a call
     def precall(self, matrix):
         if len(self.stack)>100:		# arbitrary
-            if __debug__: self.debug.write("!Recursion limit\n")
+            if __debug__:
+                if self.debug: self.debug.write("!Recursion limit\n")
             raise struct.error
         self.stack.append((self.bgl.tell(), self.layer, self.billboard, matrix and True))
 
 
+    # Emit geometry and lights, recording them if in a memoised call
+    def addtris(self, key, mat, vtx, idx):
+        if not key in self.objdat:
+            self.objdat[key]=[]
+            self.keys.append(key)
+        self.objdat[key].append((mat, vtx, idx))
+        self.vertices+=len(vtx)
+        self.polygons+=len(idx)/3
+        if self.rec: self.rec[3].append((True, key, mat.clone(), vtx, idx))
+
+    def addlight(self, key, xyz, col):
+        if not key in self.lightdat:
+            self.lightdat[key]=[]
+            self.keys.append(key)
+        self.lightdat[key].append((xyz, col))
+        self.vertices+=1
+        if self.rec: self.rec[3].append((False, key, None, xyz, col))
+
+    # Whether to generate a draped polygon instead of geometry.
+    def trypoly(self, key, haveuv, vtx, idx=None):
+        if self.rec and self.t is not None and self.loc:
+            self.rec[2]=False	# Depends on the matrix, so can't be memoised
+        return not key in self.objdat and self.makepoly(haveuv, vtx, idx)
+
+
+    # Enter a subroutine at offset rel from the current position.
+    # Subroutines that just emit geometry and lights (see memopure) are
+    # recorded on first execution, keyed on the interpreter state, and
+    # replayed under the caller's matrix when called again from the same
+    # state. Nested calls are executed normally.
+    def enter(self, rel):
+        target=self.bgl.tell()+rel
+        if self.rec:
+            self.bgl.seek(target)
+            return
+        key=(target, self.name, self.loc, self.layer, self.billboard, self.alt, self.altmsl, self.scale,
+             self.t, self.m, id(self.tex), id(self.mat), self.lightcol, self.haze, self.zbias, self.surface,
+             self.concave, self.complexity, tuple(self.idx), self.vtxgen, tuple(sorted(self.vars.items())),
+             not self.objdat)
+        memo=self.memo.get(key, False)
+        if memo:
+            (events, state, keep)=memo
+            matrix=self.matrix[-1]
+            for (tris, ekey, a, b, c) in events:
+                ekey=ekey[:5]+(matrix,)+ekey[6:]
+                if tris:
+                    self.addtris(ekey, a.clone(), b, c)
+                else:
+                    self.addlight(ekey, b, c)
+            (self.t, self.m, self.tex, self.mat, self.lightcol, self.haze, self.zbias, self.surface,
+             self.concave, self.complexity, idx, vars, neednight, old, rrt, anim)=state
+            self.idx=list(idx)
+            self.vars=dict(vars)
+            self.neednight|=neednight
+            self.old|=old
+            self.rrt|=rrt
+            self.anim|=anim
+            self.Return()
+        else:
+            if memo is False:	# not known to be impure
+                self.rec=[key, len(self.stack), True, [], (self.tex, self.mat)]
+            self.bgl.seek(target)
+
+    # End of a recorded subroutine
+    def endrec(self):
+        (key, depth, pure, events, keep)=self.rec
+        self.rec=None
+        if pure:
+            # Keep the entry tex & mat alive with the memo, so that their ids
+            # in the key can't be re-used by other lists
+            self.memo[key]=(events, (self.t, self.m, self.tex, self.mat, self.lightcol, self.haze, self.zbias, self.surface,
+                                     self.concave, self.complexity, list(self.idx), dict(self.vars), self.neednight, self.old, self.rrt, self.anim), keep)
+        else:
+            self.memo[key]=None
+
+
     def tessbegin(self, typ, polys):
         # New output polygon
         assert typ==GL_LINE_LOOP
@@ -1980,7 +1872,7 @@ class ProcScen:
         (x,y,z, nx,ny,nz, tu,tv)=vertex
         polys[-1][0].append((self.loc.biased(x,z), tu,tv))
 
-    tesscombine2=array([0.5,0.5,0,0], GLfloat)
+    tesscombine2=array([0.5,0.5,0,0], float32)
     def tesscombine(self, coords, vertex, weight, polys):
         # two cases:
         # - two co-located vertices: check that UVs match
@@ -1996,27 +1888,6 @@ class ProcScen:
             polys[0]=False	# Can't raise an exception so do this instead
         return vertex[0]
 
-    def csgtvertex(self, vertex, polys):
-        polys[-1][0].append(vertex)
-
-    def csgtcombine(self, coords, vertex, weight, polys):
-        # Polygon meets tile border. Need to work out UV coords from polygon vertices.
-        #self.debug.write("combine: %s %s %s\n" % (coords, vertex, weight))
-        newtu=newtv=0
-        cumw=0
-        for i in range(4):
-            if vertex[i] is None:
-                polys[0]=False	# Shouldn't happen - Something went wrong with initial tessellation
-                if __debug__:
-                    if self.debug: self.debug.write("WTF?\n")
-            else:
-                (loc, tu, tv)=vertex[i]
-                if tu is not None:	# Polygon point not tile border
-                    newtu+=tu
-                    newtv+=tv
-                    cumw +=weight[i]
-        return Point(float(coords[2]), float(coords[0])), newtu/cumw, newtv/cumw
-
     # Try to make a draped polygon
     def makepoly(self, haveuv, vtx, idx=None):
         if self.t is None: return False	# Only care about textured polygons
@@ -2024,12 +1895,15 @@ class ProcScen:
         if __debug__:
             if self.debug: self.debug.write("Poly: %s %s %s %d " % (self.tex[self.t], self.alt, self.layer, self.zbias))
 
-        # Altitude test on first vertex
+        # Transform
+        vtx=asarray(vtx, float).reshape(-1,8)
         if self.matrix[-1]:
-            (x,y,z)=self.matrix[-1].transform(*vtx[idx[0]][:3])
+            xyz=self.matrix[-1].transform_many(vtx[:,0:3])*self.scale
         else:
-            (x,y,z)=vtx[idx[0]][:3]
-        yval=y*self.scale
+            xyz=vtx[:,0:3]*self.scale
+
+        # Altitude test on first vertex
+        yval=xyz[idx and idx[0] or 0,1]
         if (self.altmsl and not self.layer) or yval+self.alt>groundfudge:
             if __debug__:
                 if self.debug: self.debug.write("Above ground %s\n" % (yval+self.alt))
@@ -2037,23 +1911,14 @@ class ProcScen:
         elif __debug__:
             if self.debug: self.debug.write("Ground %s " % (yval+self.alt))
 
-        # Transform & Co-planar test
-        newvtx=[]
-        minu=minv=maxint
-        maxu=maxv=-maxint
-        for (x,y,z, nx,ny,nz, tu,tv) in vtx:
-            if self.matrix[-1]:
-                (x,y,z)=self.matrix[-1].transform(x,y,z)
-            if abs(y*self.scale-yval)>planarfudge:
-                if __debug__:
-                    if self.debug: self.debug.write("Not coplanar\n")
-                return False
-            minu=min(minu,tu)
-            minv=min(minv,tv)
-            maxu=max(maxu,tu)
-            maxv=max(maxv,tv)
-            newvtx.append((x*self.scale,y*self.scale,z*self.scale, nx,ny,nz, tu,tv))
-        vtx=newvtx
+        # Co-planar test
+        if (abs(xyz[:,1]-yval)>planarfudge).any():
+            if __debug__:
+                if self.debug: self.debug.write("Not coplanar\n")
+            return False
+        (minu,minv)=vtx[:,6:8].min(0).tolist()
+        (maxu,maxv)=vtx[:,6:8].max(0).tolist()
+        vtx=[tuple(v) for v in column_stack((xyz, vtx[:,3:8])).tolist()]
 
         TEXFUDGE=0.01
         uvscale=max(0.1,round(self.scale*256, 0))	# Mustn't be zero
@@ -2130,27 +1995,26 @@ class ProcScen:
         else:
             polys.pop(0)
 
-        # Output from tessellation is a list of windings.
-        # Holes are CW and precede the polygon that contains them. Easier if they're the other way round.
-        polys.reverse()
-        i=0
-        while i<len(polys):
-            w=polys[i][0]
+        # Output from tessellation is a list of windings, exteriors CCW and holes CW.
+        exteriors=[]
+        holes=[]
+        for (w,) in polys:
             count=len(w)
             area2=0
             for j in range(count):
                 area2+=(w[j][0].lat*w[(j+1)%count][0].lon - w[(j+1)%count][0].lat*w[j][0].lon)
             if __debug__:
-                self.debug.write("points: %d %s\n" % (count, area2<=0 and 'CCW' or 'CW'))
+                if self.debug: self.debug.write("points: %d %s\n" % (count, area2<=0 and 'CCW' or 'CW'))
             if area2>0:
-                polys[i-1].append(w)	# Add hole winding to the containing polygon
-                polys.pop(i)
+                holes.append(w)
             else:
-                i+=1
+                exteriors.append([w])
+        addholes(exteriors, holes)
+        polys=exteriors
 
         if haveuv:
             heading=65535
-        elif self.matrix[-1] and self.matrix[-1].m[1][1]==1:	# No pitch or bank?
+        elif self.matrix[-1] and self.matrix[-1].rows[1][1]==1:	# No pitch or bank?
             heading=self.matrix[-1].heading()
         else:
             heading=0
@@ -2160,88 +2024,123 @@ class ProcScen:
         if self.haze and tex.e: self.output.haze[tex.e]=self.haze
 
         # Adjust for straddling tile boundaries
-        for i in range(len(polys)-1,-1,-1):
-            points=polys[i]
-            w=points[0]	# exterior winding
-            minlat=minlon=maxint
-            maxlat=maxlon=-maxint
-            for (loc,tu,tv) in w:
-                minlat=min(minlat,loc.lat)
-                minlon=min(minlon,loc.lon)
-                maxlat=max(maxlat,loc.lat)
-                maxlon=max(maxlon,loc.lon)
-
-            latrange=range(int(floor(minlat)), 1+int(floor(maxlat)))
-            lonrange=range(int(floor(minlon)), 1+int(floor(maxlon)))
-
-            # Strictly we don't have to do this tessellation if we don't straddle, but do it anyway as a sanity test
-            #if len(latrange)==len(lonrange)==1:
-            #    continue	# doesn't straddle a tile border
-
-            # More tessellation, this time in CSG mode
-            tessObj = gluNewTess()
-            gluTessNormal(tessObj, 0, -1, 0)
-            gluTessProperty(tessObj, GLU_TESS_WINDING_RULE,  GLU_TESS_WINDING_ABS_GEQ_TWO)
-            gluTessProperty(tessObj, GLU_TESS_BOUNDARY_ONLY, GL_TRUE)
-            gluTessCallback(tessObj, GLU_TESS_BEGIN_DATA,    self.tessbegin)
-            gluTessCallback(tessObj, GLU_TESS_VERTEX_DATA,   self.csgtvertex)
-            gluTessCallback(tessObj, GLU_TESS_COMBINE_DATA,  self.csgtcombine)
-
-            polys.pop(i)
-            try:
-                for lat in latrange:
-                    for lon in lonrange:
-                        newpolys=[True]
-                        gluTessBeginPolygon(tessObj, newpolys)
-                        gluTessBeginContour(tessObj)
-                        gluTessVertex(tessObj, [lon,   0, lat],   (Point(lat,   lon),   None, None))
-                        gluTessVertex(tessObj, [lon+1, 0, lat],   (Point(lat,   lon+1), None, None))
-                        gluTessVertex(tessObj, [lon+1, 0, lat+1], (Point(lat+1, lon+1), None, None))
-                        gluTessVertex(tessObj, [lon,   0, lat+1], (Point(lat+1, lon),   None, None))
-                        gluTessEndContour(tessObj)
-                        for w in points:
-                            gluTessBeginContour(tessObj)
-                            for p in w:
-                                (loc, tu, tv)=p
-                                gluTessVertex(tessObj, [loc.lon, 0, loc.lat], p)
-                            gluTessEndContour(tessObj)
-                        gluTessEndPolygon(tessObj)
-
-                        if not newpolys[0]:
-                            return False	# Failed
-                        else:
-                            newpolys.pop(0)
-
-                        newpolys.reverse()	# So holes follow containing polygon
-                        j=0
-                        while j<len(newpolys):
-                            neww=newpolys[j][0]
-                            count=len(neww)
-                            area2=0
-                            for k in range(count):
-                                area2+=(neww[k][0].lat*neww[(k+1)%count][0].lon - neww[(k+1)%count][0].lat*neww[k][0].lon)
-                            if area2>0:
-                                newpolys[j-1].append(neww)	# Add hole winding to the containing polygon
-                                newpolys.pop(j)
-                            else:
-                                j+=1
-
-                        polys.extend(newpolys)
-            except:
-                gluDeleteTess(tessObj)
-                if self.debug: print_exc(None, self.debug)
-                raise GLUerror
-            gluDeleteTess(tessObj)
+        polys=[piece for points in polys for piece in cliptiles(points)]
 
         # Add polygons
         if __debug__:
             if self.debug: self.debug.write("OK\n")
         for points in polys:
             self.polydat.append((points, self.layer, heading, uvscale, tex))
+            self.vertices+=sum([len(w) for w in points])
+            self.polygons+=1
 
         return True
 
 
+    # Union polygons that are drawn the same way - same texture, layer,
+    # heading and scale - within each tile, so that abutting quads become
+    # fewer, larger polygons. A polygon only joins an earlier one if nothing
+    # else on its layer that might overlap it was drawn in between.
+    def mergepolys(self):
+        groups=[]	# [key, (minlat, maxlat, minlon, maxlon), [polydat]] in drawing order
+        latest={}	# last group by key
+        for pdat in self.polydat:
+            (points, layer, heading, scale, tex)=pdat
+            (s,n,w,e)=tilebounds(points)
+            key=(s, w, layer, heading, scale, tex)
+            lats=[p[0].lat for p in points[0]]
+            lons=[p[0].lon for p in points[0]]
+            bounds=(min(lats), max(lats), min(lons), max(lons))
+            group=latest.get(key)
+            if group:
+                for other in groups[groups.index(group)+1:]:
+                    if other[0][2]==layer and other[1][0]<=bounds[1] and other[1][1]>=bounds[0] and other[1][2]<=bounds[3] and other[1][3]>=bounds[2]:
+                        group=None	# drawn over since
+                        break
+            if group:
+                group[1]=(min(group[1][0], bounds[0]), max(group[1][1], bounds[1]), min(group[1][2], bounds[2]), max(group[1][3], bounds[3]))
+                group[2].append(pdat)
+            else:
+                group=[key, bounds, [pdat]]
+                groups.append(group)
+                latest[key]=group
+
+        self.polydat=[]
+        for (key, bounds, pdats) in groups:
+            if len(pdats)>1:
+                (points, layer, heading, scale, tex)=pdats[0]
+                polys=self.unionpolys([pdat[0] for pdat in pdats], heading==65535)
+                if polys and len(polys)<len(pdats):
+                    if __debug__:
+                        if self.debug: self.debug.write("Merged %d polygons into %d: %s %s\n" % (len(pdats), len(polys), tex, layer))
+                    self.polydat.extend([(points, layer, heading, scale, tex) for points in polys])
+                    continue
+            self.polydat.extend(pdats)
+
+    # Union of polygons, or None if haveuv and their UVs don't agree
+    def unionpolys(self, polys, haveuv):
+        tessObj = gluNewTess()
+        gluTessNormal(tessObj, 0, 0, 1)
+        gluTessProperty(tessObj, GLU_TESS_WINDING_RULE,  GLU_TESS_WINDING_NONZERO)
+        gluTessProperty(tessObj, GLU_TESS_BOUNDARY_ONLY, GL_TRUE)
+        gluTessCallback(tessObj, GLU_TESS_BEGIN_DATA,    self.mergebegin)
+        gluTessCallback(tessObj, GLU_TESS_VERTEX_DATA,   self.mergevertex)
+        gluTessCallback(tessObj, GLU_TESS_COMBINE_DATA,  self.mergecombine)
+        windings=[True, haveuv]	# First element is a success value, second whether UVs must match
+        try:
+            gluTessBeginPolygon(tessObj, windings)
+            for points in polys:
+                for w in points:
+                    gluTessBeginContour(tessObj)
+                    for p in w:
+                        gluTessVertex(tessObj, [p[0].lon, p[0].lat, 0], p)
+                    gluTessEndContour(tessObj)
+            gluTessEndPolygon(tessObj)
+        except:
+            gluDeleteTess(tessObj)
+            if self.debug: print_exc(None, self.debug)
+            return None
+        gluDeleteTess(tessObj)
+        if not windings[0]: return None
+
+        exteriors=[]
+        holes=[]
+        for w in windings[2:]:
+            a=area2(w)
+            if len(w)<3 or not a:
+                continue
+            elif a>0:
+                exteriors.append([w])
+            else:
+                holes.append(w)
+        addholes(exteriors, holes)
+        return exteriors
+
+    def mergebegin(self, typ, windings):
+        assert typ==GL_LINE_LOOP
+        windings.append([])
+
+    def mergevertex(self, vertex, windings):
+        windings[-1].append(vertex)
+
+    def mergecombine(self, coords, vertex, weight, windings):
+        # New point where points coincide or edges cross. Its UVs must be
+        # the same from each of the polygons that meet there.
+        if vertex[2] is None:
+            ends=[(vertex[0], vertex[0], 1), (vertex[1], vertex[1], 1)]
+        else:
+            ends=[(vertex[j], vertex[j+1], weight[j]+weight[j+1] and float(weight[j+1])/(weight[j]+weight[j+1])) for j in [0,2]]
+        uvs=[(p[1]+t*(q[1]-p[1]), p[2]+t*(q[2]-p[2])) for (p,q,t) in ends]
+        if windings[1] and (abs(uvs[0][0]-uvs[1][0])>0.001 or abs(uvs[0][1]-uvs[1][1])>0.001):
+            if __debug__:
+                if self.debug and windings[0]: self.debug.write("UV mismatch merging polygons\n")
+            windings[0]=False	# Can't raise an exception so do this instead
+        total=sum([weight[j] for j in range(4) if vertex[j] is not None])
+        lat=sum([weight[j]*vertex[j][0].lat for j in range(4) if vertex[j] is not None])/total
+        lon=sum([weight[j]*vertex[j][0].lon for j in range(4) if vertex[j] is not None])/total
+        return (Point(lat, lon), uvs[0][0], uvs[0][1])
+
+
     # Generate Objects for the current Area or Library object
     def makeobjs(self):
 
@@ -2249,38 +2148,50 @@ class ProcScen:
             # Detect night-only objects, e.g. LIEE2008 cag_pc spotlight, and objects that manually change texture at night
 
             self.effectdat=self.dayeffectdat	# just use daylight effects
+            self.keys=unique(self.keys)	# the night pass re-adds keys that the day pass used
             # just use nighttime lights
 
-            nightpolydat=self.polydat
+            # Only geometry generated after the night pass forked can differ
+            # from daytime, so look that up against daytime geometry.
+            shapes={}	# first daytime poly by (windings, layer, heading, scale)
+            for dpoly in self.daypolydat:
+                (points, layer, heading, scale, tex)=dpoly
+                shapes.setdefault((len(points), layer, heading, scale), dpoly)
+            nightpolydat=self.polydat[self.nightmark:]
             self.polydat=[]
             for npoly in nightpolydat:
                 (npoints, nlayer, nheading, nscale, ntex)=npoly
-                for dpoly in self.daypolydat:
-                    (points, layer, heading, scale, tex)=dpoly
-                    if len(points)==len(npoints) and layer==nlayer and heading==nheading and scale==nscale: break
-                    for k in range(len(points)):
-                        if points[k][0]!=npoints[k][0] or points[k][1]!=npoints[k][1] or points[k][2]!=npoints[k][2]:
-                            break
+                dpoly=shapes.get((len(npoints), nlayer, nheading, nscale))
+                if not dpoly:
+                    for dpoly in self.daypolydat:
+                        points=dpoly[0]
+                        for k in range(len(points)):
+                            if points[k][0]!=npoints[k][0] or points[k][1]!=npoints[k][1] or points[k][2]!=npoints[k][2]:
+                                break
+                        else:
+                            break	# dupe
                     else:
-                        break	# dupe
-                else:
-                    # nighttime-only poly
-                    if __debug__:
-                        if self.debug: self.debug.write("Night-only poly: %s\n" % ntex)
-                    if not ntex.e: ntex=Texture(self.output.xpver, None, ntex.d)	# texture manually managed
-                    self.polydat.append((npoints, nlayer, nheading, nscale, ntex))
-                    continue
+                        # nighttime-only poly
+                        if __debug__:
+                            if self.debug: self.debug.write("Night-only poly: %s\n" % ntex)
+                        if not ntex.e: ntex=Texture(self.output.xpver, None, ntex.d)	# texture manually managed
+                        self.polydat.append((npoints, nlayer, nheading, nscale, ntex))
+                        continue
                 # Duplicate
+                tex=dpoly[4]
                 if not tex.e and tex.d!=ntex.d: tex.e=ntex.d	# texture manually managed
             self.polydat.extend(self.daypolydat)
 
             nightobjdat=self.objdat
             self.objdat=self.dayobjdat
+            placed={}	# objdat keys by placement, ignoring loc which only compares approximately
+            for key in self.objdat:
+                placed.setdefault(key[:1]+key[2:7], []).append(key)
             for nkey in nightobjdat:
                 if nkey in self.objdat: continue	# dupe
                 (nname, nloc, nlayer, nalt, naltmsl, nmatrix, nscale, ntex)=nkey
-                for (name, loc, layer, alt, altmsl, matrix, scale, tex) in self.objdat:
-                    if name==nname and loc==nloc and layer==nlayer and alt==nalt and altmsl==naltmsl and matrix==nmatrix and scale==nscale:
+                for (name, loc, layer, alt, altmsl, matrix, scale, tex) in placed.get(nkey[:1]+nkey[2:7], []):
+                    if loc==nloc:
                         # Duplicate. TODO: Night-time only geometry?
                         if tex and not tex.e and tex.d!=ntex.d: tex.e=ntex.d	# texture manually managed
                         break
@@ -2297,6 +2208,7 @@ class ProcScen:
                     if not key in self.objdat:
                         self.objdat[key]=[]
                         self.keys.append(key)
+                        placed.setdefault(key[:1]+key[2:7], []).append(key)
                     self.objdat[key].extend(nightobjdat[nkey])
                     continue
         
@@ -2326,7 +2238,13 @@ class ProcScen:
             taxilayout(allnodes, alllinks, 0, self.output)
 
         # Do polygons
+        self.mergepolys()
         for (points, layer, heading, scale, tex) in self.polydat:
+            # Drop points in straight runs, and where UVs are interpolated
+            if heading==65535:
+                points=simplify(points, simplifyfudge, lambda p: p[0], None, lambda p: p[1:], 0.001)
+            else:
+                points=simplify(points, simplifyfudge, lambda p: p[0])
             (fname,ext)=splitext(basename(tex.d or tex.e))
             # base and lit textures may not have same case
             if fname[-3:].lower()=='_lm': fname=fname[:-3]+"_LIT"
@@ -2334,29 +2252,7 @@ class ProcScen:
                 fname+=ext[1:].lower()	# For *.xAF etc
             # Spaces not allowed in textures. Avoid Mac/PC interop problems
             fname=asciify(fname)
-            poly=Polygon(fname, tex, heading==65535, scale, layer)
-            if fname in self.output.polydat:
-                iname=fname
-                i=0
-                while True:
-                    # See if this is a duplicate
-                    if i:
-                        fname="%s-%d" % (iname, i)
-                        poly.name=fname
-                    if not fname in self.output.polydat:
-                        break	# no match - new object
-                    if poly==self.output.polydat[fname]:
-                        if self.output.xpver<9:
-                            # 8.60 has a bug with polygons at different layers
-                            # sharing textures, so use lowest layer
-                            if __debug__:
-                                if self.debug and poly.layer!=self.output.polydat[fname].layer: self.debug.write("!Flattened polygon %s layers %s and %s\n" % (fname, poly.layer, self.output.polydat[fname].layer))
-                            self.output.polydat[fname].layer=min(poly.layer,self.output.polydat[fname].layer)
-                        break	# matched - re-use this object
-                    i+=1
-                    
-            self.output.polydat[fname]=poly
-            self.output.polyplc.append((fname, heading, points))
+            self.placepoly(Polygon(fname, tex, heading==65535, scale, layer), heading, points)
 
 
         # Sort throught lights and geometry to create Objects.
@@ -2374,16 +2270,16 @@ class ProcScen:
             newmatrix=matrix
             heading=0
             
-            if loc and matrix and matrix.m[1][1]==1:	# No pitch or bank?
+            if loc and matrix and matrix.rows[1][1]==1:	# No pitch or bank?
                 # Rotate at placement time in hope of commonality with Objects produced in other Areas
                 heading=matrix.heading()
                 # unrotate translation
-                (x,y,z)=Matrix().headed(-heading).rotate(matrix.m[3][0], matrix.m[3][1], matrix.m[3][2])
+                (x,y,z)=Matrix().headed(-heading).rotate(matrix.rows[3][0], matrix.rows[3][1], matrix.rows[3][2])
                 scale2=scale/2.0
                 newmatrix=Matrix().offset(round(x+scale2-(x+scale2)%scale,3), round(y+scale2-(y+scale2)%scale,3), round(z+scale2-(z+scale2)%scale,3))	# round to nearest unit to encourage a match
                 if __debug__:
-                    if self.debug: self.debug.write("New heading %6.2f, offset (%7.3f,%7.3f,%7.3f) %s\n" % (heading, newmatrix.m[3][0], newmatrix.m[3][1], newmatrix.m[3][2], newmatrix.m==identity.m))
-                if newmatrix.m==identity.m: newmatrix=None
+                    if self.debug: self.debug.write("New heading %6.2f, offset (%7.3f,%7.3f,%7.3f) %s\n" % (heading, newmatrix.rows[3][0], newmatrix.rows[3][1], newmatrix.rows[3][2], newmatrix==identity))
+                if newmatrix==identity: newmatrix=None
 
             # Find existing Object at this location with same tex to consolidate
             okey=(loc, layer, altmsl, heading)
@@ -2416,40 +2312,31 @@ class ProcScen:
                     obj.veffect.append((x*scale,alt+y*scale,-z*scale, effect, s))
 
             if lkey in self.objdat:
+                if newmatrix: nrmmatrix=newmatrix.adjoint()
                 for (mat, vtx, idx) in self.objdat[lkey]:
-                    newvt=[]
-                    # Break out common cases for speed
+                    # Whole vertex list at once
+                    vtx=asarray(vtx, float).reshape(-1,8)
                     if newmatrix:
-                        nrmmatrix=newmatrix.adjoint()
-                        if not tex:
-                            (pu,pv)=rgb2uv(mat.d)
-                            for v in vtx:
-                                (x,y,z,nx,ny,nz,tu,tv)=v
-                                (x,y,z)=newmatrix.transform(x,y,z)
-                                (nx,ny,nz)=nrmmatrix.rotateAndNormalize(nx,ny,nz)
-                                # replace materials with palette texture
-                                newvt.append([x*scale,alt+y*scale,-z*scale, nx,ny,-nz, pu,pv])
-                        else:
-                            for v in vtx:
-                                (x,y,z,nx,ny,nz,tu,tv)=v
-                                (x,y,z)=newmatrix.transform(x,y,z)
-                                (nx,ny,nz)=nrmmatrix.rotateAndNormalize(nx,ny,nz)
-                                newvt.append([x*scale,alt+y*scale,-z*scale, nx,ny,-nz, tu,tv])
+                        xyz=newmatrix.transform_many(vtx[:,0:3])
+                        nrm=nrmmatrix.rotate_many(vtx[:,3:6], True)
                     else:
-                        for v in vtx:
-                            (x,y,z,nx,ny,nz,tu,tv)=v
-                            if not tex:
-                                # replace materials with palette texture
-                                (tu,tv)=rgb2uv(mat.d)
-                            newvt.append([x*scale,alt+y*scale,-z*scale, nx,ny,-nz, tu,tv])
-                        
+                        xyz=vtx[:,0:3]
+                        nrm=vtx[:,3:6]
+                    newvt=empty((len(vtx),8))
+                    newvt[:,0]=xyz[:,0]*scale
+                    newvt[:,1]=alt+xyz[:,1]*scale
+                    newvt[:,2]=-xyz[:,2]*scale
+                    newvt[:,3:5]=nrm[:,0:2]
+                    newvt[:,5]=-nrm[:,2]
+                    if tex:
+                        newvt[:,6:8]=vtx[:,6:8]
+                    else:
+                        newvt[:,6:8]=rgb2uv(mat.d)	# replace materials with palette texture
+
                     # Reverse order of individual tris
-                    newidx=[]
-                    for j in range(0,len(idx),3):
-                        for k in range(2,-1,-1):
-                            newidx.append(idx[j+k])
+                    newidx=asarray(idx, int).reshape(-1,3)[:,::-1].ravel().tolist()
 
-                    obj.addgeometry(mat, newvt, newidx)
+                    obj.addgeometry(mat, newvt.tolist(), newidx)
 
 
         # If altmsl adjust all objects with same placement to ground level
@@ -2476,24 +2363,20 @@ class ProcScen:
             else:
                 # Can have multiple objects at same loc, or same object at different locations, so place individually
                 for obj in objs[okey]:
-                    # See if this is a duplicate
-                    for old in self.objcache:
-                        if obj==old:
-                            if __debug__:
-                                if self.debug: self.debug.write("Dupe: %s and %s\n" % (obj.filename(1), old.filename(1)))
-                            self.output.objplc.append((loc, heading, self.complexity, old.filename(1), 1))
-                            break
-                        elif obj.filename(1)==old.filename(1):
-                            if __debug__:
-                                if self.debug: self.debug.write("!Couldn't merge %s\n" % obj.filename(1))
-                            obj.name+='x'	# Hack - different matrices at same loc eg LIEE2008 faro_icav
-                    else:
-                        assert obj.filename(1) not in self.output.objdat, obj.filename(1)	# object filenames must be unique
-                        if __debug__:
-                            if self.debug: self.debug.write("New: %s\n" % obj.filename(1))
-                        self.objcache.append(obj)
-                        self.output.objdat[obj.filename(1)]=[obj]
-                        self.output.objplc.append((loc, heading, self.complexity, obj.filename(1), 1))
+                    self.output.objplc.append((loc, heading, self.complexity, self.placeobj(obj), 1))
+
+
+    # Generated Object placed by makeobjs. Returns the name to place
+    def placeobj(self, obj):
+        return placeobj(obj, self.output)
+
+    # Polygon placed by makeobjs
+    def placepoly(self, poly, heading, points):
+        placepoly(poly, heading, points, self.output)
+
+    # Generic building made from args. Returns the name to place
+    def genericobj(self, args):
+        return genericobj(args, self.srcfile, self.gencache, self.output)
 
 
     def checkmsl(self):
@@ -2509,8 +2392,8 @@ class ProcScen:
     def getvar(self, var):
         if var in self.vars:
             val=self.vars[var]
-            if var==0x28c and self.vars[0x28c]==1:
-                self.neednight=True
+            if var==0x28c and val==1 and not self.neednight:
+                self.nightread=True	# see branchnight()
                 if __debug__:
                     if self.debug: self.debug.write('Need Night\n')
             return val
@@ -2591,6 +2474,390 @@ class ProcScen:
             return 0,0,0
 
 
+    # Handler and operands by opcode, built once. Operands are given by a
+    # struct format, a decoder function, or None if the handler reads them.
+    opcodes={0x02:(NOP, ''),
+             0x05:(Surface, ''),
+             0x06:(SPnt, '6x'),
+             0x07:(SPnt, '6x'),
+             0x08:(Closure, ''),
+             0x0d:(Jump, '<h'),
+             0x0e:(DefRes, '<H3h'),
+             0x0f:(StrRes, '<H'),
+             0x10:(CntRes, '<H'),
+             0x14:(SColor, '<H'),
+             0x17:(TextureEnable, '<H'),
+             0x18:(Texture, '<4h14s'),
+             0x1a:(ResList, reslist),
+             0x1b:(Jump, '<h'),
+             0x1c:(IfIn2, '<7h'),
+             0x1d:(FaceT, facet),
+             0x1e:(Haze, '<H'),
+             0x1f:(TaxiMarkings, taximarkings),
+             0x20:(FaceTTMap, facettmap),
+             0x21:(IfIn3, '<10h'),
+             0x22:(Return, ''),
+             0x23:(Call, '<h'),
+             0x24:(IfIn1, '<4h'),
+             0x25:(SeparationPlane, '<4hi'),
+             0x26:(SetWrd, '<2h'),
+             0x29:(GResList, greslist),
+             0x2a:(FaceT, facet),
+             0x2b:(Call32, '<i'),
+             0x2d:(SColor24, '4B'),
+             0x2e:(LColor24, '4B'),
+             0x2f:(Scale, None),
+             0x30:(NOP, '2x'),
+             0x32:(Call, '<h'),
+             0x33:(Instance, '<h3H'),
+             0x34:(SuperScale, '<6xH'),
+             0x35:(PntRow, '<6hH'),
+             0x37:(Point, '<3h'),
+             0x38:(Concave, ''),
+             0x39:(IfMsk, '<2hH'),
+             0x3b:(VInstance, '<hH'),
+             0x3c:(Position, None),
+             0x3e:(FaceT, facet),
+             0x3f:(NOP, '2x'),
+             0x40:(NOP, '10x'),
+             0x42:(TextureRunway, None),
+             0x43:(Texture2, texture2),
+             0x44:(TextureRunway, None),
+             0x46:(PointVICall, '<4h6H'),
+             0x49:(Building, '<8h'),
+             0x4c:(VScale, '<8xIh'),
+             0x4d:(MoveL2G, '<2H'),
+             0x4e:(MoveL2G, '<2H'),
+             0x50:(SColor, '<H'),
+             0x51:(LColor, '<H'),
+             0x52:(SColor, '<H'),
+             0x55:(SurfaceType, '<Hhhh'),
+             0x5d:(TextureRepeat, '<3h'),
+             0x5f:(NOP, '6x'),
+             0x62:(NOP, ifvis),
+             0x63:(LibraryCall, '<hIIII'),
+             0x69:(RoadStart, '<4h'),
+             0x6a:(RoadCont, '<3h'),
+             0x6b:(NOP, '8x'),
+             0x6c:(NOP, '6x'),
+             0x6d:(NOP, '6x'),
+             0x6e:(TaxiwayStart, '<4h'),
+             0x6f:(RoadCont, '<3h'),
+             0x70:(NOP, ifvis),
+             0x73:(Jump, '<h'),
+             0x74:(AddCat, '<2h'),
+             0x75:(Call, '<h'),
+             0x76:(NOP, ''),
+             0x77:(ScaleAGL, None),
+             0x7a:(FaceTTMap, facettmap),
+             0x7d:(NOP, ''),
+             0x80:(ResPnt, '<H'),
+             0x81:(NOP, '2x'),
+             0x83:(ReScale, '<6xI'),
+             0x88:(Jump32, '<i'),
+             0x89:(NOP, '4x'),
+             0x8a:(Call32, '<i'),
+             0x8b:(AddCat32, '<ih'),
+             0x8f:(NOP, '4x'),
+             0x93:(NOP, '2x'),
+             0x95:(NOP, '8x'),
+             0x96:(CrashStart, '<h'),
+             0x9e:(Interpolate, '18x'),
+             0x9f:(NOP, '4x'),
+             0xa0:(Object, None),
+             0xa4:(NOP, '2x'),
+             0xa6:(NOP, '6x'),
+             0xa7:(SpriteVICall, '<4h6H'),
+             0xa8:(TextureRoadStart, '<Hhhhh'),
+             0xaa:(NewRunway, None),
+             0xac:(ZBias, '<H'),
+             0xad:(Animate, '<16x3f'),
+             0xae:(TransformEnd, ''),
+             0xaf:(TransformMatrix, '<12f'),
+             0xb1:(NOP, '20x'),
+             0xb2:(Light, '<HfffI8x4B12x'),
+             0xb3:(IfInF1, '<2h2f'),
+             0xb4:(NOP, '4x'),
+             0xb5:(VertexList, vertexlist),
+             0xb6:(MaterialList, materiallist),
+             0xb7:(TextureList, texturelist),
+             0xb8:(SetMaterial, '<2h'),
+             0xb9:(DrawTriList, drawtrilist),
+             0xba:(DrawLineList, drawlinelist),
+             0xbc:(NOP, '4x'),
+             0xbd:(NOP, ''),
+             0xc4:(SetMatrixIndirect, '<H'),
+             }
+
+    # Handlers that can run in a memoised subroutine, ie that only emit
+    # geometry and lights or change state that enter() saves.
+    memopure=set([NOP, Surface, SPnt, Closure, Jump, Jump32, StrRes, CntRes, SColor, LColor,
+                  SColor24, LColor24, TextureEnable, Texture, Texture2, TextureList, MaterialList,
+                  SetMaterial, TextureRepeat, Haze, ZBias, Concave, IfIn1, IfIn2, IfIn3, IfInF1, IfMsk,
+                  SetWrd, MoveL2G, Call, Call32, Return, FaceT, FaceTTMap, DrawTriList, DrawLineList,
+                  Point, PntRow, ResPnt, Light, SeparationPlane, SurfaceType, CrashStart, Interpolate,
+                  TaxiMarkings])
+
+    # Conditionals whose only effect is to jump - see branchnight()
+    branches=set([IfIn1, IfIn2, IfIn3, IfInF1, IfMsk])
+
+    # Attributes that a night pass keeps from the day pass - see fork()
+    shared=['keys', 'memo', 'rec', 'vertices', 'polygons', 'vtxgen', 'neednight', 'nightread', 'nightfork', 'nightmark',
+            'dayloc', 'dayobjdat', 'daylightdat', 'dayeffectdat', 'daypolydat']
+
+
+# ProcScen in a worker process - see AreaResult. Naming generated Objects
+# and Polygons depends on what earlier areas generated, so they're recorded
+# for Parse to store in area order and placed under a placeholder name.
+class AreaScen(ProcScen):
+    def placeobj(self, obj):
+        return self.output.store('obj', obj)
+
+    def placepoly(self, poly, heading, points):
+        self.output.events.append(('poly', poly, heading, points))
+
+    def genericobj(self, args):
+        return self.output.store('generic', args)
+
+
+# Stands in for Output while interpreting areas in procareas, or a whole
+# BGL in convmain.procbgl. settings are from scensettings.
+class AreaResult:
+    areapool=None
+
+    def __init__(self, settings):
+        (self.xpver, self.addtexdir, self.registered, self.season, self.hemi,
+         self.friendly, self.stock, self.subst, self.xppath, debug, opprof)=settings
+        self.events=[]	# Log, debug, and Objects and Polygons to store, in order
+        self.objplc=[]	# As Output.objplc, but with placeholder names - see store()
+        self.misc=[]
+        self.haze={}
+        self.flags=None	# (old, rrt, anim) or None if the area couldn't be parsed
+        if debug:
+            self.debug=self
+        else:
+            self.debug=None
+        if opprof:
+            self.opprof=OpProfile()
+        else:
+            self.opprof=None
+
+    def log(self, msg):
+        self.events.append(('log', msg))
+
+    def refresh(self):
+        pass
+
+    # debug file interface
+    def write(self, msg):
+        self.events.append(('debug', msg))
+
+    # Object or generic building for Parse to store. Returns a placeholder
+    # name that can't clash with a real one.
+    def store(self, kind, arg):
+        name='\0%d\0' % len(self.events)
+        self.events.append((kind, name, arg))
+        return name
+
+    # Picklable side-effects, for replayscen
+    def result(self):
+        return (self.events, self.objplc, self.misc, self.haze, self.hemi, self.opprof and self.opprof.stats)
+
+
+# The parts of Output that ProcScen reads, for AreaResult
+def scensettings(output):
+    return (output.xpver, output.addtexdir, output.registered, output.season, output.hemi,
+            output.friendly, output.stock, output.subst, output.xppath, output.debug is not None, output.opprof is not None)
+
+
+# Apply the side-effects recorded in an AreaResult to output
+def replayscen(result, srcfile, gencache, output):
+    (events, objplc, misc, haze, hemi, stats)=result
+    names={}	# real names by placeholder
+    for event in events:
+        if event[0]=='log':
+            msg=event[1]
+            for (placeholder, name) in names.iteritems():
+                msg=msg.replace(placeholder, name)	# generic building names
+            output.log(msg)
+        elif event[0]=='debug':
+            if output.debug: output.debug.write(event[1])
+        elif event[0]=='obj':
+            names[event[1]]=placeobj(event[2], output)
+        elif event[0]=='generic':
+            names[event[1]]=genericobj(event[2], srcfile, gencache, output)
+        else:
+            placepoly(event[1], event[2], event[3], output)
+    output.objplc.extend([(loc, hdg, cmplx, names.get(name, name), scale) for (loc, hdg, cmplx, name, scale) in objplc])
+    output.misc.extend(misc)
+    output.haze.update(haze)
+    if hemi: output.hemi=1
+    if stats: output.opprof.merge(stats)
+
+
+# Interpret a batch of the areas of one BGL. Runs in a worker process,
+# so returns the result of each area for poolareas to replay in order.
+# Each area starts in the state the previous one left, as in runareas,
+# and the result records that state so poolareas can check it.
+def procareas(job):
+    (filename, srcfile, texdir, settings, areas, first)=job
+    bgl=BGLFile(filename)	# decoded code is shared by the batch
+    results=[]
+    hemi=None	# as left by the previous area
+    for (start, enda) in areas:
+        res=AreaResult(settings)
+        if hemi is not None: res.hemi=hemi
+        state=(first, res.hemi)
+        try:
+            bgl.seek(start)
+            p=AreaScen(bgl, enda, 1.0, None, srcfile, texdir, res, firstarea=first, gencache={})
+            res.flags=(p.old, p.rrt, p.anim)
+            first=False
+        except:
+            if res.debug: print_exc(None, res.debug)
+        hemi=res.hemi
+        results.append((state, res.flags, res.result()))
+    bgl.close()
+    return results
+
+
+# Area headers in section 9. Yields (position, length) with bgl at the
+# start of the area's instructions.
+def areatable(bgl, secbase, output):
+    while True:
+        # LatBand
+        posl=bgl.tell()
+        (c,)=bgl.unpack('<B')
+        if not c in [0, 21]:
+            if output.debug: output.debug.write("!Bogus LatBand %2x\n" % c)
+            raise struct.error	# wtf?
+        if c==0:
+            break
+        (foo,off)=bgl.unpack('<Ii')
+        bgl.seek(secbase+off)
+        while True:
+            # Header
+            posa=bgl.tell()
+            (c,)=bgl.unpack('<B')
+            bgl.read(9)
+            if c==0:
+                break
+            elif c in [6,9,12,14]:
+                (l,)=bgl.unpack('<I')
+            elif c in [5,8,11,13]:
+                (l,)=bgl.unpack('<H')
+            elif c in [4,7,10]:
+                (l,)=bgl.unpack('<B')
+            else:
+                if output.debug: output.debug.write("!Bogus area type %x\n"%c)
+                raise struct.error	# wtf?
+            yield (posa, l)
+            bgl.seek(posa+l)
+        bgl.seek(posl+9)
+
+
+# Interpret the areas of section 9 one after another.
+# Yields (position, (old, rrt, anim) or None if the area couldn't be parsed)
+def runareas(bgl, secbase, srcfile, texdir, output, gencache, scen):
+    first=True
+    for (posa, l) in areatable(bgl, secbase, output):
+        if __debug__:
+            if output.debug: output.debug.write("----\nArea %x\n" % posa)
+        try:
+            output.refresh()
+            p=scen(bgl, posa+l, 1.0, None, srcfile, texdir, output, firstarea=first, gencache=gencache)
+            flags=(p.old, p.rrt, p.anim)
+            first=False
+        except:
+            if output.debug: print_exc(None, output.debug)
+            flags=None
+        yield (posa, flags)
+
+
+# As runareas, but interpreting batches of areas in output.areapool.
+# Objects and Polygons are stored in area order so names and dedupe
+# come out as if the areas had been interpreted one after another.
+def poolareas(bgl, secbase, srcfile, texdir, output, gencache):
+    areas=[]	# (position, start, end)
+    try:
+        for (posa, l) in areatable(bgl, secbase, output):
+            areas.append((posa, bgl.tell(), posa+l))
+        bogus=False
+    except struct.error:
+        bogus=True	# do the areas before the bad header first, as runareas
+    settings=scensettings(output)
+    n=1+len(areas)/(4*output.workers)	# areas per batch
+    jobs=[(bgl.filename, srcfile, texdir, settings,
+           [(start, enda) for (posa, start, enda) in areas[i:i+n]], i==0) for i in range(0, len(areas), n)]
+    results=chain.from_iterable(output.areapool.imap(procareas, jobs))
+    first=True
+    for ((posa, start, enda), (state, flags, result)) in izip(areas, results):
+        if __debug__:
+            if output.debug: output.debug.write("----\nArea %x\n" % posa)
+        output.refresh()
+        if state!=(first, output.hemi):
+            # A batch doesn't know whether earlier batches' areas parsed
+            # or were in the southern hemisphere, so do this one again
+            [(state, flags, result)]=procareas((bgl.filename, srcfile, texdir, scensettings(output), [(start, enda)], first))
+        replayscen(result, srcfile, gencache, output)
+        if flags: first=False
+        yield (posa, flags)
+    if bogus: raise struct.error
+
+
+# Store a generated Object, using any identical Object from this or
+# earlier files. Returns the name to place.
+def placeobj(obj, output):
+    name=storeobj(obj, output)
+    if __debug__:
+        if output.debug:
+            if output.objdat[name][0] is obj:
+                output.debug.write("New: %s\n" % name)
+            else:
+                output.debug.write("Dupe: %s and %s\n" % (obj.filename(1), name))
+    return name
+
+
+# Place a Polygon, using any identical Polygon of the same name
+def placepoly(poly, heading, points, output):
+    fname=poly.name
+    if fname in output.polydat:
+        iname=fname
+        i=0
+        while True:
+            # See if this is a duplicate
+            if i:
+                fname="%s-%d" % (iname, i)
+                poly.name=fname
+            if not fname in output.polydat:
+                break	# no match - new object
+            if poly==output.polydat[fname]:
+                if output.xpver<9:
+                    # 8.60 has a bug with polygons at different layers
+                    # sharing textures, so use lowest layer
+                    if __debug__:
+                        if output.debug and poly.layer!=output.polydat[fname].layer: output.debug.write("!Flattened polygon %s layers %s and %s\n" % (fname, poly.layer, output.polydat[fname].layer))
+                    output.polydat[fname].layer=min(poly.layer,output.polydat[fname].layer)
+                break	# matched - re-use this object
+            i+=1
+
+    output.polydat[fname]=poly
+    output.polyplc.append((fname, heading, points))
+
+
+# Name of the generic building made from args, making it if it isn't
+# already in this BGL's gencache
+def genericobj(args, srcfile, gencache, output):
+    if args in gencache: return gencache[args]
+    name="%s-generic-%d" % (asciify(basename(srcfile)[:-4]), len(gencache)+1)
+    if len(args)==5:
+        obj=makegenmulti(name, output, *args)
+    else:
+        obj=makegenquad(name, output, *args)
+    name=gencache[args]=storeobj(obj, output, name)
+    return name
+
+
 # Handle miscellaneous section 16
 class ProcMisc:
     def __init__(self, bgl, srcfile, output):
@@ -2611,7 +2878,7 @@ class ProcMisc:
 
         while True:
             pos=bgl.tell()
-            (cmd,)=unpack('<B',bgl.read(1))
+            (cmd,)=bgl.unpack('<B')
             if cmd==0 or cmd==0x22:
                 return
             elif cmd in cmds:
@@ -2625,27 +2892,27 @@ class ProcMisc:
 
     def Marker(self):		# 04,05,06
         # Ignore - this data should be in XML
-        (size,)=unpack('<B',self.bgl.read(1))
+        (size,)=self.bgl.unpack('<B')
         self.bgl.seek(size-2,1)
 
     def Landme(self):		# 07
         # Ignore
-        (size,)=unpack('<B',self.bgl.read(1))
+        (size,)=self.bgl.unpack('<B')
         self.bgl.seek(size-2,1)
 
     def TimeZone(self):		# 64
         # Ignore
-        (size,)=unpack('<B',self.bgl.read(1))
+        (size,)=self.bgl.unpack('<B')
         self.bgl.seek(size-2,1)
 
     def Platform(self):		# 65
         # Ignore
-        (size,)=unpack('<B',self.bgl.read(1))
+        (size,)=self.bgl.unpack('<B')
         self.bgl.seek(size-2,1)
 
     def AreaSense(self):	# 70
         # Assume inside
-        (off,n)=unpack('<hH', self.bgl.read(4))
+        (off,n)=self.bgl.unpack('<hH')
         self.bgl.seek(4*n,1)	# skip
 
     def Reserved(self):		# a6
@@ -2653,10 +2920,10 @@ class ProcMisc:
         self.bgl.read(6)
 
     def Terrain(self):		# e6
-        (foo,size,op,n,alt)=unpack("<BIHHi", self.bgl.read(13))
+        (foo,size,op,n,alt)=self.bgl.unpack("<BIHHi")
         l=[]
         for i in range(n):
-            (lat,lon)=unpack("<ii", self.bgl.read(8))
+            (lat,lon)=self.bgl.unpack("<ii")
             lat*=360.0/(65536*65536)
             lon*=360.0/(65536*65536)
             if lat>180: lon-=360
@@ -2681,12 +2948,12 @@ class ProcMisc:
 # Handle exception section 19
 def ProcEx(bgl, output):
     while True:
-        (c,)=unpack('<B',bgl.read(1))
+        (c,)=bgl.unpack('<B')
         if c==0:
             return
         elif c==3:
             # Exclusion
-            (mask,n,s,e,w)=unpack('<H4I',bgl.read(18))
+            (mask,n,s,e,w)=bgl.unpack('<H4I')
             if __debug__:
                 if output.debug: output.debug.write("Exclude: %d\n" % mask)
             if mask&1:
@@ -2702,7 +2969,7 @@ def ProcEx(bgl, output):
                 #output.exc.append(('fac', Point(s,w), Point(n,e)))
         elif c==4:
             # Exception - ignore
-            (lat,lon,typ,sn,sf,snf)=unpack('<IIBBBB',bgl.read(12))
+            (lat,lon,typ,sn,sf,snf)=bgl.unpack('<IIBBBB')
             lat=lat*360.0/cirp
             lon=lon*360.0/0x100000000
             if lat>180: lat-=360
@@ -2716,11 +2983,11 @@ def ProcEx(bgl, output):
 
 # Handle terrain section 8
 def ProcTerrain(bgl, srcfile, output):
-    (size,ver)=unpack('<2I', bgl.read(8))
+    (size,ver)=bgl.unpack('<2I')
     if size!=0x64: raise struct.error
-    (reserved1,)=unpack('<I', bgl.read(4))	# No idea how to decode this
+    (reserved1,)=bgl.unpack('<I')	# No idea how to decode this
     bgl.seek(11*4,1)
-    (lwm,vtp)=unpack('<2I', bgl.read(8))
+    (lwm,vtp)=bgl.unpack('<2I')
     if lwm or vtp: output.log('Skipping terrain data in file %s' % asciify(basename(srcfile),False))
 
 
@@ -2730,10 +2997,10 @@ def subdivide(vtx):
     gluTessProperty(tessObj,GLU_TESS_WINDING_RULE,GLU_TESS_WINDING_NONZERO)
     gluTessCallback(tessObj,GLU_TESS_VERTEX_DATA,  tessvertex)
     gluTessCallback(tessObj,GLU_TESS_EDGE_FLAG,    tessedge)	# no strips
-    points=[]
+    weld=VertexWeld()
     idx=[]
     try:
-        gluTessBeginPolygon(tessObj, (points, idx))
+        gluTessBeginPolygon(tessObj, (weld, idx))
         gluTessBeginContour(tessObj)
         for vertex in vtx:
             (x,y,z, nx,ny,nz, tu, tv)=vertex
@@ -2744,28 +3011,54 @@ def subdivide(vtx):
         gluDeleteTess(tessObj)
         raise GLUerror
     gluDeleteTess(tessObj)        
-    return points,idx
+    return weld.points,idx
 
 def tessedge(flag):
     pass	# dummy
 
-def tessvertex(vertex, (points, idx)):
-    if vertex in points:
-        idx.append(points.index(vertex))
+def tessvertex(vertex, (weld, idx)):
+    idx.append(weld.add(vertex))
+
+
+# Distinct vertices in the order first seen. Equal vertices are welded.
+class VertexWeld:
+    def __init__(self):
+        self.points=[]
+        self.index={}	# index in points by vertex
+
+    def add(self, vertex):
+        i=self.index.get(vertex)
+        if i is None:
+            i=self.index[vertex]=len(self.points)
+            self.points.append(vertex)
+        return i
+
+
+# Texture folder for the BGL srcfile, as passed to ProcScen
+def bgltexdir(srcfile, inventory):
+    texdir=normpath(join(dirname(srcfile), pardir))
+    # For case-sensitive filesystems
+    d=inventory.find(texdir, 'texture')
+    if d:
+        return maketexdict(join(texdir, d), inventory)
     else:
-        idx.append(len(points))
-        points.append(vertex)
+        return None
 
 
 # Helper makes dict of form lowercasename: realname
-def maketexdict(texdir):
+def maketexdict(texdir, inventory=None):
     if not texdir: return None
+    if inventory:
+        if texdir in inventory.texdicts: return inventory.texdicts[texdir]
+        names=inventory.listdir(texdir)
+    else:
+        names=listdir(texdir)
 
     # Handle unicode
     if type(texdir)==types.UnicodeType:
-        f=[normalize(name) for name in listdir(texdir)]
+        f=[normalize(name) for name in names]
     else:
-        f=listdir(texdir)
+        f=names
 
     d=dict([(name.lower(),name) for name in f])
 
@@ -2774,7 +3067,8 @@ def maketexdict(texdir):
         aname=asciify(name).lower()
         if aname not in d:
             d[aname]=name
-    
+
+    if inventory: inventory.texdicts[texdir]=(texdir, d)
     return texdir, d
 
 
@@ -0,0 +1,155 @@
+#
+# Clipping of draped polygons to 1x1 degree tiles.
+#
+# A polygon is a list of windings [exterior, hole, ...], each a list of
+# (Point, u, v), with the exterior anticlockwise and holes clockwise. Where
+# an edge crosses a tile border the new point's UVs are interpolated along
+# the edge.
+#
+
+from math import ceil, floor
+
+from convutil import Point
+
+
+# Tiles covered by a polygon's exterior: (south, north, west, east)
+def tilebounds(points):
+    lats=[p[0].lat for p in points[0]]
+    lons=[p[0].lon for p in points[0]]
+    (s,w)=(int(floor(min(lats))), int(floor(min(lons))))
+    return (s, max(s, int(ceil(max(lats)))-1), w, max(w, int(ceil(max(lons)))-1))
+
+
+# Split a polygon into polygons that each lie within one tile
+def cliptiles(points):
+    (s,n,w,e)=tilebounds(points)
+    if s==n and w==e: return [points]	# doesn't straddle a tile border
+    polys=[]
+    for strip in bands([points], 'lat', s, n):
+        for band in bands(strip, 'lon', w, e):
+            polys.extend(band)
+    return polys
+
+
+# Split polygons at the tile borders between tiles lo and hi on one axis.
+# Returns [[polygon] in each tile]
+def bands(polys, axis, lo, hi):
+    result=[]
+    for border in range(lo+1, hi+1):
+        result.append([piece for points in polys for piece in clip(points, axis, border, False)])
+        polys=[piece for points in polys for piece in clip(points, axis, border, True)]
+    result.append(polys)
+    return result
+
+
+# Clip a polygon to one side of the line where axis ('lat' or 'lon') is
+# border - the side above the border if above. Returns [polygon]
+def clip(points, axis, border, above):
+    if above:
+        side=lambda p: getattr(p[0], axis)-border
+    else:
+        side=lambda p: border-getattr(p[0], axis)
+    inside=[[side(p)>=0 for p in w] for w in points]
+    if not False in inside[0]: return [points]
+    if not True in inside[0]: return []
+
+    # Pieces of the windings that are inside, from where they enter to where
+    # they leave
+    chains=[]
+    holes=[]
+    for (w, ins) in zip(points, inside):
+        if not False in ins:
+            holes.append(w)
+            continue
+        n=len(w)
+        start=ins.index(False)
+        chain=None
+        for j in range(start+1, start+n+1):
+            (p,q)=(w[(j-1)%n], w[j%n])
+            if ins[j%n]:
+                if chain is None: chain=[cut(p, q, side, axis, border)]
+                chain.append(q)
+            elif chain is not None:
+                chain.append(cut(p, q, side, axis, border))
+                chains.append(chain)
+                chain=None
+
+    # Join each chain to the next along the border with the inside on the
+    # left. Leaving and entering points alternate along the border. Where
+    # chains meet the border at the same point, order them by where they
+    # would cross a line just inside the border.
+    other=(axis=='lat' and 'lon' or 'lat')
+    sign=((axis=='lat')==above and 1 or -1)
+    pos=lambda p: sign*getattr(p[0], other)
+    def order(end, near):
+        for q in near:
+            if side(q)>0: return (pos(end), (pos(q)-pos(end))/side(q))
+        return (pos(end), 0)
+    leave=sorted(range(len(chains)), key=lambda i: order(chains[i][-1], reversed(chains[i][:-1])))
+    enter=sorted(range(len(chains)), key=lambda i: order(chains[i][0], chains[i][1:]))
+    nextchain=dict(zip(leave, enter))
+
+    polys=[]
+    done=set()
+    for i in range(len(chains)):
+        if i in done: continue
+        w=[]
+        while i not in done:
+            done.add(i)
+            for p in chains[i]:
+                if not w or (p[0].lat,p[0].lon)!=(w[-1][0].lat,w[-1][0].lon): w.append(p)
+            i=nextchain[i]
+        if len(w)>1 and (w[0][0].lat,w[0][0].lon)==(w[-1][0].lat,w[-1][0].lon): w.pop()
+        if len(w)>=3 and area2(w)>0: polys.append([w])
+
+    # Holes that lie wholly inside go with the piece that contains them
+    addholes(polys, holes)
+    return polys
+
+
+# Add each hole to the smallest polygon that contains it. Holes can touch
+# exteriors, so go by the polygon that contains most of the hole's points
+# and the midpoints of its edges.
+def addholes(polys, holes):
+    for hole in holes:
+        if len(polys)==1:
+            polys[0].append(hole)
+            continue
+        n=len(hole)
+        locs=[(p[0].lat, p[0].lon) for p in hole]+[((hole[j-1][0].lat+hole[j][0].lat)*0.5, (hole[j-1][0].lon+hole[j][0].lon)*0.5) for j in range(n)]
+        best=None
+        for poly in polys:
+            votes=len([1 for (lat,lon) in locs if contains(poly[0], lat, lon)])
+            if votes and (best is None or (votes, -area2(poly[0]))>best[0]): best=((votes, -area2(poly[0])), poly)
+        if best: best[1].append(hole)
+
+
+# Point where the edge p-q crosses the border
+def cut(p, q, side, axis, border):
+    (sp,sq)=(side(p), side(q))
+    if sp==0: return p
+    if sq==0: return q
+    t=float(sp)/(sp-sq)
+    ((lp,up,vp),(lq,uq,vq))=(p,q)
+    if axis=='lat':
+        loc=Point(border, lp.lon+t*(lq.lon-lp.lon))
+    else:
+        loc=Point(lp.lat+t*(lq.lat-lp.lat), border)
+    return (loc, up+t*(uq-up), vp+t*(vq-vp))
+
+
+# Twice the area of a winding. Positive = anticlockwise
+def area2(w):
+    n=len(w)
+    return sum([w[j-1][0].lon*w[j][0].lat - w[j][0].lon*w[j-1][0].lat for j in range(n)])
+
+
+# Whether a location is inside a winding, by crossings
+def contains(w, lat, lon):
+    c=False
+    n=len(w)
+    for j in range(n):
+        (p,q)=(w[j-1][0], w[j][0])
+        if (p.lat<=lat)!=(q.lat<=lat) and p.lon+(lat-p.lat)*(q.lon-p.lon)/(q.lat-p.lat)>lon:
+            c=not c
+    return c
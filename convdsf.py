@@ -0,0 +1,176 @@
+#
+# Write overlay DSFs directly, rather than via DSF2TEXT and DSFTool.
+#
+# Points are quantised onto the same grid that DSFTool uses: each tile is
+# split into divisions x divisions point pools with 65535 steps across each
+# pool, and values are rounded down. Polygons that straddle a division go in
+# the smallest enclosing aligned pool of 2x2, 4x4, ... divisions.
+#
+
+from array import array
+from math import floor
+from struct import pack
+from sys import byteorder
+try:
+    from hashlib import md5
+except ImportError:	# Python<2.5
+    from md5 import new as md5
+
+from convutil import FS2XError
+
+maxpool=65535		# Point indices are 16bit
+
+
+def atom(name, data):
+    return name[::-1]+pack('<I', 8+len(data))+data
+
+def strings(strs):
+    return ''.join([s.encode('latin1','replace')+'\0' for s in strs])
+
+
+# 16bit point pool with planes [lon, lat, ...]
+class Pool:
+    def __init__(self, planes, offsets, scales):
+        self.planes=planes
+        self.offsets=offsets	# None = take range from the points
+        self.scales=scales
+        self.points=[]
+
+    def add(self, points):
+        first=len(self.points)
+        self.points.extend(points)
+        return first
+
+    def atoms(self):
+        offsets=list(self.offsets)
+        scales=list(self.scales)
+        for plane in range(len(offsets)):
+            if offsets[plane] is None:
+                vals=[p[plane] for p in self.points]
+                offsets[plane]=min(vals)
+                scales[plane]=(max(vals)-offsets[plane]) or 1.0
+        data=pack('<IB', len(self.points), self.planes)
+        for plane in range(self.planes):
+            off=offsets[plane]
+            scale=65535/scales[plane]
+            if self.offsets[plane] is None:
+                a=array('H', [max(0, min(65535, int((p[plane]-off)*scale+0.5))) for p in self.points])
+            else:	# round down, as DSFTool
+                a=array('H', [max(0, min(65535, int(floor((p[plane]-off)*scale)))) for p in self.points])
+            if byteorder=='big': a.byteswap()
+            data+='\0'+a.tostring()	# raw encoding
+        return (atom('POOL', data),
+                atom('SCAL', ''.join([pack('<ff', scales[i], offsets[i]) for i in range(self.planes)])))
+
+
+class Pools:
+    def __init__(self, sw, divisions):
+        self.sw=sw
+        self.divisions=divisions
+        self.pools=[]
+        self.current={}	# index of pool being filled, by (planes, depth, x, y)
+
+    # Returns (pool index, first point index)
+    def add(self, points):
+        planes=len(points[0])
+        xs=[min(int((p[0]-self.sw.lon)*self.divisions), self.divisions-1) for p in points]
+        ys=[min(int((p[1]-self.sw.lat)*self.divisions), self.divisions-1) for p in points]
+        (x0, x1, y0, y1)=(min(xs), max(xs), min(ys), max(ys))
+        depth=0
+        while (x0>>depth)!=(x1>>depth) or (y0>>depth)!=(y1>>depth):
+            depth+=1
+        size=float(1<<depth)/self.divisions
+        key=(planes, depth, x0>>depth, y0>>depth)
+        if key in self.current and len(self.pools[self.current[key]].points)+len(points)<=maxpool:
+            i=self.current[key]
+        else:
+            offsets=[self.sw.lon+(x0>>depth)*size, self.sw.lat+(y0>>depth)*size]
+            scales=[size, size]
+            if planes==3:	# object heading
+                offsets.append(0.0)
+                scales.append(360.0)
+            else:		# polygon UVs
+                offsets.extend([None]*(planes-2))
+                scales.extend([None]*(planes-2))
+            i=self.current[key]=len(self.pools)
+            self.pools.append(Pool(planes, offsets, scales))
+        return (i, self.pools[i].add(points))
+
+
+# props:	[(name, value)]
+# objdefs, polydefs:	[filename]
+# objects:	[(def index, lon, lat, heading)]
+# polygons:	[(def index, param, [[(lon, lat) or (lon, lat, u, v)]])]
+def writedsf(dsfname, sw, divisions, props, objdefs, polydefs, objects, polygons):
+    pools=Pools(sw, divisions)
+    objplc=[]
+    for (idx, lon, lat, heading) in sorted(objects, key=lambda o: o[0]):
+        (pool, first)=pools.add([(lon, lat, heading)])
+        objplc.append((pool, idx, first))
+    polyplc=[]
+    for (idx, param, windings) in polygons:
+        if len(windings)>255:
+            raise FS2XError("Can't write DSF %s: Polygon has too many windings" % dsfname)
+        points=[p for w in windings for p in w]
+        if not points: continue
+        if len(points)>maxpool:
+            raise FS2XError("Can't write DSF %s: Polygon has too many points" % dsfname)
+        (pool, first)=pools.add(points)
+        polyplc.append((pool, idx, param, first, [len(w) for w in windings]))
+
+    # Commands
+    cmds=[]
+    state=[None, None]	# pool, definition
+    def select(pool, idx):
+        if pool!=state[0]:
+            cmds.append(pack('<BH', 1, pool))
+            state[0]=pool
+        if idx!=state[1]:
+            if idx<0x100:
+                cmds.append(pack('<BB', 3, idx))
+            elif idx<0x10000:
+                cmds.append(pack('<BH', 4, idx))
+            else:
+                cmds.append(pack('<BI', 5, idx))
+            state[1]=idx
+
+    objplc.sort()	# so that placements form ranges
+    i=0
+    while i<len(objplc):
+        (pool, idx, first)=objplc[i]
+        j=i+1
+        while j<len(objplc) and objplc[j]==(pool, idx, first+j-i): j+=1
+        select(pool, idx)
+        if j-i==1:
+            cmds.append(pack('<BH', 7, first))
+        else:
+            cmds.append(pack('<BHH', 8, first, first+j-i))
+        i=j
+    state[1]=None	# object and polygon definitions are separate
+    for (pool, idx, param, first, counts) in polyplc:
+        select(pool, idx)
+        if len(counts)==1:
+            cmds.append(pack('<BHHH', 13, param, first, first+counts[0]))
+        else:
+            cmds.append(pack('<BHB', 15, param, len(counts)))
+            for n in counts:
+                cmds.append(pack('<H', first))
+                first+=n
+            cmds.append(pack('<H', first))
+
+    geod=[]
+    for pool in pools.pools:
+        geod.extend(pool.atoms())
+    data=('XPLNEDSF'+pack('<I', 1)+
+          atom('HEAD', atom('PROP', strings([s for prop in props for s in prop])))+
+          atom('DEFN', atom('TERT', '')+atom('OBJT', strings(objdefs))+
+               atom('POLY', strings(polydefs))+atom('NETW', ''))+
+          atom('GEOD', ''.join(geod))+
+          atom('CMDS', ''.join(cmds)))
+    try:
+        f=file(dsfname, 'wb')
+        f.write(data)
+        f.write(md5(data).digest())
+        f.close()
+    except IOError, e:
+        raise FS2XError("Can't write DSF %s: %s" % (dsfname, e.strerror))
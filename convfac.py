@@ -0,0 +1,551 @@
+#
+# Decode FS2004 & FSX facility data BGLs directly.
+#
+# Generates the same elements and attribute strings as "bglxml -t" would
+# write, for replay through convxml.Parse. Anything that we don't understand
+# raises Unsupported so that the caller can fall back to bglxml.
+#
+
+import struct	# for struct.error
+from struct import unpack_from
+
+from convutil import BGLFile
+
+
+class Unsupported(Exception):
+    pass
+
+
+# bglxml's enumerations
+surfacenames=['CONCRETE', 'GRASS', 'WATER', 'UNKNOWN', 'ASPHALT', 'UNKNOWN',
+              'UNKNOWN', 'CLAY', 'SNOW', 'ICE', 'UNKNOWN', 'UNKNOWN', 'DIRT',
+              'CORAL', 'GRAVEL', 'OIL_TREATED', 'STEEL_MATS', 'BITUMINOUS',
+              'BRICK', 'MACADAM', 'PLANKS', 'SAND', 'SHALE', 'TARMAC',
+              'UNKNOWN']
+designatornames=['NONE', 'LEFT', 'RIGHT', 'CENTER', 'WATER', 'A']
+compassnames=['NORTH', 'NORTHEAST', 'EAST', 'SOUTHEAST', 'SOUTH', 'SOUTHWEST',
+              'WEST', 'NORTHWEST']
+levelnames=['NONE', 'LOW', 'MEDIUM', 'HIGH']
+vasinames=['NONE', 'VASI21', 'VASI31', 'VASI22', 'VASI32', 'VASI23', 'VASI33',
+           'PAPI2', 'PAPI4', 'TRICOLOR', 'PVASI', 'TVASI', 'BALL', 'APAP']
+approachnames=['NONE', 'ODALS', 'MALSF', 'MALSR', 'SSALF', 'SSALR', 'ALSF1',
+               'ALSF2', 'RAIL', 'CALVERT', 'CALVERT2', 'MALS', 'SALS', 'SALSF',
+               'SSALS', 'SSALS']
+comnames=[' ', 'ATIS', 'MULTICOM', 'UNICOM', 'CTAF', 'GROUND', 'TOWER',
+          'CLEARANCE', 'APPROACH', 'DEPARTURE', 'CENTER', 'FSS', 'AWOS', 'ASOS',
+          'CLEARANCE_PRE_TAXI', 'REMOTE_CLEARANCE_DELIVERY']
+helipadnames=['NONE', 'H', 'SQUARE', 'CIRCLE', 'MEDICAL']
+pointnames=[None, 'NORMAL', 'HOLD_SHORT', 'UNKNOWN', 'ILS_HOLD_SHORT',
+            'HOLD_SHORT_NO_DRAW', 'ILS_HOLD_SHORT_NO_DRAW']
+pathnames=[None, 'TAXI', 'RUNWAY', 'PARKING', 'PATH', 'CLOSED', 'VEHICLE']
+parkingnames=['NONE', 'PARKING', 'N_PARKING', 'NE_PARKING', 'E_PARKING',
+              'SE_PARKING', 'S_PARKING', 'SW_PARKING', 'W_PARKING',
+              'NW_PARKING', 'GATE', 'DOCK']
+parkingtypes=['NONE', 'RAMP_GA', 'RAMP_GA_SMALL', 'RAMP_GA_MEDIUM',
+              'RAMP_GA_LARGE', 'RAMP_CARGO', 'RAMP_MIL_CARGO',
+              'RAMP_MIL_COMBAT', 'GATE_SMALL', 'GATE_MEDIUM', 'GATE_HEAVY',
+              'DOCK_GA', 'FUEL', 'VEHICLE']
+pushbacknames=['NONE', 'LEFT', 'RIGHT', 'BOTH']
+vornames=[' ', 'TERMINAL', 'LOW', 'HIGH', ' ', 'VOT']
+ndbnames=['COMPASS_POINT', 'MH', 'H', 'HH']
+markernames=['INNER', 'MIDDLE', 'OUTER', 'BACKCOURSE']
+complexitynames=['VERY_SPARSE', 'SPARSE', 'NORMAL', 'DENSE', 'VERY_DENSE',
+                 'EXTREMELY_DENSE']
+regionchars='  0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+# Returns a list of (name, attrs) element starts and (name, None) element
+# ends, or None if bglxml is needed.
+def decode(bglname, output):
+    try:
+        return Decode(bglname).elems
+    except (Unsupported, struct.error, IndexError), e:
+        if output.debug: output.debug.write('%s\nUsing bglxml: %s\n' % (bglname.encode("latin1", 'replace'), e))
+        return None
+
+
+# Field formatting, as bglxml
+def lat(v):
+    return '%0.6f' % (90.0-v*(180.0/0x20000000))
+
+def lon(v):
+    return '%0.6f' % (v*(360.0/0x30000000)-180.0)
+
+def alt(v):
+    return '%0.2f' % (v*0.001)
+
+def magvar(v):
+    if v>=180: v-=360
+    return '%0.2f' % v
+
+def tf(v):
+    return v and 'TRUE' or 'FALSE'
+
+def enum(names, i):
+    if i>=len(names) or names[i] is None:
+        raise Unsupported('value %d' % i)
+    return names[i]
+
+def surface(i):
+    if i==0xfe: i=24
+    return enum(surfacenames, i)
+
+def rwnumber(i):
+    if i==0: return '36'
+    if i<=36: return '%02d' % i
+    return enum(compassnames, i-37)
+
+def ident(v, packed=True):
+    if packed: v=(v&0xfffffff0)>>5
+    s=''
+    while v:
+        d=v%38
+        if d<=11:
+            s=chr(d+0x2e)+s
+        else:
+            s=chr(d+0x35)+s
+        v//=38
+    return s or '0'
+
+def region(v):
+    if v>0x5a3: v&=0x7ff
+    if not v: return ''
+    if 2<=v<=0x5a3:
+        s=regionchars[v//38]+regionchars[v%38]
+    else:
+        s='AA'
+    return s.lstrip(' ')
+
+def string(s):
+    for i in range(len(s)):
+        if s[i]<' ':
+            s=s[:i]
+            break
+    return unicode(s, 'latin_1')
+
+def guid(data, off):
+    (a,b,c)=unpack_from('<IHH', data, off)
+    d=unpack_from('<8B', data, off+8)
+    return '{%08x-%04x-%04x-%02x%02x-%02x%02x%02x%02x%02x%02x}' % ((a,b,c)+d)
+
+
+class Decode:
+    def __init__(self, bglname):
+        bgl=BGLFile(bglname)
+        self.data=bgl.data
+        self.elems=[]
+        self.ils=[]		# (ident, elems) in file order
+        self.signs=False	# taxiway signs are placed in airports by bglxml
+        try:
+            self.decode()
+        finally:
+            self.data=''	# so that the file isn't held open
+            bgl.close()
+
+    def decode(self):
+        (hdrsize,)=unpack_from('<I', self.data, 4)	# section table follows
+        (nsect,)=unpack_from('<I', self.data, 0x14)
+        sections=[]
+        for i in range(nsect):
+            (stype, unk, nsub, suboff, size)=unpack_from('<5I', self.data, hdrsize+20*i)
+            for j in range(nsub):
+                (subid, count, off, size)=unpack_from('<4I', self.data, suboff+16*j)
+                sections.append((stype, count, off, size))
+        sections.sort(key=lambda s: s[0])	# bglxml processes in type order
+
+        # Collect ILSs first for attaching to runways
+        for (stype, count, off, size) in sections:
+            if stype==0x13:
+                for rec in self.records(off, size, 0x13):
+                    if ord(self.data[rec+6])==4: self.ils.append(self.Ils(rec))
+
+        for (stype, count, off, size) in sections:
+            if stype==0x03:
+                for rec in self.records(off, size):
+                    self.Airport(rec)
+            elif stype==0x13:
+                for rec in self.records(off, size, 0x13):
+                    if ord(self.data[rec+6])!=4: self.Vor(rec)
+            elif stype==0x17:
+                for rec in self.records(off, size, 0x17):
+                    self.Ndb(rec)
+            elif stype==0x18:
+                for rec in self.records(off, size, 0x18):
+                    self.Marker(rec)
+            elif stype==0x25:
+                rec=off
+                while rec<off+size:
+                    (rid, rsize)=unpack_from('<HH', self.data, rec)
+                    if rsize<4: raise Unsupported('object length %d' % rsize)
+                    self.SceneryObject(rec, rid, rsize)
+                    rec+=rsize
+            elif stype==0x2e:
+                for i in range(count):
+                    self.ExclusionRectangle(off+0x14*i)
+            # Waypoints, boundaries, name lists and ModelData aren't used
+        if self.signs: raise Unsupported('TaxiwaySign')
+
+    def records(self, off, size, rid=None):
+        rec=off
+        while rec<off+size:
+            (i, rsize)=unpack_from('<HI', self.data, rec)
+            if (rid is not None and i!=rid) or rsize<6:
+                raise Unsupported('record 0x%x' % i)
+            yield rec
+            rec+=rsize
+
+    def subrecords(self, rec, end):
+        while rec<end:
+            (i, rsize)=unpack_from('<HI', self.data, rec)
+            if rsize<6: raise Unsupported('record 0x%x' % i)
+            yield (rec, i, rsize)
+            rec+=rsize
+
+    def name(self, rec, size, cap):
+        return string(self.data[rec+6:rec+6+min(size-6, cap)])
+
+    def start(self, name, attrs):
+        self.elems.append((name, attrs))
+
+    def end(self, name):
+        self.elems.append((name, None))
+
+    def leaf(self, name, attrs):
+        self.elems.extend([(name, attrs), (name, None)])
+
+    def Airport(self, rec):
+        data=self.data
+        (rid, rsize)=unpack_from('<HI', data, rec)
+        if rid==0x03:
+            sub=rec+0x34
+        elif rid==0x3c:	# FSX
+            sub=rec+0x38
+        else:
+            raise Unsupported('airport 0x%x' % rid)
+        (x, y, z, tx, ty, tz, mag, aid)=unpack_from('<6ifI', data, rec+0xc)
+        (i, size)=unpack_from('<HI', data, sub)
+        if i==0x33:	# DeleteAirport
+            sub+=size
+            (i, size)=unpack_from('<HI', data, sub)
+        self.start('Airport', {'ident':ident(aid), 'name':self.name(sub, size, size),
+                               'lat':lat(y), 'lon':lon(x),
+                               'magvar':magvar(mag), 'alt':alt(z)})
+        sub+=size
+
+        if ty!=0x10000000 and tx!=0x18000000:
+            if sub<rec+rsize and unpack_from('<H', data, sub)[0]==0x66:
+                raise Unsupported('Tower scenery')
+            self.leaf('Tower', {'lat':lat(ty), 'lon':lon(tx), 'alt':alt(tz or z)})
+
+        subs=list(self.subrecords(sub, rec+rsize))
+        for j in range(len(subs)):
+            (sub, i, size)=subs[j]
+            if i==0x04:
+                self.Runway(sub, size)
+            elif i==0x12:
+                (ctype, freq)=unpack_from('<HI', data, sub+6)
+                self.leaf('Com', {'frequency':'%0.3f' % (freq*0.000001),
+                                  'type':enum(comnames, ctype),
+                                  'name':string(data[sub+0xc:sub+size])})
+            elif i==0x1a:
+                (count,)=unpack_from('<H', data, sub+6)
+                for k in range(count):
+                    (ptype, orient, unk, x, y)=unpack_from('<BBHii', data, sub+8+12*k)
+                    self.leaf('TaxiwayPoint', {'index':str(k),
+                                               'type':enum(pointnames, ptype),
+                                               'orientation':orient==1 and 'REVERSE' or 'FORWARD',
+                                               'lat':lat(y), 'lon':lon(x)})
+            elif i in [0x1b, 0x3d]:
+                self.TaxiwayParking(sub, i)
+            elif i==0x1c:
+                self.TaxiwayPath(sub)
+            elif i==0x1d:
+                (count,)=unpack_from('<H', data, sub+6)
+                for k in range(count):
+                    n=data[sub+8+8*k:sub+16+8*k].split('\0')[0]
+                    self.leaf('TaxiName', {'index':str(k), 'name':unicode(n, 'latin_1')})
+            elif i==0x26:
+                (surf, flags, unk, x, y, z, length, width, heading)=unpack_from('<BBIiiifff', data, sub+6)
+                self.leaf('Helipad', {'lat':lat(y), 'lon':lon(x), 'alt':alt(z),
+                                      'surface':surface(surf),
+                                      'heading':'%0.2f' % heading,
+                                      'length':'%0.2f' % length,
+                                      'width':'%0.2f' % width,
+                                      'closed':tf(flags&0x20),
+                                      'transparent':tf(flags&0x10),
+                                      'type':enum(helipadnames, flags&0xf)})
+            elif i==0x31:
+                self.ApronEdgeLights(sub)
+            elif i==0x37:
+                flags=0
+                if j+1<len(subs) and subs[j+1][1]==0x30:
+                    flags=ord(data[subs[j+1][0]+7])
+                (surf, count)=unpack_from('<BH', data, sub+6)
+                self.start('Aprons', {})
+                self.start('Apron', {'surface':surface(surf),
+                                     'drawSurface':tf(flags&1),
+                                     'drawDetail':tf(flags&2)})
+                for k in range(count):
+                    (x, y)=unpack_from('<ii', data, sub+9+8*k)
+                    self.leaf('Vertex', {'lat':lat(y), 'lon':lon(x)})
+                self.end('Apron')
+                self.end('Aprons')
+            elif i==0x30:
+                if j==0 or subs[j-1][1]!=0x37: raise Unsupported('record 0x30')
+            elif i in [0x38, 0x39]:
+                name=i==0x38 and 'BlastFence' or 'BoundaryFence'
+                (count,)=unpack_from('<H', data, sub+6)
+                self.start(name, {'instanceId':guid(data, sub+8),
+                                  'profile':guid(data, sub+0x18)})
+                for k in range(count):
+                    (x, y)=unpack_from('<ii', data, sub+0x28+8*k)
+                    self.leaf('Vertex', {'lat':lat(y), 'lon':lon(x)})
+                self.end(name)
+            elif i in [0x11, 0x24, 0x33]:
+                pass	# Start, Approach & DeleteAirport aren't used
+            else:
+                raise Unsupported('airport record 0x%x' % i)
+        self.end('Airport')
+
+    def Runway(self, rec, rsize):
+        data=self.data
+        (surf, number, pdes, unk, sdes, pils, sils, x, y, z, length, width, heading, pattern, markings, lights, flags)=unpack_from('<HBBBBIIiiiffffHBB', data, rec+6)
+        attrs={'lat':lat(y), 'lon':lon(x), 'alt':alt(z),
+               'surface':surface(surf), 'heading':'%0.2f' % heading,
+               'length':'%0.2f' % length, 'width':'%0.2f' % width,
+               'number':rwnumber(number),
+               'patternAltitude':'%0.2f' % pattern}
+        if (pdes==sdes==0) or pdes^sdes==3 or (pdes==sdes and pdes in [3,4]):
+            attrs['designator']=enum(designatornames, pdes)
+        else:
+            attrs['primaryDesignator']=enum(designatornames, pdes)
+            attrs['secondaryDesignator']=enum(designatornames, sdes)
+        self.start('Runway', attrs)
+
+        if markings:
+            self.leaf('Markings', dict([(k, tf(markings&(1<<b))) for (b,k) in enumerate(['edges', 'threshold', 'fixedDistance', 'touchdown', 'dashes', 'ident', 'precision', 'edgePavement', 'singleEnd', 'primaryClosed', 'secondaryClosed', 'primaryStol', 'secondaryStol'])]))
+        if lights:
+            attrs={'centerRed':tf(lights&0x10)}
+            if lights&0xc: attrs['center']=levelnames[(lights>>2)&3]
+            if lights&3: attrs['edge']=levelnames[lights&3]
+            self.leaf('Lights', attrs)
+
+        for (sub, i, size) in self.subrecords(rec+0x34, rec+rsize):
+            end=(i&1) and 'PRIMARY' or 'SECONDARY'
+            if 5<=i<=10:
+                (surf, length)=unpack_from('<Hf', data, sub+6)
+                self.leaf(['OffsetThreshold', 'BlastPad', 'Overrun'][(i-5)/2],
+                          {'end':end, 'surface':surface(surf),
+                           'length':'%0.2f' % length,
+                           'width':'%0.2f' % length})	# sic
+            elif 0xb<=i<=0xe:
+                (vtype, x, z, spacing, pitch)=unpack_from('<Hffff', data, sub+6)
+                self.leaf('Vasi', {'end':i<=0xc and 'PRIMARY' or 'SECONDARY',
+                                   'side':(i&1) and 'LEFT' or 'RIGHT',
+                                   'type':enum(vasinames, vtype),
+                                   'biasX':'%0.2f' % x, 'biasZ':'%0.2f' % z,
+                                   'spacing':'%0.2f' % spacing,
+                                   'pitch':'%0.2f' % pitch})
+            elif i in [0xf, 0x10]:
+                (system, strobes)=unpack_from('<BB', data, sub+6)
+                self.leaf('ApproachLights', {'end':end,
+                                             'system':approachnames[system&0xf],
+                                             'strobes':str(strobes),
+                                             'endLights':tf(system&0x20),
+                                             'reil':tf(system&0x40),
+                                             'touchdown':tf(system&0x80)})
+            else:
+                raise Unsupported('runway record 0x%x' % i)
+
+        idents=[ident(v, False) for v in [pils, sils] if v]
+        for (i, elems) in self.ils:
+            if i in idents: self.elems.extend(elems)
+        self.end('Runway')
+
+    def Ils(self, rec):
+        data=self.data
+        (rid, rsize, itype, flags, x, y, z, freq, rng, mag, iid)=unpack_from('<HIBBiiiIffI', data, rec)
+        attrs={'lat':lat(y), 'lon':lon(x), 'alt':alt(z),
+               'frequency':'%0.3f' % (freq*0.000001),
+               'backCourse':tf(flags&4), 'range':'%0.2f' % rng,
+               'magvar':magvar(mag), 'ident':ident(iid), 'name':u''}
+        children=[]
+        for (sub, i, size) in self.subrecords(rec+0x28, rec+rsize):
+            if i==0x14:
+                (number, heading, width)=unpack_from('<Bxff', data, sub+6)
+                attrs['end']=(number>>4) and 'SECONDARY' or 'PRIMARY'
+                attrs['heading']='%0.2f' % heading
+                attrs['width']='%0.2f' % width
+            elif i==0x15:
+                (x, y, z, rng, pitch)=unpack_from('<iiiff', data, sub+8)
+                children.extend([('GlideSlope', {'lat':lat(y), 'lon':lon(x), 'alt':alt(z), 'range':'%0.2f' % rng, 'pitch':'%0.2f' % pitch}), ('GlideSlope', None)])
+            elif i==0x16:
+                (x, y, z, rng)=unpack_from('<iiif', data, sub+8)
+                children.extend([('Dme', {'lat':lat(y), 'lon':lon(x), 'alt':alt(z), 'range':'%0.2f' % rng}), ('Dme', None)])
+            elif i==0x19:
+                attrs['name']=self.name(sub, size, 0x2f)
+            else:
+                raise Unsupported('ILS record 0x%x' % i)
+        if 'end' not in attrs: raise Unsupported('ILS without localizer')
+        return (ident(iid), [('Ils', attrs)]+children+[('Ils', None)])
+
+    def TaxiwayParking(self, rec, rid):
+        data=self.data
+        (count,)=unpack_from('<H', data, rec+6)
+        p=rec+8
+        for k in range(count):
+            (flags, radius, heading)=unpack_from('<Iff', data, p)
+            p+=12
+            if rid==0x3d: p+=16	# FSX tee offsets
+            (x, y)=unpack_from('<ii', data, p)
+            p+=8+4*(flags>>24)	# airline codes
+            n=flags&0x3f
+            if n<=11:
+                name=parkingnames[n]
+            else:
+                name='GATE_%c' % (n+0x35)
+            self.leaf('TaxiwayParking', {'pushBack':pushbacknames[(flags>>6)&3],
+                                         'lat':lat(y), 'lon':lon(x),
+                                         'heading':'%0.2f' % heading,
+                                         'radius':'%0.2f' % radius,
+                                         'name':name,
+                                         'type':enum(parkingtypes, (flags>>8)&0xf),
+                                         'number':str((flags>>12)&0xfff),
+                                         'index':str(k)})
+
+    def TaxiwayPath(self, rec):
+        data=self.data
+        (count,)=unpack_from('<H', data, rec+6)
+        for k in range(count):
+            (start, end, ptype, number, lines, surf, width, weight)=unpack_from('<HHBBBBfi', data, rec+8+20*k)
+            attrs={'type':enum(pathnames, ptype&0xf), 'start':str(start),
+                   'end':str(end&0xfff), 'surface':surface(surf),
+                   'width':'%0.2f' % width, 'weightLimit':str(weight),
+                   'drawSurface':tf(ptype&0x20), 'drawDetail':tf(ptype&0x40),
+                   'centerLine':tf(lines&1), 'centerLineLighted':tf(lines&2),
+                   'leftEdgeLighted':tf(lines&0x10),
+                   'rightEdgeLighted':tf(lines&0x80)}
+            for (side, solid, dashed) in [('leftEdge', 4, 8), ('rightEdge', 0x20, 0x40)]:
+                if lines&solid:
+                    attrs[side]='SOLID'
+                elif lines&dashed:
+                    attrs[side]='DASHED'
+                else:
+                    attrs[side]='NONE'
+            if ptype&0xf==2:
+                attrs['number']=rwnumber(number)
+                attrs['designator']=enum(designatornames, end>>12)
+            else:
+                attrs['name']=str(number)
+            self.leaf('TaxiwayPath', attrs)
+
+    def ApronEdgeLights(self, rec):
+        data=self.data
+        (nverts, nedges)=unpack_from('<HH', data, rec+8)
+        verts=[unpack_from('<ii', data, rec+0x18+8*k) for k in range(nverts)]
+        self.start('ApronEdgeLights', {})
+        last=None
+        for k in range(nedges):
+            (start, end)=unpack_from('<HH', data, rec+0x18+8*nverts+8*k+4)
+            if k==0 or start!=last:
+                if k: self.end('EdgeLights')
+                self.start('EdgeLights', {})
+                (x, y)=verts[start]
+                self.leaf('Vertex', {'lat':lat(y), 'lon':lon(x)})
+            (x, y)=verts[end]
+            self.leaf('Vertex', {'lat':lat(y), 'lon':lon(x)})
+            last=end
+        if nedges: self.end('EdgeLights')
+        self.end('ApronEdgeLights')
+
+    def Vor(self, rec):
+        data=self.data
+        (rid, rsize, vtype, flags, x, y, z, freq, rng, mag, vid, reg)=unpack_from('<HIBBiiiIffII', data, rec)
+        attrs={'lat':lat(y), 'lon':lon(x), 'alt':alt(z),
+               'type':enum(vornames, vtype),
+               'frequency':'%0.3f' % (freq*0.000001), 'magvar':magvar(mag),
+               'range':'%0.2f' % rng, 'region':region(reg),
+               'ident':ident(vid), 'name':u'',
+               'dme':'FALSE', 'dmeOnly':'FALSE'}
+        dme=None
+        for (sub, i, size) in self.subrecords(rec+0x28, rec+rsize):
+            if i==0x16:
+                (x, y, z, rng)=unpack_from('<iiif', data, sub+8)
+                dme={'lat':lat(y), 'lon':lon(x), 'alt':alt(z), 'range':'%0.2f' % rng}
+            elif i==0x19:
+                attrs['name']=self.name(sub, size, 0x3f)
+            else:
+                raise Unsupported('VOR record 0x%x' % i)
+        if dme:
+            attrs['dme']=tf(flags&0x10)
+            attrs['dmeOnly']=tf(not flags&1)
+        self.start('Vor', attrs)
+        if dme and flags&0x10: self.leaf('Dme', dme)
+        self.end('Vor')
+
+    def Ndb(self, rec):
+        data=self.data
+        (rid, rsize, ntype, freq, x, y, z, rng, mag, nid, reg)=unpack_from('<HIHIiiiffII', data, rec)
+        attrs={'type':enum(ndbnames, ntype), 'name':u'',
+               'lat':lat(y), 'lon':lon(x), 'alt':alt(z),
+               'frequency':'%0.2f' % (freq*0.001), 'range':'%0.2f' % rng,
+               'magvar':magvar(mag), 'region':region(reg), 'ident':ident(nid)}
+        if rsize>0x28:
+            (size,)=unpack_from('<I', data, rec+0x2a)
+            attrs['name']=self.name(rec+0x28, size, 0x3f)
+        self.leaf('Ndb', attrs)
+
+    def Marker(self, rec):
+        data=self.data
+        (heading, mtype, x, y, z, mid, reg)=unpack_from('<HBiiiII', data, rec+5)
+        self.leaf('Marker', {'type':enum(markernames, mtype),
+                             'lat':lat(y), 'lon':lon(x), 'alt':alt(z),
+                             'heading':'%0.2f' % (heading*360.0/65536),
+                             'region':region(reg or 2), 'ident':ident(mid)})
+
+    def SceneryObject(self, rec, rid, rsize):
+        data=self.data
+        if rid in [5, 0xe]:
+            self.signs=True
+            return
+        elif rid in [4, 0xd, 7, 0x10]:
+            return	# Effects and Triggers aren't used
+        elif rid not in [2, 0xb, 3, 0xc]:
+            raise Unsupported('object 0x%x' % rid)	# incl GenericBuilding
+        (x, y, z, agl, pitch, bank, heading, cmplx)=unpack_from('<iiiHHHHI', data, rec+4)
+        base=rid>9 and rec+0x2c or rec+0x1c	# FSX has an instance GUID
+        if cmplx>5: cmplx=0
+        self.start('SceneryObject', {'lat':lat(y), 'lon':lon(x), 'alt':alt(z),
+                                     'altitudeIsAgl':tf(agl),
+                                     'pitch':'%0.2f' % (pitch*360.0/65536),
+                                     'bank':'%0.2f' % (bank*360.0/65536),
+                                     'heading':'%0.2f' % (heading*360.0/65536),
+                                     'imageComplexity':complexitynames[cmplx]})
+        if rid in [2, 0xb]:
+            if rec+rsize>base+0x14: raise Unsupported('AttachedObject')
+            (a,b,c,d,scale)=unpack_from('<4If', data, base)
+            self.leaf('LibraryObject', {'name':'%08x%08x%08x%08x' % (a,b,c,d),
+                                        'scale':'%0.2f' % scale})
+        else:
+            (pole, sock)=unpack_from('<ff', data, base)
+            (lit,)=unpack_from('<H', data, base+0x10)
+            self.leaf('Windsock', {'poleHeight':'%0.2f' % pole,
+                                   'sockLength':'%0.2f' % sock,
+                                   'lighted':tf(lit)})
+        self.end('SceneryObject')
+
+    def ExclusionRectangle(self, rec):
+        (flags, flags2, x0, y0, x1, y1)=unpack_from('<BBxxiiii', self.data, rec)
+        if flags!=8 and not flags&0xf0 and not flags2&7: return
+        attrs={'latitudeMinimum':lat(y1), 'latitudeMaximum':lat(y0),
+               'longitudeMinimum':lon(x0), 'longitudeMaximum':lon(x1),
+               'excludeAllObjects':tf(flags==8)}
+        if flags!=8:
+            attrs.update({'excludeBeaconObjects':tf(flags&0x10),
+                          'excludeEffectObjects':tf(flags&0x20),
+                          'excludeGenericBuildingObjects':tf(flags&0x40),
+                          'excludeLibraryObjects':tf(flags&0x80),
+                          'excludeTaxiwaySignObjects':tf(flags2&1),
+                          'excludeTriggerObjects':tf(flags2&2),
+                          'excludeWindSockObjects':tf(flags2&4)})
+        self.leaf('ExclusionRectangle', attrs)
@@ -1,25 +1,30 @@
 from math import floor, sin, cos, radians
-from os import curdir, listdir, mkdir, pardir, sep, stat, unlink, walk
+from itertools import imap, izip
+from cPickle import dump, load
+from hashlib import md5
+from os import curdir, getpid, listdir, mkdir, pardir, sep, stat, unlink, walk
 from os.path import basename, dirname, exists, isdir, join, normpath, splitext
 from shutil import copyfile
-from StringIO import StringIO
 import struct	# for struct.error
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from
 from sys import exit, platform, maxint
 from traceback import print_exc
 from tempfile import gettempdir
 
-from convutil import asciify, banner, helper, complexities, AptNav, Object, Polygon, Point, FS2XError, sortfolded
+from convutil import asciify, banner, helper, texevents, unzipbgl, unzipbgldata, workerpool, complexities, AptNav, BGLFile, Inventory, Object, Polygon, Point, FS2XError, sortfolded
 from convobjs import makestock, ignorestock, friendlytxt, friendlyxml
 from convbgl import ProcEx, maketexdict
 from convphoto import ProcPhoto
+from convdsf import writedsf
 import convbgl
+import convfac
 import convmdl
 import convxml
+from version import appversion
 
 class Output:
     def __init__(self, fspath, lbpath, xppath, dumplib, season, xpver,
-                 status, log, refresh, debug):
+                 status, log, refresh, debug, workers=1, libcache=True, lazylibs=False):
 
         self.dumplib=dumplib
         if dumplib:
@@ -44,6 +49,12 @@ class Output:
         self.log=log
         self.refresh=refresh
 
+        self.workers=workers	# Processes to use. 1=don't use a pool
+        if libcache:
+            self.libindex=join(gettempdir(), 'fs2xp-libs.idx')	# Cached scanlibs results
+        else:
+            self.libindex=None	# don't cache
+
         self.apt={}	# (location, AptNav entries) by ICAO code
         self.aptfull={}	# version of the above with nothing excluded
         self.nav=[]
@@ -54,9 +65,16 @@ class Output:
         self.excfac=[]	# Exclusion rectangles for facility data
         self.doingexcfac=False	# Process exclusions?
         self.needfull=False	# Some apt.dat features are excluded?
-        self.libobj={}	# Lib objects: (MDL, f, cmp, offset, size, name, scale) by uid
+        self.libobj={}	# Lib objects: (MDL, f, cmp, offset, size, name, scale) by uid - use findlib()
+        self.libseq={}	# Scan order of the BGL that defines each lib object, by uid
+        self.libpending=[]	# Compressed library BGLs not yet decompressed: (seq, toppath, bglname, job, set of uids or None if not known)
+        self.lazylibs=lazylibs	# Decompress library BGLs only when an object from them is used?
+        self.dsftool=False	# Write DSFs via DSF2TEXT and DSFTool rather than directly?
+        self.opprof=None	# OpProfile of scenery interpretation, if wanted
+        self.areapool=None	# Pool interpreting BGL areas during process() - see convbgl.Parse
         self.objplc=[]	# Object placements:	(loc, hdg, cmplx, name, scale)
         self.objdat={}	# Objects by name
+        self.objstore={}	# Names of generated Objects in objdat by digest - see storeobj()
         self.polyplc=[]	# Poly placements: [(name, hdg, [loc, u, v])]
         self.polydat={}	# Polygons by name
         self.stock={}	# FSX stock objects - we don't have these
@@ -65,6 +83,10 @@ class Output:
         self.names={}	# friendly names must be unique
         self.haze={}	# Textures that have palette-based transparency
         self.donetex={}	# Textures we have seen (avoid multiple convert/report)
+        self.texpool=None	# Pool doing texture conversions during export
+        self.texjobs=[]	# Pending texture conversions: (src, AsyncResult)
+        self.texdsts={}	# Pending texture conversions: src by dst
+        self.texrenames={}	# Textures written as PNG instead of DDS: new name by old
         self.visrunways=False	# Runways on top of scenery - should be per apt
         
         if platform=='win32':
@@ -91,19 +113,16 @@ class Output:
                 raise FS2XError('"%s" does not exist' % path)
             if path and not isdir(path):
                 raise FS2XError('"%s" is not a folder' % path)
+        self.inventory=Inventory([self.fspath, lbpath])	# Source files
 
         if self.dds:
             self.palettetex='Resources/FS2X-palette.dds'
         else:
             self.palettetex='Resources/FS2X-palette.png'
         self.addtexdir=None
-        try:
-            for f in listdir(lbpath):
-                if f.lower()=='texture':
-                    self.addtexdir=maketexdict(join(lbpath, f))
-                    break
-        except:
-            pass
+        if lbpath:
+            d=self.inventory.find(lbpath, 'texture')
+            if d: self.addtexdir=maketexdict(join(lbpath, d), self.inventory)
 
         if not self.dumplib and (basename(dirname(xppath)).lower()!='custom scenery' or not isdir(dirname(xppath))):
             raise FS2XError('The "X-Plane scenery location" must be a sub-folder\nof X-Plane\'s Custom Scenery folder.')
@@ -202,17 +221,21 @@ class Output:
         self.status(-1, 'Scanning libraries')
         if self.debug: self.debug.write('Library objects\n')
 
+        index=LibIndex(self.libindex, self.inventory)
+        pool=workerpool(self.workers)
+        seq=0
         for toppath in [self.fspath, self.lbpath]:	# do local first
             if not toppath:
                 continue
 
             # read Rwy12 UID mappings
-            for path, dirs, files in walk(toppath):
+            for path, dirs, files in self.inventory.walk(toppath):
                 for filename in files:
                     if filename[-4:].lower()=='.xml':
                         friendlyxml(join(path,filename), self.friendly, self.names)
-                        
-            for path, dirs, files in walk(toppath):
+
+            jobs=[]
+            for path, dirs, files in self.inventory.walk(toppath):
                 if basename(path).lower()!='scenery':
                     continue	# Only look at BGLs in 'scenery' directory
                 n = len(files)
@@ -220,201 +243,94 @@ class Output:
                     filename=files[i]
                     if filename[-4:].lower()!='.bgl':
                         continue
-                    if exists(join(path,filename[:-4]+'.txt')):
-                        # read EZ-Scenery UID mapping
-                        friendlytxt(filename[:-4]+'.txt', self.friendly, self.names)
-                    bglname=join(path, filename)
-                    if stat(bglname).st_size==0:
-                        self.done[bglname]=True
-                        continue	# Sometimes seen 0-length files!
-                    try:
-                        bgl=file(bglname, 'rb')
-                    except IOError:
+                    if not self.inventory.stat(join(path, filename)):
                         self.log("Can't read \"%s\"" % filename)
-                        self.done[bglname]=True
                         continue
-                    c=bgl.read(2)
-                    if len(c)!=2:
-                        self.log("Can't read \"%s\"" % filename)
-                        self.done[bglname]=True
-                        continue
-                    done=True
-                    (c,)=unpack('<H', c)
-                    if c&0xff00==0:
-                        # Old-style
-                        for section in [42,46,54,58,102]:
-                            bgl.seek(section)
-                            (secbase,)=unpack('<I',bgl.read(4))
-                            if secbase: done=False	# Includes other data
-                        bgl.seek(62)	# LIBRARY data
-                        (libbase,)=unpack('<I',bgl.read(4))
-                        if toppath==self.fspath:
-                            bgl.seek(114)	# EXCLUSION data
-                            (excbase,)=unpack('<I',bgl.read(4))
-                        else:
-                            excbase=0
-                        if not (libbase or excbase): continue
-                        self.status(i*100.0/n, bglname[len(toppath)+1:])
-                        tmp=bglname
-                        bgl.seek(122)
-                        (spare2,)=unpack('<I',bgl.read(4))
-                        if spare2:
-                            # compressed
-                            bgl.close()
-                            tmp=join(gettempdir(), filename)
-                            if platform!='win32':
-                                compressed=bglname
-                                # Wine can't handle non-ascii?
-                                try:
-                                    bglname[len(toppath):].encode("ascii")
-                                except:
-                                    compressed=join(gettempdir(), 'fs2xp1.bgl')
-                                    copyfile(bglname, compressed)
-                                    tmp=join(gettempdir(), 'fs2xp2.bgl')
-                                helper(self.bglexe, compressed, tmp)
-                                if compressed!=bglname: unlink(compressed)
-                            else:
-                                helper(self.bglexe, bglname, tmp)
-                            if not exists(tmp):
-                                # Check for uncompressed version
-                                tmp=join('Resources',basename(bglname).lower())
-                                if not exists(tmp):
-                                    self.log("Can't parse compressed file %s"%(
-                                        filename))
-                                    continue	# don't mark as done
-                            bgl=file(tmp, 'rb')
-                        # Exclusions
-                        if excbase:
-                            bgl.seek(excbase)
-                            if self.debug: self.debug.write('%s\n' % filename.encode("latin1", 'replace'))
-                            try:
-                                ProcEx(bgl, self)
-                            except:
-                                self.log("Can't parse Exclusion section in file %s" % filename)
-                                if self.debug: print_exc(None, self.debug)
-                        if not libbase: continue
-                        bgl.seek(libbase)
-                        try:
-                            while True:
-                                pos=bgl.tell()
-                                (off,)=unpack('<I', bgl.read(4))
-                                if off==0: break
-                                (a,b,c,d)=unpack('<IIII',bgl.read(16))
-                                uid = "%08x%08x%08x%08x" % (a,b,c,d)
-                                bgl.seek(libbase+off)
-                                (a,b,c,d,x)=unpack('<IIIIB',bgl.read(17))
-                                if a==1 and b==2 and c==3 and d==4:	# fs98 library
-                                    (rcsize,)=unpack('<H', bgl.read(2))
-                                    hdsize=19
-                                    scale=1.0
-                                else:
-                                    (hdsize,rcsize,radius,scale,typ,prop)=unpack('<6I',bgl.read(24))
-                                    if scale:
-                                        scale=65536.0/scale
-                                    else:
-                                        scale=1.0
-                                name=None
-                                if hdsize>42:
-                                    # Use "friendly" name instead of id
-                                    name=asciify(bgl.read(hdsize- 41).rstrip(' \0'))
-                                if uid in self.friendly:
-                                    name=self.friendly[uid]
-                                elif not name and asciify(splitext(filename)[0]) not in self.names:
-                                    name=asciify(splitext(filename)[0])
-                                    self.friendly[uid]=name
-                                    self.names[name]=True
-                                elif name and name not in self.names:
-                                    self.friendly[uid]=name
-                                    self.names[name]=True
-                                else:
-                                    name=uid
-
-                                if not uid in self.libobj:	# 1st wins
-                                    if self.debug and toppath==self.fspath: self.debug.write("%s:\t%s\t%s\tFS8\n" % (uid, name, bglname[len(toppath)+1:]))
-                                    self.libobj[uid]=(8, bglname, tmp, libbase+off+hdsize, rcsize, name, scale)
-                                bgl.seek(pos+20)
-                        except:
-                            self.log("Error parsing FS8 library %s" % filename)
-                            if self.debug: print_exc(None, self.debug)
-
-                    elif c==0x201:
-                        # FS9 or FSX
-                        islib=False
-                        bgl.seek(4)
-                        (sectiontbl,)=unpack('<I',bgl.read(4))
-                        bgl.seek(20)
-                        (sections,)=unpack('<I',bgl.read(4))
-                        for section in range(sections):
-                            bgl.seek(sectiontbl+20*section)
-                            (typ,x,subsections,subsectiontbl)=unpack('<IIIi', bgl.read(16))
-                            #print "%x %x %d" % (typ,x,subsections)
-                            if typ!=0x2b:	# 2b=MDL data
-                                if typ==0x6e:	# Ortho and DEM BGLs seem to have a 6e section
-                                    self.log('Skipping terrain data in file %s' % filename)
-                                elif typ==0x65:
-                                    self.log("Skipping traffic data in file %s" % filename)
-                                else:
-                                    done=False	# Something else - perhaps Facility data
-                                continue
-                            if not islib:
-                                self.status(i*100.0/n,bglname[len(toppath)+1:])
-                                islib=True
-                            for subsection in range(subsections):
-                                bgl.seek(subsectiontbl+16*subsection)
-                                #print "  %x" % bgl.tell(),
-                                (id,records,recordtbl)=unpack('<IIi',
-                                                              bgl.read(12))
-                                #print "%x %d" % (id,records)
-                                for record in range(records):
-                                    bgl.seek(recordtbl+record*24)
-                                    (a,b,c,d,off,rcsize)=unpack('<IIIIiI',
-                                                                bgl.read(24))
-                                    uid = "%08x%08x%08x%08x" % (a,b,c,d)
-                                    name=None
-
-                                    # Check for FSX friendly name
-                                    bgl.seek(recordtbl+off)
-                                    if bgl.read(4)=='RIFF':
-                                        (mdlsize,)=unpack('<I', bgl.read(4))
-                                        if bgl.read(4)=='MDLX':
-                                            mdlformat=10	# FSX format
-                                            while bgl.tell()<recordtbl+off+mdlsize:
-                                                c=bgl.read(4)
-                                                (size,)=unpack('<I', bgl.read(4))
-                                                if c=='MDLN':
-                                                    name=asciify(bgl.read(size).strip('\0').strip())
-                                                    break
-                                                elif c=='MDLD':
-                                                    break	# stop at data
-                                                else:
-                                                    bgl.seek(size,1)
-                                        else:
-                                            mdlformat=9	# FS9 format
-
-                                    if uid in self.stock:
-                                        name=self.stock[uid]
-                                    elif uid in self.friendly:
-                                        name=self.friendly[uid]
-                                    elif not name and records==1 and asciify(splitext(filename)[0]) not in self.names:
-                                        name=asciify(splitext(filename)[0])
-                                        self.friendly[uid]=name
-                                        self.names[name]=True
-                                    elif name and name not in self.names:
-                                        self.friendly[uid]=name
-                                        self.names[name]=True
-                                    else:
-                                        name=uid
-
-                                    if not uid in self.libobj:
-                                        if self.debug and toppath==self.fspath: self.debug.write("%s:\t%s\t%s\tFS%d\n" % (uid, name, bglname[len(toppath)+1:], mdlformat))
-                                        self.libobj[uid]=(mdlformat,
-                                                          bglname, bglname,
-                                                          recordtbl+off,rcsize,
-                                                          name, 1.0)
-                    else:
-                        self.log("Can't parse file \"%s\". Is this a BGL file?" % filename)
-                    bgl.close()
-                    if done: self.done[bglname]=True
+                    jobs.append((i, n, join(path, filename)))
+
+            # Workers just parse. Names are resolved here in file order
+            # so that the first definition of a uid or name still wins.
+            args=[(bglname, self.inventory.stat(bglname).st_size, toppath, toppath==self.fspath, self.bglexe, self.debug is not None, self.lazylibs) for (i, n, bglname) in jobs]
+            cached=[index.lookup(arg) for arg in args]
+            scan=[arg for (arg, result) in izip(args, cached) if result is None]
+            if pool:
+                results=pool.imap(scanbgl, scan, 16)
+            else:
+                results=imap(scanbgl, scan)
+            for ((i, n, bglname), arg, result) in izip(jobs, args, cached):
+                if result is None:
+                    result=results.next()
+                    index.store(arg, result)
+                (done, exc, events)=result
+                filename=basename(bglname)
+                if self.inventory.exists(bglname[:-4]+'.txt'):
+                    # read EZ-Scenery UID mapping
+                    friendlytxt(filename[:-4]+'.txt', self.friendly, self.names)
+                self.replay(toppath, bglname, seq, arg, events, i*100.0/n)
+                self.exc.extend(exc)
+                if done: self.done[bglname]=True
+                seq+=1
+
+        if pool:
+            pool.close()
+            pool.join()
+        index.save()
+
+
+    # Apply the events recorded by scanbgl
+    def replay(self, toppath, bglname, seq, arg, events, percent=None):
+        for event in events:
+            if event[0]=='status':
+                if percent is not None: self.status(percent, bglname[len(toppath)+1:])
+            elif event[0]=='log':
+                self.log(event[1])
+            elif event[0]=='debug':
+                if self.debug: self.debug.write(event[1])
+            elif event[0]=='pending':
+                uids=event[1]
+                if uids is not None: uids=set(uids)
+                self.libpending.append((seq, toppath, bglname, arg[:-1]+(False,), uids))
+            elif event[0]=='retry':
+                pass	# only matters to LibIndex
+            else:
+                self.addlib(toppath, seq, *event[1:])
+
+
+    # Library object by uid, first decompressing any libraries that were
+    # scanned lazily before the one that defines it and that might define
+    # it. None if not found. uid=None decompresses everything.
+    def findlib(self, uid):
+        for pending in list(self.libpending):
+            (seq, toppath, bglname, arg, uids)=pending
+            if uid in self.libobj and self.libseq[uid]<seq: break
+            if uid is None or uids is None or uid in uids:
+                self.libpending.remove(pending)
+                self.replay(toppath, bglname, seq, arg, scanbgl(arg)[2])
+        return self.libobj.get(uid)
+
+
+    # Add a library object found by scanbgl to self.libobj
+    def addlib(self, toppath, seq, uid, name, single, usestock, entry):
+        (mdlformat, bglname, realfile, offset, size, scale)=entry
+        filename=basename(bglname)
+        if usestock and uid in self.stock:
+            name=self.stock[uid]
+        elif uid in self.friendly:
+            name=self.friendly[uid]
+        elif not name and single and asciify(splitext(filename)[0]) not in self.names:
+            name=asciify(splitext(filename)[0])
+            self.friendly[uid]=name
+            self.names[name]=True
+        elif name and name not in self.names:
+            self.friendly[uid]=name
+            self.names[name]=True
+        else:
+            name=uid
+
+        if not uid in self.libobj or seq<self.libseq[uid]:	# 1st wins, even if decompressed later
+            if self.debug and toppath==self.fspath: self.debug.write("%s:\t%s\t%s\tFS%d\n" % (uid, name, bglname[len(toppath)+1:], mdlformat))
+            self.libobj[uid]=(mdlformat, bglname, realfile, offset, size, name, scale)
+            self.libseq[uid]=seq
 
 
     # Fill out self.objplc, self.objdat, self.polyplc, self.polydat
@@ -422,7 +338,7 @@ class Output:
         if self.dumplib: return
         self.status(-1, 'Reading Photoscenery')
         if self.debug: self.debug.write('Photoscenery\n')
-        for path, dirs, files in walk(self.fspath):
+        for path, dirs, files in self.inventory.walk(self.fspath):
             if basename(path).lower()=='texture':
                 # Only look at BMPs in 'texture' directory
                 try:
@@ -438,80 +354,76 @@ class Output:
         if self.dumplib: return
         self.status(-1, 'Reading BGLs')
         if self.debug: self.debug.write('Procedural scenery\n')
-        xmls=[]
-        for path, dirs, files in walk(self.fspath):
+        jobs=[]
+        for path, dirs, files in self.inventory.walk(self.fspath):
             if basename(path).lower()!='scenery':
                 continue	# Only look at BGLs in 'scenery' directory
             n = len(files)
             for i in range(n):
-                self.gencount=0
-                self.anchorcount=0
                 filename=files[i]
                 if filename[-4:].lower()!='.bgl':
                     continue
                 bglname=join(path, filename)
                 if bglname in self.done: continue
                 self.done[bglname]=True
-                self.status(i*100.0/n, bglname[len(self.fspath)+1:])
-                try:
-                    bgl=file(bglname, 'rb')
-                except IOError:
-                    self.log("Can't read \"%s\"" % bglname)
-                    continue
-                c=bgl.read(2)
-                if len(c)!=2:
-                    self.log("Can't read \"%s\"" % bglname)
-                    continue                
-                tmp=None
-                (c,)=unpack('<H', c)
-                if c&0xff00==0:
-                    bgl.seek(122)
-                    (spare2,)=unpack('<I',bgl.read(4))
-                    if spare2:
-                        # compressed
-                        bgl.close()
-                        tmp=join(gettempdir(), filename)
-                        if platform!='win32':
-                            compressed=bglname
-                            # Wine can't handle non-ascii?
-                            try:
-                                bglname[len(self.fspath):].encode("ascii")
-                            except:
-                                compressed=join(gettempdir(), 'fs2xp1.bgl')
-                                copyfile(bglname, compressed)
-                                tmp=join(gettempdir(), 'fs2xp2.bgl')
-                            helper(self.bglexe, compressed, tmp)
-                            if compressed!=bglname: unlink(compressed)
-                        else:
-                            helper(self.bglexe, bglname, tmp)
-                        if not exists(tmp):
-                            self.log("Can't parse compressed file %s" % (
-                                filename))
-                            continue
-                        bgl=file(tmp, 'rb')
-                    try:
-                        convbgl.Parse(bgl, bglname, self)
-                    except:
-                        self.log("Can't read \"%s\"" % filename)
-                        if self.debug: print_exc(None, self.debug)
-                elif c==0x201:
-                    xmls.append(bglname)
-                else:
-                    self.log("Can't parse \"%s\". Is this a BGL file?" % (
-                        filename))
-                bgl.close()
-                if tmp and exists(tmp) and not self.debug: unlink(tmp)
+                jobs.append((i, n, bglname))
+
+        # Workers interpret whole BGLs if there's more than one, otherwise
+        # the areas of the BGL. Either way Objects and Polygons are named
+        # and deduped here in file order.
+        # How a BGL is interpreted depends on whether an earlier one was in
+        # the southern hemisphere, so workers only run a few BGLs ahead, and
+        # any started before the hemisphere changed are started again.
+        pool=workerpool(self.workers)
+        if pool and len(jobs)>1:
+            queued=[]	# (hemi, AsyncResult) for this and the following BGLs
+        else:
+            self.areapool=pool
+            queued=None
+        xmls=[]
+        for (k, (i, n, bglname)) in enumerate(jobs):
+            self.gencount=0
+            self.anchorcount=0
+            self.status(i*100.0/n, bglname[len(self.fspath)+1:])
+            if queued is not None:
+                if queued and queued[0][0]!=self.hemi:
+                    queued=[]	# started in the wrong hemisphere
+                settings=convbgl.scensettings(self)
+                for (j, m, name) in jobs[k+len(queued):k+2*self.workers]:
+                    queued.append((self.hemi, pool.apply_async(procbgl, ((name, self.fspath, convbgl.bgltexdir(name, self.inventory), settings, self.bglexe),))))
+                (isxml, result)=queued.pop(0)[1].get()
+                convbgl.replayscen(result, bglname, {}, self)
+            else:
+                isxml=readbgl(bglname, self.fspath, convbgl.bgltexdir(bglname, self.inventory), self, self.bglexe)
+            if isxml: xmls.append(bglname)
+        if pool:
+            pool.close()
+            pool.join()
+            self.areapool=None
 
         # set up exclusions that affect facilities
         self.excfac=self.exc
 
         # Do airport facilities last so that exclusions have been set up
+        decoded={}	# convfac.decode() by filename, for the second pass
         for self.doingexcfac in [False, True]:
             n = len(xmls)
             for i in range(n):
                 bglname=xmls[i]
                 if not self.doingexcfac:
                     self.status(i*100.0/n, bglname[len(self.fspath)+1:])
+                if bglname not in decoded:
+                    decoded[bglname]=convfac.decode(bglname, self)
+                elems=decoded[bglname]
+                if elems is not None:
+                    try:
+                        convxml.Parse(elems, bglname, self)
+                    except FS2XError:
+                        raise
+                    except:
+                        self.log("Can't parse file %s" % basename(bglname))
+                        if self.debug: print_exc(None, self.debug)
+                    continue
                 tmp=join(gettempdir(), basename(bglname[:-3])+'xml')
                 x=helper(self.xmlexe, '-t', bglname, tmp)
                 if exists(tmp):
@@ -538,6 +450,7 @@ class Output:
     # Process referenced library into self.objplc and self.objdat
     def proclibs(self):
         if self.dumplib:	# Fake up references
+            self.findlib(None)	# decompress everything
             for uid in self.libobj:
                 self.objplc.append((None, 0, 1, uid, 1))
 
@@ -553,11 +466,11 @@ class Output:
                 if name in ignorestock:
                     self.objplc.pop(i)	# Silently drop ignored stock objects
                     continue
-            elif not uid in self.libobj:
+            elif not self.findlib(uid):
                 i+=1
                 continue	# Missing object error will be reported later
             else:
-                (mdlformat, bglname, realfile, offset, size, name, libscale)=self.libobj[uid]
+                (mdlformat, bglname, realfile, offset, size, name, libscale)=self.findlib(uid)
                 
             # Replace uid with name
             self.objplc[i]=(loc, heading, complexity, name, scale)
@@ -581,7 +494,7 @@ class Output:
             i+=1
             scen=None
             tran=None
-            bgl=file(realfile, 'rb')
+            bgl=BGLFile(realfile)
             bgl.seek(offset)
             if mdlformat==9:
                 # New-style MDL file
@@ -590,16 +503,16 @@ class Output:
                 tbldata=''
                 try:
                     if bgl.read(4)!='RIFF': raise IOError
-                    (mdlsize,)=unpack('<I', bgl.read(4))
+                    (mdlsize,)=bgl.unpack('<I')
                     if bgl.read(4)!='MDL9': raise IOError
                     while bgl.tell()<offset+mdlsize:
                         c=bgl.read(4)
-                        (size,)=unpack('<I', bgl.read(4))
+                        (size,)=bgl.unpack('<I')
                         if c=='EXTE':
                             end=size+bgl.tell()
                             while bgl.tell()<end:
                                 c=bgl.read(4)
-                                (size,)=unpack('<I', bgl.read(4))
+                                (size,)=bgl.unpack('<I')
                                 if c in ['TEXT','MATE','VERT']:
                                     data+=bgl.read(size-2)	# strip return
                                     if bgl.read(2)!='\x22\0':	raise IOError
@@ -632,9 +545,7 @@ class Output:
                     continue
                 # Write a flat BGL section
                 bgl.close()
-                bgl=StringIO()
-                bgl.write(data)
-                bgl.seek(0)
+                bgl=BGLFile(realfile, data)
                 offset=0
                 size=len(data)
 
@@ -642,11 +553,9 @@ class Output:
                 # Add library object to self.objdat
                 texdir=normpath(join(dirname(bglname), pardir))
                 # For case-sensitive filesystems
-                for d in listdir(texdir):
-                    if d.lower()=='texture':
-                        if not lasttexdir or lasttexdir[0]!=texdir:
-                            lasttexdir=maketexdict(join(texdir, d))
-                        break
+                d=self.inventory.find(texdir, 'texture')
+                if d:
+                    lasttexdir=maketexdict(join(texdir, d), self.inventory)
                 else:
                     lasttexdir=None
                 if mdlformat==10:
@@ -877,263 +786,333 @@ class Output:
             f.close()
 
         self.status(-1, 'Writing OBJs')
-        # make a list of requested objects and scales
-        objdef={}
-        for loc, heading, complexity, name, scale in self.objplc:
-            if not name in objdef:
-                objdef[name]=[scale]
-            elif not scale in objdef[name]:
-                objdef[name].append(scale)
-        polydef={}
-        for (name, param, points) in self.polyplc:
-            if not name in polydef:
-                polydef[name]=True
-
-        # do layer mapping
-        # In FSX any layer overwrites runways and taxiways. layer>=16 also overwrites markings and lights.
-        # We have to map these to 8 X-Plane layers below markings and 8 above.
-        # In X-Plane 9, polygons with surface at layer airports+1 or later also suppresses lights. But not in X-Plane 10.
-        # Note: In X-Plane 10.20, airports layer doesn't work for draped objs
-        fslayers={}
-        for name in objdef:
-            if name in self.objdat:
-                for obj in self.objdat[name]:
-                    if obj.layer: fslayers[obj.layer]=None
-        for name in polydef:
-            if name in self.polydat:
-                poly=self.polydat[name]
-                if poly.layer: fslayers[poly.layer]=None
-        lokeys=sorted([key for key in fslayers.keys() if 4<=key<16])
-        hikeys=sorted([key for key in fslayers.keys() if key>=16])
-        for (keys, mapping) in [(lokeys, ['runways +1', 'runways +2', 'runways +3', 'runways +4', 'runways +5', 'markings -5', 'markings -4', 'markings -3', 'markings -2', 'markings -1']),
-                                (hikeys, ['roads +1', 'roads +2', 'roads +3', 'roads +4', 'roads +5', 'objects -5', 'objects -4', 'objects -3', 'objects -2', 'objects -1'])]:
-            divisor=(len(keys)+7)/8	# have to map to 8 values
-            for i in range(len(keys)):
-                fslayers[keys[i]]=mapping[i/divisor]
-            fslayers[0]='terrain +1'	# for FS2004 photoscenery
-            fslayers[1]='terrain +2'	# for Blue Sky photoscenery
-            fslayers[2]='terrain +3'	#  "
-            fslayers[3]='terrain +4'	#  "
-        if __debug__:
-            if fslayers and self.debug:
-                self.debug.write("\nLayer mapping:\n")
-                for key in sorted(fslayers.keys()):
-                    self.debug.write("%02d -> %s\n" % (key, fslayers[key]))
-                self.debug.write("\n")
-
-        # write out objects
-        keys=objdef.keys()
-        sortfolded(keys)
-        n = len(keys)+len(self.polydat)
-        i = 0
-        for name in keys:
-            if name in self.objdat:
-                self.status(i*100.0/n, name)
-                for scale in objdef[name]:
+        self.texpool=workerpool(self.workers)	# textures are converted in the background
+        try:
+            # make a list of requested objects and scales
+            objdef={}
+            for loc, heading, complexity, name, scale in self.objplc:
+                if not name in objdef:
+                    objdef[name]=[scale]
+                elif not scale in objdef[name]:
+                    objdef[name].append(scale)
+            polydef={}
+            for (name, param, points) in self.polyplc:
+                if not name in polydef:
+                    polydef[name]=True
+
+            # do layer mapping
+            # In FSX any layer overwrites runways and taxiways. layer>=16 also overwrites markings and lights.
+            # We have to map these to 8 X-Plane layers below markings and 8 above.
+            # In X-Plane 9, polygons with surface at layer airports+1 or later also suppresses lights. But not in X-Plane 10.
+            # Note: In X-Plane 10.20, airports layer doesn't work for draped objs
+            fslayers={}
+            for name in objdef:
+                if name in self.objdat:
                     for obj in self.objdat[name]:
-                        obj.export(scale, self, fslayers)
-            elif name in self.stock.values():
-                self.log('Object %s is a built-in object' % name)
-            elif '/' not in name:	# Not substituted library object
-                self.log('Object %s not found' % name)
-            elif name.startswith('opensceneryx/'):
-                self.usesopensceneryx=True
-            i+=1
-        keys=self.polydat.keys()
-        sortfolded(keys)
-        for name in keys:
-            self.status(i*100.0/n, name)
-            self.polydat[name].export(self, fslayers)
-            i+=1
+                        if obj.layer: fslayers[obj.layer]=None
+            for name in polydef:
+                if name in self.polydat:
+                    poly=self.polydat[name]
+                    if poly.layer: fslayers[poly.layer]=None
+            lokeys=sorted([key for key in fslayers.keys() if 4<=key<16])
+            hikeys=sorted([key for key in fslayers.keys() if key>=16])
+            for (keys, mapping) in [(lokeys, ['runways +1', 'runways +2', 'runways +3', 'runways +4', 'runways +5', 'markings -5', 'markings -4', 'markings -3', 'markings -2', 'markings -1']),
+                                    (hikeys, ['roads +1', 'roads +2', 'roads +3', 'roads +4', 'roads +5', 'objects -5', 'objects -4', 'objects -3', 'objects -2', 'objects -1'])]:
+                divisor=(len(keys)+7)/8	# have to map to 8 values
+                for i in range(len(keys)):
+                    fslayers[keys[i]]=mapping[i/divisor]
+                fslayers[0]='terrain +1'	# for FS2004 photoscenery
+                fslayers[1]='terrain +2'	# for Blue Sky photoscenery
+                fslayers[2]='terrain +3'	#  "
+                fslayers[3]='terrain +4'	#  "
+            if __debug__:
+                if fslayers and self.debug:
+                    self.debug.write("\nLayer mapping:\n")
+                    for key in sorted(fslayers.keys()):
+                        self.debug.write("%02d -> %s\n" % (key, fslayers[key]))
+                    self.debug.write("\n")
+
+            # write out objects
+            keys=objdef.keys()
+            sortfolded(keys)
+            n = len(keys)+len(self.polydat)
+            i = 0
+            for name in keys:
+                if name in self.objdat:
+                    self.status(i*100.0/n, name)
+                    for scale in objdef[name]:
+                        for obj in self.objdat[name]:
+                            obj.export(scale, self, fslayers)
+                elif name in self.stock.values():
+                    self.log('Object %s is a built-in object' % name)
+                elif '/' not in name:	# Not substituted library object
+                    self.log('Object %s not found' % name)
+                elif name.startswith('opensceneryx/'):
+                    self.usesopensceneryx=True
+                i+=1
+            keys=self.polydat.keys()
+            sortfolded(keys)
+            for name in keys:
+                self.status(i*100.0/n, name)
+                self.polydat[name].export(self, fslayers)
+                i+=1
 
-        if self.dumplib:
-            return
+            if self.dumplib:
+                self.texwait()
+                return
 
-        if self.usesopensceneryx:
-            self.log('Using objects from the OpenSceneryX library')
-            copyfile(join('Resources','opensceneryx_library.txt'), join(self.xppath, 'library.txt'))
-            mkdir(join(self.xppath,'opensceneryx'))
-            for filename in listdir('Resources'):
-                if splitext(filename)[0]=='placeholder':
-                    copyfile(join('Resources',filename), join(self.xppath,'opensceneryx',filename))
-
-        # copy readmes
-        for path, dirs, files in walk(self.fspath):
-            for filename in files:
-                (s,e)=splitext(filename)
-                if e.lower() in ['.htm', '.html', '.rtf', '.doc', '.pdf', '.jpg', '.jpeg']:
-                    copyfile(join(path, filename),
-                             join(self.xppath, filename))
-                else:
-                    for f in ['readme', 'read me',	# en
-                              'leggime', 'leggi me'	# it
-                              'leeeme', 'leee me',	# sp
-                              'lisezmoi', 'lisez moi']:	# fr
-                        if f in filename.lower():
-                            copyfile(join(path, filename),
-                                     join(self.xppath, filename))
+            if self.usesopensceneryx:
+                self.log('Using objects from the OpenSceneryX library')
+                copyfile(join('Resources','opensceneryx_library.txt'), join(self.xppath, 'library.txt'))
+                mkdir(join(self.xppath,'opensceneryx'))
+                for filename in self.inventory.listdir('Resources'):
+                    if splitext(filename)[0]=='placeholder':
+                        copyfile(join('Resources',filename), join(self.xppath,'opensceneryx',filename))
+
+            # copy readmes
+            for path, dirs, files in self.inventory.walk(self.fspath):
+                for filename in files:
+                    (s,e)=splitext(filename)
+                    if e.lower() in ['.htm', '.html', '.rtf', '.doc', '.pdf', '.jpg', '.jpeg']:
+                        copyfile(join(path, filename),
+                                 join(self.xppath, filename))
+                    else:
+                        for f in ['readme', 'read me',	# en
+                                  'leggime', 'leggi me'	# it
+                                  'leeeme', 'leee me',	# sp
+                                  'lisezmoi', 'lisez moi']:	# fr
+                            if f in filename.lower():
+                                copyfile(join(path, filename),
+                                         join(self.xppath, filename))
                         
         
-        self.status(-1, 'Writing DSFs')
-        cmplx={}
-        for loc, heading, complexity, name, scale in self.objplc:
-            tile=(int(floor(loc.lat)), int(floor(loc.lon)))
-            key=(name,scale)
-            if not cmplx.has_key(tile):
-                cmplx[tile]={}
-            if not cmplx[tile].has_key(key) or cmplx[tile][key]>complexity:
-                cmplx[tile][key]=complexity
-
-        #expand names & create indices & create per-complexity placements
-        objdef={}	# filenames (maybe more than one per Object)
-        objplc={}	# number and location
-        objlookup={}	# lists of indices into objdef
-        polydef={}	# filename
-        polyplc={}	# number and data
-        polylookup={}	# lists of indices into polydef
-        for loc, heading, c, name, scale in self.objplc:
-            tile=(int(floor(loc.lat)), int(floor(loc.lon)))
-            key=(name,scale)
-            complexity=cmplx[tile][(name,scale)]
-            if not tile in objdef:
-                objdef[tile]=[[] for i in range(complexities)]
-                objplc[tile]=[[] for i in range(complexities)]
-                objlookup[tile]={}
-                polydef[tile]=[]
-                polyplc[tile]=[]
-
-            if not key in objlookup[tile]:
-                # Object not in objdef yet
-                thisobjdef=objdef[tile][complexity]
-                if '/' in name:		# Substituted library object
-                    objlookup[tile][key]=[len(thisobjdef)]
-                    thisobjdef.append(name)
-                elif name in self.objdat:
-                    # Must only add objs that exist
-                    idx=[]
-                    for obj in self.objdat[name]:
-                        idx.append(len(thisobjdef))
-                        thisobjdef.append("objects/" + obj.filename(scale))
-                    objlookup[tile][key]=idx
-                else:
-                    continue
-
-            base=objlookup[tile][key][0]
-            for i in objlookup[tile][key]:
-                objplc[tile][complexity].append((i,loc.lon,loc.lat,heading))
+            self.status(-1, 'Writing DSFs')
+            cmplx={}
+            for loc, heading, complexity, name, scale in self.objplc:
+                tile=(int(floor(loc.lat)), int(floor(loc.lon)))
+                key=(name,scale)
+                if not cmplx.has_key(tile):
+                    cmplx[tile]={}
+                if not cmplx[tile].has_key(key) or cmplx[tile][key]>complexity:
+                    cmplx[tile][key]=complexity
+
+            #expand names & create indices & create per-complexity placements
+            objdef={}	# filenames (maybe more than one per Object)
+            objplc={}	# number and location
+            objlookup={}	# lists of indices into objdef
+            polydef={}	# filename
+            polyplc={}	# number and data
+            polylookup={}	# lists of indices into polydef
+            for loc, heading, c, name, scale in self.objplc:
+                tile=(int(floor(loc.lat)), int(floor(loc.lon)))
+                key=(name,scale)
+                complexity=cmplx[tile][(name,scale)]
+                if not tile in objdef:
+                    objdef[tile]=[[] for i in range(complexities)]
+                    objplc[tile]=[[] for i in range(complexities)]
+                    objlookup[tile]={}
+                    polydef[tile]=[]
+                    polyplc[tile]=[]
+
+                if not key in objlookup[tile]:
+                    # Object not in objdef yet
+                    thisobjdef=objdef[tile][complexity]
+                    if '/' in name:		# Substituted library object
+                        objlookup[tile][key]=[len(thisobjdef)]
+                        thisobjdef.append(name)
+                    elif name in self.objdat:
+                        # Must only add objs that exist
+                        idx=[]
+                        for obj in self.objdat[name]:
+                            idx.append(len(thisobjdef))
+                            thisobjdef.append("objects/" + obj.filename(scale))
+                        objlookup[tile][key]=idx
+                    else:
+                        continue
 
-        for (name, heading, points) in self.polyplc:
-            tile=(int(floor(points[0][0][0].lat)), int(floor(points[0][0][0].lon)))
-            if not tile in polydef:
-                objdef[tile]=[[] for i in range(complexities)]
-                objplc[tile]=[[] for i in range(complexities)]
-                polydef[tile]=[]
-                polyplc[tile]=[]
+                base=objlookup[tile][key][0]
+                for i in objlookup[tile][key]:
+                    objplc[tile][complexity].append((i,loc.lon,loc.lat,heading))
 
-            if '/' in name:		# Substituted library object
-                fname=name
-            else:
-                fname="objects/"+self.polydat[name].filename()
-            if not fname in polydef[tile]:
-                polyplc[tile].append((len(polydef[tile]),heading,points))
-                polydef[tile].append(fname)
-            else:
-                polyplc[tile].append((polydef[tile].index(fname),heading,points))
-
-        tiles=objdef.keys()
-        n = len(tiles)
-        t = 0
-        for tile in tiles:
-            (lat,lon)=tile
-            sw=Point(lat,lon)
-            ne=Point(sw.lat+1,sw.lon+1)
-            objdefs=objdef[tile]
-            objplcs=objplc[tile]
-            polydefs=polydef[tile]
-            polyplcs=polyplc[tile]
-            tilename="%+03d%+04d" % (lat,lon)
-            tiledir=join("Earth nav data", "%+02d0%+03d0" % (
-                int(lat/10), int(lon/10)))
-            self.status(t*100.0/n, tilename+'.dsf')
-            t+=1
-            objcount=0
-
-            # Caculate base index for each complexity. Highest are first.
-            base=[[] for i in range(complexities)]
-            for i in range(complexities-1,-1,-1):
-                number=objcount
-                for j in range(i+1, complexities):
-                    number+=len(objdefs[j])
-                base[i]=number
+            for (name, heading, points) in self.polyplc:
+                # Points may lie on the tile's N or E border, so go by the SW-most
+                tile=(int(floor(min([p[0].lat for p in points[0]]))), int(floor(min([p[0].lon for p in points[0]]))))
+                if not tile in polydef:
+                    objdef[tile]=[[] for i in range(complexities)]
+                    objplc[tile]=[[] for i in range(complexities)]
+                    polydef[tile]=[]
+                    polyplc[tile]=[]
 
-            path=join(self.xppath, 'Earth nav data')
-            if not isdir(path): mkdir(path)
-            path=join(self.xppath, tiledir)
-            if not isdir(path): mkdir(path)
-            dstname=join(path, tilename+'.txt')
-            dst=file(dstname, 'wt')
-
-            dst.write('I\n800\nDSF2TEXT\n\n')
-            dst.write('PROPERTY sim/planet\tearth\n')
-            dst.write('PROPERTY sim/overlay\t1\n')
-            if self.docomplexity:
-                for i in range(complexities):
-                    if len(objdefs[i]):
-                        dst.write('PROPERTY sim/require_object\t%d/%d\n'% (
-                            i+1, base[i]))
-                dst.write('PROPERTY sim/require_polygon\t1/0\n')
-            else:
-                dst.write('PROPERTY sim/require_object\t1/0\n')
-                dst.write('PROPERTY sim/require_polygon\t1/0\n')
-            for exc in self.exc:
-                (typ, bl,tr)=exc
-                if bl.within(sw,ne) or tr.within(sw,ne):
-                    dst.write('PROPERTY sim/exclude_%s\t%13.8f/%12.8f/%13.8f/%12.8f\n' % (typ, bl.lon,bl.lat, tr.lon,tr.lat))
-            dst.write('PROPERTY sim/creation_agent\t%s' % banner)
-            # Following must be the last properties
-            dst.write('PROPERTY sim/west\t%d\n' %  sw.lon)
-            dst.write('PROPERTY sim/east\t%d\n' %  ne.lon)
-            dst.write('PROPERTY sim/north\t%d\n' %  ne.lat)
-            dst.write('PROPERTY sim/south\t%d\n' %  sw.lat)
-            dst.write('\n')
-            dst.write('DIVISIONS\t%d\n' % divisions)
-            dst.write('\n')
-
-            for i in range(complexities-1,-1,-1):
-                for name in objdefs[i]:
-                    dst.write('OBJECT_DEF %s\n' % name)
-            dst.write('\n')
-
-            for name in polydefs:
-                dst.write('POLYGON_DEF %s\n' % name)
-            if polydefs: dst.write('\n')
-
-            for i in range(complexities-1,-1,-1):
-                for plc in objplcs[i]:
-                    (idx,lon,lat,heading)=plc
-                    # DSFTool<=2.0 rounds down rather than to nearest encodable value, so round up here first
-                    dst.write('OBJECT %3d %14.9f %14.9f %6.2f\n' % (base[i]+idx, min(ne.lon, lon+minres/4), min(ne.lat, lat+minres/4), (heading+minhdg/4)%360))
-            dst.write('\n')
-
-            for (idx,heading,poly) in polyplcs:
-                dst.write('BEGIN_POLYGON %d %d %d\n' % (idx, heading, heading==65535 and 4 or 2))
-                for w in poly:
-                    dst.write('BEGIN_WINDING\n')
-                    for p in w:
+                if '/' in name:		# Substituted library object
+                    fname=name
+                else:
+                    fname="objects/"+self.polydat[name].filename()
+                if not fname in polydef[tile]:
+                    polyplc[tile].append((len(polydef[tile]),heading,points))
+                    polydef[tile].append(fname)
+                else:
+                    polyplc[tile].append((polydef[tile].index(fname),heading,points))
+
+            tiles=objdef.keys()
+            n = len(tiles)
+            t = 0
+            for tile in tiles:
+                (lat,lon)=tile
+                sw=Point(lat,lon)
+                ne=Point(sw.lat+1,sw.lon+1)
+                objdefs=objdef[tile]
+                objplcs=objplc[tile]
+                polydefs=polydef[tile]
+                polyplcs=polyplc[tile]
+                tilename="%+03d%+04d" % (lat,lon)
+                tiledir=join("Earth nav data", "%+02d0%+03d0" % (
+                    int(lat/10), int(lon/10)))
+                self.status(t*100.0/n, tilename+'.dsf')
+                t+=1
+                objcount=0
+
+                # Caculate base index for each complexity. Highest are first.
+                base=[[] for i in range(complexities)]
+                for i in range(complexities-1,-1,-1):
+                    number=objcount
+                    for j in range(i+1, complexities):
+                        number+=len(objdefs[j])
+                    base[i]=number
+
+                path=join(self.xppath, 'Earth nav data')
+                if not isdir(path): mkdir(path)
+                path=join(self.xppath, tiledir)
+                if not isdir(path): mkdir(path)
+                props=[('sim/planet', 'earth'), ('sim/overlay', '1')]
+                if self.docomplexity:
+                    for i in range(complexities):
+                        if len(objdefs[i]):
+                            props.append(('sim/require_object', '%d/%d' % (i+1, base[i])))
+                    props.append(('sim/require_polygon', '1/0'))
+                else:
+                    props.append(('sim/require_object', '1/0'))
+                    props.append(('sim/require_polygon', '1/0'))
+                for exc in self.exc:
+                    (typ, bl,tr)=exc
+                    if bl.within(sw,ne) or tr.within(sw,ne):
+                        props.append(('sim/exclude_%s' % typ, '%.8f/%.8f/%.8f/%.8f' % (bl.lon,bl.lat, tr.lon,tr.lat)))
+                props.append(('sim/creation_agent', banner.strip()))
+                # Following must be the last properties
+                props.append(('sim/west', '%d' % sw.lon))
+                props.append(('sim/east', '%d' % ne.lon))
+                props.append(('sim/north', '%d' % ne.lat))
+                props.append(('sim/south', '%d' % sw.lat))
+
+                objnames=[]
+                objects=[]
+                for i in range(complexities-1,-1,-1):
+                    objnames.extend(objdefs[i])
+                    for plc in objplcs[i]:
+                        (idx,lon,lat,heading)=plc
+                        # DSFTool<=2.0 rounds down rather than to nearest encodable value, so round up here first
+                        objects.append((base[i]+idx, min(ne.lon, lon+minres/4), min(ne.lat, lat+minres/4), (heading+minhdg/4)%360))
+                polygons=[]
+                for (idx,heading,poly) in polyplcs:
+                    windings=[]
+                    for w in poly:
                         if heading==65535:	# have UVs
-                            dst.write('POLYGON_POINT %14.9f %14.9f %8.4f %8.4f\n' % (min(ne.lon, p[0].lon+minres/4), min(ne.lat, p[0].lat+minres/4), p[1], p[2]))
+                            windings.append([(min(ne.lon, p[0].lon+minres/4), min(ne.lat, p[0].lat+minres/4), p[1], p[2]) for p in w])
                         else:
-                            dst.write('POLYGON_POINT %14.9f %14.9f\n' % (min(ne.lon, p[0].lon+minres/4), min(ne.lat, p[0].lat+minres/4)))
-                    dst.write('END_WINDING\n')
-                dst.write('END_POLYGON\n')
-            if polyplcs: dst.write('\n')
+                            windings.append([(min(ne.lon, p[0].lon+minres/4), min(ne.lat, p[0].lat+minres/4)) for p in w])
+                    polygons.append((idx, heading, windings))
 
-            dst.close()
-            dsfname=join(path, tilename+'.dsf')
-            x=helper(self.dsfexe, '-text2dsf', dstname, dsfname)
-            if not exists(dsfname):
-                raise FS2XError("Can't write DSF %s.dsf\n%s" % (tilename, x))
-            if not self.debug: unlink(dstname)
+                dsfname=join(path, tilename+'.dsf')
+                if not self.dsftool:
+                    writedsf(dsfname, sw, divisions, props, objnames, polydefs, objects, polygons)
+                    continue
+
+                dstname=join(path, tilename+'.txt')
+                dst=file(dstname, 'wt')
+                dst.write('I\n800\nDSF2TEXT\n\n')
+                for prop in props:
+                    dst.write('PROPERTY %s\t%s\n' % prop)
+                dst.write('\n')
+                dst.write('DIVISIONS\t%d\n' % divisions)
+                dst.write('\n')
+
+                for name in objnames:
+                    dst.write('OBJECT_DEF %s\n' % name)
+                dst.write('\n')
+
+                for name in polydefs:
+                    dst.write('POLYGON_DEF %s\n' % name)
+                if polydefs: dst.write('\n')
+
+                for obj in objects:
+                    dst.write('OBJECT %3d %14.9f %14.9f %6.2f\n' % obj)
+                dst.write('\n')
+
+                for (idx,heading,windings) in polygons:
+                    dst.write('BEGIN_POLYGON %d %d %d\n' % (idx, heading, heading==65535 and 4 or 2))
+                    for w in windings:
+                        dst.write('BEGIN_WINDING\n')
+                        for p in w:
+                            if heading==65535:	# have UVs
+                                dst.write('POLYGON_POINT %14.9f %14.9f %8.4f %8.4f\n' % p)
+                            else:
+                                dst.write('POLYGON_POINT %14.9f %14.9f\n' % p)
+                        dst.write('END_WINDING\n')
+                    dst.write('END_POLYGON\n')
+                if polygons: dst.write('\n')
+
+                dst.close()
+                x=helper(self.dsfexe, '-text2dsf', dstname, dsfname)
+                if not exists(dsfname):
+                    raise FS2XError("Can't write DSF %s.dsf\n%s" % (tilename, x))
+                if not self.debug: unlink(dstname)
+
+            self.texwait()
+        finally:
+            if self.texpool:	# failed before texwait
+                self.texpool.terminate()
+                self.texpool.join()
+                self.texpool=None
+                self.texjobs=[]
+                self.texdsts={}
+
+
+    # Wait for the texture conversions started by maketex
+    def texwait(self):
+        if self.texjobs: self.status(-1, 'Writing textures')
+        for (src, job) in self.texjobs:
+            try:
+                texevents(job.get(), self)
+            except:
+                if self.debug: print_exc(None, self.debug)
+                self.log("Can't convert texture %s" % basename(src))
+        self.texjobs=[]
+        self.texdsts={}
+        if self.texpool:
+            self.texpool.close()
+            self.texpool.join()
+            self.texpool=None
+        if self.texrenames: self.retexture()
+
+    # Point OBJs and polygons that were written before their texture had
+    # to be converted to PNG instead of DDS at the PNG
+    def retexture(self):
+        path=join(self.xppath, 'objects')
+        for filename in listdir(path):
+            if splitext(filename)[1].lower() not in ['.obj', '.pol']: continue
+            f=file(join(path, filename), 'rt')
+            lines=f.readlines()
+            f.close()
+            changed=False
+            for i in range(len(lines)):
+                tokens=lines[i].split()
+                if len(tokens)==2 and tokens[0].startswith('TEXTURE') and tokens[1] in self.texrenames:
+                    lines[i]=lines[i].replace(tokens[1], self.texrenames[tokens[1]])
+                    changed=True
+            if changed:
+                f=file(join(path, filename), 'wt')
+                f.writelines(lines)
+                f.close()
+        self.texrenames={}
 
 
     # Should taxiway node be suppressed?
@@ -1145,3 +1124,391 @@ class Output:
                 return self.doexcfac
         return False
 
+
+# Scan one BGL for library objects and exclusions.
+# Runs in a worker process, so returns its side-effects as
+# (done, exclusions, events) for Output.scanlibs to replay in file order.
+def scanbgl(job):
+    (bglname, size, toppath, local, bglexe, debug, lazy)=job
+    filename=basename(bglname)
+    res=ScanResult(debug)
+    if size==0:
+        return res.result(True)	# Sometimes seen 0-length files!
+    try:
+        bgl=BGLFile(bglname)
+    except IOError:
+        res.log("Can't read \"%s\"" % filename)
+        res.retry()
+        return res.result(True)
+    c=bgl.read(2)
+    if len(c)!=2:
+        bgl.close()
+        res.log("Can't read \"%s\"" % filename)
+        res.retry()
+        return res.result(True)
+    done=True
+    (c,)=unpack('<H', c)
+    if c&0xff00==0:
+        # Old-style
+        for section in [42,46,54,58,102]:
+            bgl.seek(section)
+            (secbase,)=bgl.unpack('<I')
+            if secbase: done=False	# Includes other data
+        bgl.seek(62)	# LIBRARY data
+        (libbase,)=bgl.unpack('<I')
+        if local:
+            bgl.seek(114)	# EXCLUSION data
+            (excbase,)=bgl.unpack('<I')
+        else:
+            excbase=0
+        if not (libbase or excbase):
+            bgl.close()
+            return res.result(False)
+        res.status()
+        tmp=bglname
+        bgl.seek(122)
+        (spare2,)=bgl.unpack('<I')
+        if spare2 and lazy and not excbase:
+            # Only library data - decompress when used. See Output.findlib
+            bgl.close()
+            res.pending(libuids(bglname, libbase))
+            return res.result(done)
+        elif spare2:
+            # compressed
+            bgl.close()
+            tmp=unzippedname(bglname)
+            if exists(tmp): unlink(tmp)	# from a previous run
+            if unzipbgl(bglname, tmp):
+                pass	# decompressed in-process
+            elif platform!='win32':
+                compressed=bglname
+                # Wine can't handle non-ascii?
+                try:
+                    bglname[len(toppath):].encode("ascii")
+                except:
+                    # per-process names since may be running in a pool
+                    compressed=join(gettempdir(), 'fs2xp1-%d.bgl' % getpid())
+                    copyfile(bglname, compressed)
+                helper(bglexe, compressed, tmp)
+                if compressed!=bglname: unlink(compressed)
+            else:
+                helper(bglexe, bglname, tmp)
+            if not exists(tmp):
+                # Check for uncompressed version
+                tmp=join('Resources',basename(bglname).lower())
+                if not exists(tmp):
+                    res.log("Can't parse compressed file %s"%(filename))
+                    res.retry()	# helper may work next time
+                    return res.result(False)	# don't mark as done
+            bgl=BGLFile(tmp)
+        # Exclusions
+        if excbase:
+            bgl.seek(excbase)
+            if debug: res.debug.write('%s\n' % filename.encode("latin1", 'replace'))
+            try:
+                ProcEx(bgl, res)
+            except:
+                res.log("Can't parse Exclusion section in file %s" % filename)
+                if debug: print_exc(None, res.debug)
+        if not libbase:
+            bgl.close()
+            return res.result(False)
+        bgl.seek(libbase)
+        try:
+            while True:
+                pos=bgl.tell()
+                (off,)=bgl.unpack('<I')
+                if off==0: break
+                (a,b,c,d)=bgl.unpack('<IIII')
+                uid = "%08x%08x%08x%08x" % (a,b,c,d)
+                bgl.seek(libbase+off)
+                (a,b,c,d,x)=bgl.unpack('<IIIIB')
+                if a==1 and b==2 and c==3 and d==4:	# fs98 library
+                    (rcsize,)=bgl.unpack('<H')
+                    hdsize=19
+                    scale=1.0
+                else:
+                    (hdsize,rcsize,radius,scale,typ,prop)=bgl.unpack('<6I')
+                    if scale:
+                        scale=65536.0/scale
+                    else:
+                        scale=1.0
+                name=None
+                if hdsize>42:
+                    # Use "friendly" name instead of id
+                    name=asciify(bgl.read(hdsize- 41).rstrip(' \0'))
+                res.lib(uid, name, True, False,
+                        (8, bglname, tmp, libbase+off+hdsize, rcsize, scale))
+                bgl.seek(pos+20)
+        except:
+            res.log("Error parsing FS8 library %s" % filename)
+            if debug: print_exc(None, res.debug)
+
+    elif c==0x201:
+        # FS9 or FSX
+        islib=False
+        bgl.seek(4)
+        (sectiontbl,)=bgl.unpack('<I')
+        bgl.seek(20)
+        (sections,)=bgl.unpack('<I')
+        for section in range(sections):
+            bgl.seek(sectiontbl+20*section)
+            (typ,x,subsections,subsectiontbl)=bgl.unpack('<IIIi')
+            #print "%x %x %d" % (typ,x,subsections)
+            if typ!=0x2b:	# 2b=MDL data
+                if typ==0x6e:	# Ortho and DEM BGLs seem to have a 6e section
+                    res.log('Skipping terrain data in file %s' % filename)
+                elif typ==0x65:
+                    res.log("Skipping traffic data in file %s" % filename)
+                else:
+                    done=False	# Something else - perhaps Facility data
+                continue
+            if not islib:
+                res.status()
+                islib=True
+            for subsection in range(subsections):
+                bgl.seek(subsectiontbl+16*subsection)
+                #print "  %x" % bgl.tell(),
+                (id,records,recordtbl)=bgl.unpack('<IIi')
+                #print "%x %d" % (id,records)
+                for record in range(records):
+                    bgl.seek(recordtbl+record*24)
+                    (a,b,c,d,off,rcsize)=bgl.unpack('<IIIIiI')
+                    uid = "%08x%08x%08x%08x" % (a,b,c,d)
+                    name=None
+
+                    # Check for FSX friendly name
+                    bgl.seek(recordtbl+off)
+                    if bgl.read(4)=='RIFF':
+                        (mdlsize,)=bgl.unpack('<I')
+                        if bgl.read(4)=='MDLX':
+                            mdlformat=10	# FSX format
+                            while bgl.tell()<recordtbl+off+mdlsize:
+                                c=bgl.read(4)
+                                (size,)=bgl.unpack('<I')
+                                if c=='MDLN':
+                                    name=asciify(bgl.read(size).strip('\0').strip())
+                                    break
+                                elif c=='MDLD':
+                                    break	# stop at data
+                                else:
+                                    bgl.seek(size,1)
+                        else:
+                            mdlformat=9	# FS9 format
+
+                    res.lib(uid, name, records==1, True,
+                            (mdlformat, bglname, bglname, recordtbl+off, rcsize, 1.0))
+    else:
+        res.log("Can't parse file \"%s\". Is this a BGL file?" % filename)
+    bgl.close()
+    return res.result(done)
+
+
+# uids of the objects in a compressed FS8 library BGL, decompressing only as
+# much of it as holds the library's directory. None if it can't be read.
+def libuids(bglname, libbase):
+    size=libbase+65536	# enough for most libraries
+    while True:
+        data=unzipbgldata(bglname, size)
+        if not data: return None
+        uids=[]
+        pos=libbase
+        while pos+20<=len(data):
+            (off,)=unpack_from('<I', data, pos)
+            if off==0: return uids
+            uids.append("%08x%08x%08x%08x" % unpack_from('<IIII', data, pos+4))
+            pos+=20
+        if pos+4<=len(data) and unpack_from('<I', data, pos)==(0,): return uids
+        if len(data)<size: return None	# whole file, and no end
+        size*=2
+
+
+# Where scanbgl decompresses a library BGL to. Library entries read from
+# this file for the rest of the run, so it's named after the whole path in
+# case BGLs in different folders have the same name, and is ascii because
+# Wine can't handle non-ascii.
+def unzippedname(bglname):
+    if isinstance(bglname, unicode): bglname=bglname.encode('utf-8')
+    return join(gettempdir(), 'fs2xp-%s.bgl' % md5(bglname).hexdigest())
+
+
+# Interpret an old-style BGL into output. Returns True for a new-style BGL,
+# which Output.process leaves until exclusions have been set up.
+def readbgl(bglname, toppath, texdir, output, bglexe, scen=None):
+    filename=basename(bglname)
+    try:
+        bgl=BGLFile(bglname)
+    except IOError:
+        output.log("Can't read \"%s\"" % bglname)
+        return False
+    c=bgl.read(2)
+    if len(c)!=2:
+        bgl.close()
+        output.log("Can't read \"%s\"" % bglname)
+        return False
+    tmp=None
+    isxml=False
+    (c,)=unpack('<H', c)
+    if c&0xff00==0:
+        bgl.seek(122)
+        (spare2,)=bgl.unpack('<I')
+        if spare2:
+            # compressed
+            bgl.close()
+            # per-process names since may be running in a pool
+            tmp=join(gettempdir(), '%d-%s' % (getpid(), filename))
+            if unzipbgl(bglname, tmp):
+                pass	# decompressed in-process
+            elif platform!='win32':
+                compressed=bglname
+                # Wine can't handle non-ascii?
+                try:
+                    bglname[len(toppath):].encode("ascii")
+                except:
+                    compressed=join(gettempdir(), 'fs2xp1-%d.bgl' % getpid())
+                    copyfile(bglname, compressed)
+                    tmp=join(gettempdir(), 'fs2xp2-%d.bgl' % getpid())
+                helper(bglexe, compressed, tmp)
+                if compressed!=bglname: unlink(compressed)
+            else:
+                helper(bglexe, bglname, tmp)
+            if not exists(tmp):
+                output.log("Can't parse compressed file %s" % (
+                    filename))
+                return False
+            bgl=BGLFile(tmp)
+        try:
+            convbgl.Parse(bgl, bglname, output, texdir, scen)
+        except:
+            output.log("Can't read \"%s\"" % filename)
+            if output.debug: print_exc(None, output.debug)
+    elif c==0x201:
+        isxml=True
+    else:
+        output.log("Can't parse \"%s\". Is this a BGL file?" % (
+            filename))
+    bgl.close()
+    if tmp and exists(tmp) and not output.debug: unlink(tmp)
+    return isxml
+
+
+# Interpret one old-style BGL. Runs in a worker process, so returns
+# (new-style?, side-effects) for Output.process to replay in file order.
+# Failures are logged rather than raised, since the exception might not
+# survive the trip back.
+def procbgl(job):
+    (bglname, toppath, texdir, settings, bglexe)=job
+    res=convbgl.AreaResult(settings)
+    try:
+        isxml=readbgl(bglname, toppath, texdir, res, bglexe, convbgl.AreaScen)
+    except:
+        res.log("Can't read \"%s\"" % basename(bglname))
+        if res.debug: print_exc(None, res.debug)
+        isxml=False
+    return (isxml, res.result())
+
+
+# Stands in for Output while scanning a BGL in scanbgl
+class ScanResult:
+    def __init__(self, debug):
+        self.exc=[]	# Exclusion rectangles, as Output.exc
+        self.events=[]	# Status, log, debug and library entries in order
+        if debug:
+            self.debug=self
+        else:
+            self.debug=None
+
+    def status(self):
+        self.events.append(('status',))
+
+    def log(self, msg):
+        self.events.append(('log', msg))
+
+    # debug file interface
+    def write(self, msg):
+        self.events.append(('debug', msg))
+
+    # library entry whose name is resolved by Output.addlib
+    def lib(self, uid, name, single, usestock, entry):
+        self.events.append(('lib', uid, name, single, usestock, entry))
+
+    # library data that hasn't been decompressed, and the uids it defines
+    def pending(self, uids):
+        self.events.append(('pending', uids))
+
+    # failed in a way that might not happen next time, so don't cache
+    def retry(self):
+        self.events.append(('retry',))
+
+    def result(self, done):
+        return (done, self.exc, self.events)
+
+
+# Persistent cache of scanbgl results by filename, so that unchanged
+# libraries don't need to be re-read on the next run
+class LibIndex:
+    format=2	# of the entries, within an appversion
+
+    def __init__(self, filename, inventory):
+        self.filename=filename
+        self.inventory=inventory
+        self.entries={}	# (size, mtime, unzipped, result) by (bglname, local, debug, lazy)
+        self.changed=False
+        if not filename: return
+        try:
+            h=file(filename, 'rb')
+            (version, entries)=load(h)
+            h.close()
+            if version==(appversion, LibIndex.format):	# scanbgl may have changed
+                self.entries=entries
+        except:
+            pass	# missing or corrupt - start again
+
+    def lookup(self, job):
+        (bglname, size, toppath, local, bglexe, debug, lazy)=job
+        key=(bglname, local, debug, lazy)
+        if key not in self.entries: return None
+        (size, mtime, unzipped, result)=self.entries[key]
+        s=self.inventory.stat(bglname)
+        if not s or s.st_size!=size or s.st_mtime!=mtime: return None
+        # Compressed libraries are read from a temporary copy, which must
+        # still be the one that was made from this BGL
+        if unzipped and self.unzipped(bglname, result)!=unzipped: return None
+        return result
+
+    def store(self, job, result):
+        if not self.filename: return
+        (bglname, size, toppath, local, bglexe, debug, lazy)=job
+        key=(bglname, local, debug, lazy)
+        if [event for event in result[2] if event[0]=='retry']:
+            if key in self.entries:
+                del self.entries[key]
+                self.changed=True
+            return
+        unzipped=self.unzipped(bglname, result)
+        if unzipped is False: return
+        s=self.inventory.stat(bglname)
+        if not s: return
+        self.entries[key]=(s.st_size, s.st_mtime, unzipped, result)
+        self.changed=True
+
+    # (name, size, mtime) of the temporary copy that result's library
+    # entries read from, or None if they read from the BGL itself. False if
+    # they read from somewhere else or the copy is missing.
+    def unzipped(self, bglname, result):
+        files=set([event[5][2] for event in result[2] if event[0]=='lib'])
+        files.discard(bglname)
+        if not files: return None
+        tmp=unzippedname(bglname)
+        if files!=set([tmp]) or not exists(tmp): return False
+        s=stat(tmp)
+        return (tmp, s.st_size, s.st_mtime)
+
+    def save(self):
+        if not self.changed: return
+        try:
+            h=file(self.filename, 'wb')
+            dump(((appversion, LibIndex.format), self.entries), h, -1)
+            h.close()
+        except IOError:
+            pass
@@ -1,6 +1,8 @@
+from numpy import array, empty
 from os import listdir
 from os.path import basename, dirname, join, normpath, pardir, splitext
 from struct import unpack
+from timeit import default_timer
 
 from convbgl import findtex, maketexdict
 from convutil import asciify, rgb2uv, Matrix, Object, Material, Texture
@@ -26,25 +28,28 @@ class ProcScen:
         amap=[]
         scen=[]
         data={}
+        prof=output.opprof
+        vertices=polygons=0	# Generated geometry, for OpProfile
         
         if bgl.read(4)!='RIFF': raise IOError
-        (mdlsize,)=unpack('<I', bgl.read(4))
+        (mdlsize,)=bgl.unpack('<I')
         endmdl=bgl.tell()+mdlsize
         if bgl.read(4)!='MDLX': raise IOError
         while bgl.tell()<endmdl:
             c=bgl.read(4)
-            (size,)=unpack('<I', bgl.read(4))
+            (size,)=bgl.unpack('<I')
             if c=='MDLD':
                 end=size+bgl.tell()
                 while bgl.tell()<end:
                     c=bgl.read(4)
-                    (size,)=unpack('<I', bgl.read(4))
+                    (size,)=bgl.unpack('<I')
+                    if prof: (chunk, start, t, v, p)=(c, bgl.tell()-8, default_timer(), vertices, polygons)
                     if c=='TEXT':
                         tex.extend([bgl.read(64).strip('\0').strip() for i in range(0,size,64)])
                     elif c=='MATE':
                         # http://www.fsdeveloper.com/wiki/index.php?title=MDL_file_format_(FSX)#MATE
                         for i in range(0,size,120):
-                            (flags1,flags2,diffuse,detail,normal,specular,emissive,reflection,fresnel,dr,dg,db,da,sr,sg,sb,sa,sp,ds,normalscale,recflectionscale,po,power,bloomfloor,ambientscale,srcblend,dstblend,alphafunc,alphathreshhold,zwritealpha)=unpack('<9I16f3I2f', bgl.read(120))
+                            (flags1,flags2,diffuse,detail,normal,specular,emissive,reflection,fresnel,dr,dg,db,da,sr,sg,sb,sa,sp,ds,normalscale,recflectionscale,po,power,bloomfloor,ambientscale,srcblend,dstblend,alphafunc,alphathreshhold,zwritealpha)=bgl.unpack('<9I16f3I2f')
                             # Get texture names
                             diffuse   =(flags1 & Material.FSX_MAT_HAS_DIFFUSE) and tex[diffuse] or None
                             emissive  =(flags1 & Material.FSX_MAT_HAS_EMISSIVE) and tex[emissive] or None
@@ -77,26 +82,27 @@ class ProcScen:
                                 for i in range(len(mattex)):
                                     output.debug.write("%3d:\t%s\t%s\n" % (i, mattex[i][0], mattex[i][1]))
                     elif c=='INDE':
-                        idx=unpack('<%dH' % (size/2), bgl.read(size))
+                        idx=unpack('<%dH' % (size/2), bgl.view(size))
                     elif c=='VERB':
                         endv=size+bgl.tell()
                         while bgl.tell()<endv:
                             c=bgl.read(4)
-                            (size,)=unpack('<I', bgl.read(4))
+                            (size,)=bgl.unpack('<I')
                             if c=='VERT':
-                                vt.append([unpack('<8f',bgl.read(32)) for i in range(0,size,32)])
+                                v=unpack('<%df' % (size/4), bgl.view(size))
+                                vt.append([v[i:i+8] for i in range(0,len(v),8)])
                             else:
                                 bgl.seek(size,1)
                     elif c=='TRAN':
                         for i in range(0,size,64):
-                            matrix.append(Matrix([unpack('<4f',bgl.read(16)) for j in range(4)]))
+                            matrix.append(Matrix([bgl.unpack('<4f') for j in range(4)]))
                         if __debug__:
                             if output.debug:
                                 output.debug.write("Matrices %d\n" % len(matrix))
                                 for i in range(len(matrix)): output.debug.write("%s = %d\n" % (matrix[i], i))
                     elif c=='AMAP':
                         for i in range(0,size,8):
-                            (a,b)=unpack('<2I',bgl.read(8))
+                            (a,b)=bgl.unpack('<2I')
                             amap.append(b)
                         if __debug__:
                             if output.debug:
@@ -107,7 +113,7 @@ class ProcScen:
                         # Assumed to be after TRAN and AMAP sections
                         count=size/8
                         for i in range(count):
-                            (child,peer,offset,unk)=unpack('<4h',bgl.read(8))
+                            (child,peer,offset,unk)=bgl.unpack('<4h')
                             scen.append((child,peer,offset,-1))
                         # Invert Child/Peer pointers to get parents
                         for i in range(count):
@@ -132,15 +138,15 @@ class ProcScen:
                         maxlod=0
                         while bgl.tell()<endt:
                             c=bgl.read(4)
-                            (size,)=unpack('<I', bgl.read(4))
+                            (size,)=bgl.unpack('<I')
                             if c=='LODE':
                                 ende=size+bgl.tell()
-                                (lod,)=unpack('<I', bgl.read(4))
+                                (lod,)=bgl.unpack('<I')
                                 while bgl.tell()<ende:
                                     c=bgl.read(4)
-                                    (size,)=unpack('<I', bgl.read(4))
+                                    (size,)=bgl.unpack('<I')
                                     if c=='PART':
-                                        (typ,scene,material,verb,voff,vcount,ioff,icount,unk)=unpack('<9I', bgl.read(36))
+                                        (typ,scene,material,verb,voff,vcount,ioff,icount,unk)=bgl.unpack('<9I')
                                         assert (typ==1)
                                         maxlod=max(lod,maxlod)
                                         (child, peer, finalmatrix, parent)=scen[scene]
@@ -153,6 +159,8 @@ class ProcScen:
                                             finalmatrix=finalmatrix*thismatrix
                                         if not lod in data: data[lod]=[]
                                         data[lod].append((mattex[material][0], mattex[material][1], vt[verb][voff:voff+vcount], idx[ioff:ioff+icount], finalmatrix))
+                                        vertices+=vcount
+                                        polygons+=icount/3
                                         partno+=1
                                     else:
                                         bgl.seek(size,1)
@@ -160,6 +168,7 @@ class ProcScen:
                                 bgl.seek(size,1)
                     else:
                         bgl.seek(size,1)
+                    if prof: prof.add(srcfile, chunk, 'MDLD', default_timer()-t, bgl.tell()-start, vertices-v, polygons-p)
             else:
                 bgl.seek(size,1)
 
@@ -168,21 +177,22 @@ class ProcScen:
         for (m,t,vt,idx,matrix) in data[maxlod]:
             if __debug__:
                 if output.debug: output.debug.write("%s\n%s\n" % (t, matrix))
-            objvt=[]
-            nrmmatrix=matrix.adjoint()
+            # Whole vertex list at once
+            vt=array(vt, float).reshape(-1,8)
+            xyz=matrix.transform_many(vt[:,0:3])
+            nrm=matrix.adjoint().rotate_many(vt[:,3:6], True)
+            objvt=empty((len(vt),8))
+            objvt[:,0:2]=xyz[:,0:2]
+            objvt[:,2]=-xyz[:,2]
+            objvt[:,3:5]=nrm[:,0:2]
+            objvt[:,5]=-nrm[:,2]
             if t:
                 assert not t.s and not t.n and not t.r	# Bunching scheme will need re-work
-                for (x,y,z, nx,ny,nz, tu,tv) in vt:
-                    (x,y,z)=matrix.transform(x,y,z)
-                    (nx,ny,nz)=nrmmatrix.rotateAndNormalize(nx,ny,nz)
-                    objvt.append((x,y,-z, nx,ny,-nz, tu,tv))
+                objvt[:,6:8]=vt[:,6:8]
             else:
                 # replace material with palette texture
-                (pu,pv)=rgb2uv(m.d)
-                for (x,y,z, nx,ny,nz, tu,tv) in vt:
-                    (x,y,z)=matrix.transform(x,y,z)
-                    (nx,ny,nz)=nrmmatrix.rotateAndNormalize(nx,ny,nz)
-                    objvt.append((x,y,-z, nx,ny,-nz, pu,pv))
+                objvt[:,6:8]=rgb2uv(m.d)
+            objvt=[tuple(v) for v in objvt.tolist()]
             if t in objs:
                 obj=objs[t]
                 if t and t.e: obj.tex.e=t.e	# Because we don't compare on emissive
@@ -1,6 +1,5 @@
 import codecs
 from math import sin, cos, atan, pi
-from os import listdir
 from os.path import join
 import xml.parsers.expat
 
@@ -12,7 +11,7 @@ ignorestock=['air_beacontower01', 'air_localizerantenna01', 'air_ndb_dmeantenna'
 def makestock(name, output):
     if name in output.subst: return None
     objname=name+'.obj'
-    if not objname in listdir('Resources'): return None
+    if not objname in output.inventory.listdir('Resources'): return None
 
     tex=None
     vt=[]
@@ -1,9 +1,8 @@
 from glob import glob
-from math import floor
-from os import listdir
 from os.path import basename, join
 import re
 
+from convclip import cliptiles
 from convutil import Polygon, Point, Texture
 
 LATRES=360.0/32768
@@ -23,7 +22,7 @@ def ProcPhoto(texdir, output):
     if output.debug: output.debug.write("%s\n" % texdir.encode("latin1", 'replace'))
 
     # All textures
-    texs=[i for i in listdir(texdir) if texre.search(i)]
+    texs=[i for i in output.inventory.listdir(texdir) if texre.search(i)]
     texsdict=dict([[i[:-4].lower(),i] for i in texs])
 
     # Blue Sky Scenery style
@@ -110,36 +109,14 @@ def ishigher(name, layer, lat,lon, blueskydict, output):
 def makephoto(name, tex, lat, lon, scale, layer, pixels, output):
     # lat and lon are the NW corner cos that's how MSFS does it
     if output.debug: output.debug.write("Photo: %s %.6f,%.6f,%s " % (name, lat, lon, scale))
-    if lon+LONRES*scale > floor(lon)+1:
-        # Split EW
-        if output.debug: output.debug.write("EW ")
-        points=[[(Point(lat-LATRES*scale,lon),0,0),
-                 (Point(lat-LATRES*scale,floor(lon)+1),(floor(lon)+1-lon)/(LONRES*scale),0),
-                 (Point(lat,floor(lon)+1),(floor(lon)+1-lon)/(LONRES*scale),1),
-                 (Point(lat,lon),0,1)],
-                [(Point(lat-LATRES*scale,floor(lon)+1),(floor(lon)+1-lon)/(LONRES*scale),0),
-                 (Point(lat-LATRES*scale,lon+(LONRES*scale)),1,0),
-                 (Point(lat,lon+LONRES*scale),1,1),
-                 (Point(lat,floor(lon)+1),(floor(lon)+1-lon)/(LONRES*scale),1)]]
-    else:
-        if output.debug: output.debug.write("OK ")
-        points=[[(Point(lat-LATRES*scale,lon),0,0),	# SW
-                 (Point(lat-LATRES*scale,lon+LONRES*scale),1,0),
-                 (Point(lat,lon+LONRES*scale),1,1),	# NE
-                 (Point(lat,lon),0,1)]]
-
-    if lat>floor(lat-LATRES*scale)+1:
-        if output.debug: output.debug.write("NS\n")
-        # Split NS
-        for i in range(len(points)):
-            points.append([(Point(floor(lat-LATRES*scale)+1,points[i][3][0].lon),points[i][3][1],(floor(lat-LATRES*scale)+1-lat+LATRES*scale)/(LATRES*scale)),
-                           (Point(floor(lat-LATRES*scale)+1,points[i][2][0].lon),points[i][2][1],(floor(lat-LATRES*scale)+1-lat+LATRES*scale)/(LATRES*scale)),
-                           points[i][2], points[i][3]])
-            points[i][2]=points[-1][1]
-            points[i][3]=points[-1][0]
-    elif output.debug: output.debug.write("OK\n")
+    points=[[(Point(lat-LATRES*scale,lon),0,0),	# SW
+             (Point(lat-LATRES*scale,lon+LONRES*scale),1,0),
+             (Point(lat,lon+LONRES*scale),1,1),	# NE
+             (Point(lat,lon),0,1)]]
+    polys=cliptiles(points)
+    if output.debug: output.debug.write("%d tiles\n" % len(polys))
 
     poly=Polygon(name, tex, True, int(LATRES*1852*60*scale), layer, (lat-LATRES*scale*0.5, lon+LONRES*scale*0.5, pixels))
     output.polydat[name]=poly
-    for p in points:
+    for p in polys:
         output.polyplc.append((name, 65535, p))
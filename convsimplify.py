@@ -0,0 +1,176 @@
+#
+# Douglas-Peucker simplification of polygons.
+#
+# Drops points that lie within a tolerance, in metres, of the line between
+# the points either side of them. A shortcut is only taken if it doesn't
+# cross any other edge of the polygon or enclose any other of its points, so
+# windings stay simple and holes stay inside their exterior.
+#
+
+from math import cos, radians
+
+from numpy import array, logical_and, logical_not, logical_or, logical_xor, zeros
+
+from convutil import onedeg
+
+
+# Simplify a polygon - a list of windings. loc(item) gives an item's Point.
+# Items for which fixed(winding, index) is true are kept. If uv is given,
+# uv(item) gives an item's (u,v) and items whose UVs are more than uvtol
+# from those interpolated along the shortcut are also kept.
+# Returns the simplified windings.
+def simplify(windings, tol, loc=None, fixed=None, uv=None, uvtol=0):
+    if not tol: return windings
+    if loc is None: loc=lambda p: p
+    p0=loc(windings[0][0])
+    scale=cos(radians(p0.lat))/onedeg
+    xys=[[((loc(p).lon-p0.lon)*scale, (loc(p).lat-p0.lat)/onedeg) for p in w] for w in windings]
+
+    # Every point and edge of the polygon, by winding and index
+    whole=Whole(xys)
+
+    # Points where windings touch themselves or each other are kept
+    seen={}
+    for (wi,w) in enumerate(windings):
+        for (i,p) in enumerate(w):
+            seen.setdefault((loc(p).lat, loc(p).lon), []).append((wi,i))
+    touch=set([key for keys in seen.itervalues() if len(keys)>1 for key in keys])
+
+    result=[]
+    for (wi,(w,xy)) in enumerate(zip(windings, xys)):
+        n=len(w)
+        if n<=3:
+            result.append(w)
+            continue
+        anchors=[i for i in range(n) if (wi,i) in touch or (fixed and fixed(w, i))]
+        # A winding needs at least three points, so start from points that
+        # are far apart, which would be kept anyway
+        if not anchors: anchors=[furthest(xy, 0)]
+        if len(anchors)==1: anchors.append(furthest(xy, anchors[0]))
+        if len(anchors)==2:
+            (i,j)=anchors
+            anchors.append(max([k for k in range(n) if k not in anchors], key=lambda k: deviation(xy, i, j, k)))
+        anchors.sort()
+
+        keep=set(anchors)
+        for a in range(len(anchors)):
+            i=anchors[a]
+            j=anchors[(a+1)%len(anchors)]
+            if j<=i: j+=n
+            dp(w, xy, wi, i, j, tol, uv, uvtol, whole, keep)
+        s=[w[i] for i in sorted(keep)]
+        if len(s)<3 or (area2([xy[i] for i in sorted(keep)])>0)!=(area2(xy)>0):
+            result.append(w)	# shouldn't happen
+        else:
+            result.append(s)
+    return result
+
+
+# Keep the points needed between indices i and j (mod len(w)), adding them to
+# keep
+def dp(w, xy, wi, i, j, tol, uv, uvtol, whole, keep):
+    n=len(w)
+    if j-i<2: return
+    worst=None
+    for k in range(i+1, j):
+        err=deviation(xy, i%n, j%n, k%n)/tol
+        if uv:
+            e=uvdeviation(w, xy, uv, i%n, j%n, k%n)
+            if e>uvtol: err=max(err, 1+e)
+        if worst is None or err>worst[0]: worst=(err, k)
+    if worst[0]<=1 and whole.clear(wi, i, j):
+        return	# take the shortcut
+    k=worst[1]
+    keep.add(k%n)
+    dp(w, xy, wi, i, k, tol, uv, uvtol, whole, keep)
+    dp(w, xy, wi, k, j, tol, uv, uvtol, whole, keep)
+
+
+# Index of the point furthest from point i
+def furthest(xy, i):
+    (x0,y0)=xy[i]
+    return max(range(len(xy)), key=lambda k: (xy[k][0]-x0)**2+(xy[k][1]-y0)**2)
+
+# Distance [m] of point k from the segment i-j
+def deviation(xy, i, j, k):
+    ((xi,yi),(xj,yj),(xk,yk))=(xy[i], xy[j], xy[k])
+    (dx,dy)=(xj-xi, yj-yi)
+    d2=dx*dx+dy*dy
+    t=d2 and max(0, min(1, ((xk-xi)*dx+(yk-yi)*dy)/d2))
+    return ((xk-xi-t*dx)**2+(yk-yi-t*dy)**2)**0.5
+
+# Difference between point k's UVs and those along the segment i-j
+def uvdeviation(w, xy, uv, i, j, k):
+    ((xi,yi),(xj,yj),(xk,yk))=(xy[i], xy[j], xy[k])
+    (dx,dy)=(xj-xi, yj-yi)
+    d2=dx*dx+dy*dy
+    t=d2 and max(0, min(1, ((xk-xi)*dx+(yk-yi)*dy)/d2))
+    ((ui,vi),(uj,vj),(uk,vk))=(uv(w[i]), uv(w[j]), uv(w[k]))
+    return max(abs(ui+t*(uj-ui)-uk), abs(vi+t*(vj-vi)-vk))
+
+# Twice the area of a winding of (x,y). Positive = anticlockwise
+def area2(xy):
+    n=len(xy)
+    return sum([xy[j-1][0]*xy[j][1] - xy[j][0]*xy[j-1][1] for j in range(n)])
+
+
+# The original points and edges of a polygon, to check shortcuts against
+class Whole:
+    def __init__(self, xys):
+        self.lengths=[len(xy) for xy in xys]
+        self.w=array([wi for (wi,xy) in enumerate(xys) for p in xy])
+        self.i=array([i for xy in xys for i in range(len(xy))])
+        self.p=array([p for xy in xys for p in xy], float)
+        self.q=array([xy[(i+1)%len(xy)] for xy in xys for i in range(len(xy))], float)	# end of edge from p
+        self.xys=xys
+
+    # Whether the shortcut from i to j (mod length) in winding wi crosses no
+    # other edge and encloses no other point
+    def clear(self, wi, i, j):
+        n=self.lengths[wi]
+        xy=self.xys[wi]
+        chain=[xy[k%n] for k in range(i, j+1)]
+        (a,b)=(chain[0], chain[-1])
+        offset=(self.i-i)%n	# along the chain from i, in winding wi
+        mine=(self.w==wi)
+
+        # Edges crossed by the shortcut, other than those it replaces
+        (p,q)=(self.p, self.q)
+        o1=orient(a, b, p)
+        o2=orient(a, b, q)
+        o3=orient(p, q, a)
+        o4=orient(p, q, b)
+        crosses=logical_and(o1*o2<0, o3*o4<0)
+        crosses=logical_and(crosses, logical_not(logical_and(mine, offset<j-i)))
+        if crosses.any(): return False
+
+        # Points within the area between the chain and the shortcut, other
+        # than those on the chain
+        others=logical_not(logical_and(mine, offset<=j-i))
+        xs=[c[0] for c in chain]
+        ys=[c[1] for c in chain]
+        near=logical_and(logical_and(p[:,0]>=min(xs), p[:,0]<=max(xs)), logical_and(p[:,1]>=min(ys), p[:,1]<=max(ys)))
+        near=logical_and(near, others)
+        if not near.any(): return True
+        pts=p[near]
+        inside=zeros(len(pts), bool)
+        m=len(chain)
+        for k in range(m):
+            ((x0,y0),(x1,y1))=(chain[k-1], chain[k])
+            if y0==y1: continue
+            straddle=logical_xor(pts[:,1]<y0, pts[:,1]<y1)
+            crossx=x0+(pts[:,1]-y0)*(x1-x0)/(y1-y0)
+            inside=logical_xor(inside, logical_and(straddle, crossx>pts[:,0]))
+        # Points on the shortcut itself
+        d=array(b)-array(a)
+        l2=(d*d).sum()
+        t=(pts[:,0]-a[0])*d[0]+(pts[:,1]-a[1])*d[1]
+        on=logical_and(abs(orient(a, b, pts))<=1e-6*l2**0.5, logical_and(t>0, t<l2))
+        return not logical_or(inside, on).any()
+
+
+# Twice the signed area of the triangle a, b, c, for each row of any of them
+# that are arrays of points
+def orient(a, b, c):
+    (a,b,c)=(array(a, float), array(b, float), array(c, float))
+    return (b[...,0]-a[...,0])*(c[...,1]-a[...,1]) - (b[...,1]-a[...,1])*(c[...,0]-a[...,0])
@@ -3,16 +3,10 @@ from os.path import join
 from sys import maxint
 from copy import copy
 
-from OpenGL.GL import GL_LINE_LOOP, GL_TRUE
-from OpenGL.GLU import *
-try:
-    # apparently older PyOpenGL version didn't define gluTessVertex
-    gluTessVertex
-except NameError:
-    from OpenGL import GLU
-    gluTessVertex = GLU._gluTessVertex
+from convtess import *
 
-from convutil import AptNav, Point, D, T, E
+from convsimplify import simplify
+from convutil import AptNav, Point, D, T, E, simplifyfudge
 
 twopi=pi+pi
 
@@ -359,6 +353,13 @@ def tesscombine(coords, vertex, weight, data):
     debez.append(loc)
     return loc, None, 0, 0, code
 
+# Whether a tessellated pavement point must be kept when simplifying - it or
+# its neighbours are curved or blank, or its marking differs from the last
+def pavementfixed(points, i):
+    for (loc, bez, blank, dummy, code) in [points[i-1], points[i], points[(i+1)%len(points)]]:
+        if bez or blank or dummy: return True
+    return points[i][4]!=points[i-1][4]
+
 
 # --------------------------------------------------------------------------
 
@@ -822,6 +823,10 @@ def taxilayout(allnodes, alllinks, surfaceheading, output, aptdat=None, ident="u
                     output.debug.write("Unassigned interiors!\n")
                     for points in newpoints: output.debug.write("%d %s\n" % (len(points), points[0][0]))
             
+            # Drop points in straight runs, keeping curves, blanks, and
+            # where markings change
+            outpoints=[simplify(tw, simplifyfudge, lambda p: p[0], pavementfixed) for tw in outpoints]
+
             # Finally output the polygons
             out=[]
             for tw in outpoints:
@@ -1256,6 +1261,9 @@ def apronlayout(points, surface, surfaceheading, output, aptdat=None, ident="unk
             output.debug.write("Unassigned interiors!\n")
             for points in newpoints: output.debug.write("%d %s\n" % (len(points), points[0]))
             
+    # Drop points in straight runs
+    outpoints=[simplify(tw, simplifyfudge) for tw in outpoints]
+
     # Finally output the polygons
     out=[]
     for tw in outpoints:
@@ -0,0 +1,793 @@
+#
+# Polygon tessellation with the interface of the GLU tessellator.
+#
+# Provides the parts of the GLU tessellation API that FS2XPlane uses. Each
+# polygon is collected and then tessellated either by PyOpenGL's GLU or by
+# the native tessellator below, which doesn't need an OpenGL library. The
+# native tessellator is used if PyOpenGL isn't installed or if usenative()
+# has been called.
+#
+# The native tessellator splits the contours' edges where they cross or
+# touch, finds the winding number either side of each of the resulting
+# edges, and keeps the edges that separate inside from outside under the
+# winding rule. These are linked into loops - exterior loops anticlockwise
+# and holes clockwise about the normal, as GLU's. Without
+# GLU_TESS_BOUNDARY_ONLY the loops are then triangulated by ear clipping.
+#
+
+from copy import copy, deepcopy
+from math import atan2, pi
+from os import environ
+from numpy import abs as npabs, arange, array, empty, float64, logical_not, maximum, minimum, where
+
+try:
+    from OpenGL import GLU
+    from OpenGL.GLU import GLUerror
+    try:
+        # apparently older PyOpenGL version didn't define gluTessVertex
+        GLU.gluTessVertex
+        _gluTessVertex=GLU.gluTessVertex
+    except AttributeError:
+        _gluTessVertex=GLU._gluTessVertex
+except ImportError:
+    GLU=None
+    class GLUerror(Exception): pass
+
+__all__=['GLUerror', 'GL_LINE_LOOP', 'GL_TRIANGLES', 'GL_TRUE', 'GL_FALSE',
+         'GLU_TESS_BEGIN', 'GLU_TESS_VERTEX', 'GLU_TESS_END', 'GLU_TESS_ERROR', 'GLU_TESS_EDGE_FLAG', 'GLU_TESS_COMBINE',
+         'GLU_TESS_BEGIN_DATA', 'GLU_TESS_VERTEX_DATA', 'GLU_TESS_END_DATA', 'GLU_TESS_ERROR_DATA', 'GLU_TESS_EDGE_FLAG_DATA', 'GLU_TESS_COMBINE_DATA',
+         'GLU_TESS_WINDING_RULE', 'GLU_TESS_BOUNDARY_ONLY', 'GLU_TESS_TOLERANCE', 'GLU_TESS_NEED_COMBINE_CALLBACK',
+         'GLU_TESS_WINDING_ODD', 'GLU_TESS_WINDING_NONZERO', 'GLU_TESS_WINDING_POSITIVE', 'GLU_TESS_WINDING_NEGATIVE', 'GLU_TESS_WINDING_ABS_GEQ_TWO',
+         'gluNewTess', 'gluDeleteTess', 'gluTessNormal', 'gluTessProperty', 'gluTessCallback',
+         'gluTessBeginPolygon', 'gluTessBeginContour', 'gluTessVertex', 'gluTessEndContour', 'gluTessEndPolygon']
+
+# OpenGL values
+GL_FALSE=0
+GL_TRUE=1
+GL_LINE_LOOP=2
+GL_TRIANGLES=4
+GLU_TESS_BEGIN=100100
+GLU_TESS_VERTEX=100101
+GLU_TESS_END=100102
+GLU_TESS_ERROR=100103
+GLU_TESS_EDGE_FLAG=100104
+GLU_TESS_COMBINE=100105
+GLU_TESS_BEGIN_DATA=100106	# _DATA callbacks are the above +6
+GLU_TESS_VERTEX_DATA=100107
+GLU_TESS_END_DATA=100108
+GLU_TESS_ERROR_DATA=100109
+GLU_TESS_EDGE_FLAG_DATA=100110
+GLU_TESS_COMBINE_DATA=100111
+GLU_TESS_WINDING_ODD=100130
+GLU_TESS_WINDING_NONZERO=100131
+GLU_TESS_WINDING_POSITIVE=100132
+GLU_TESS_WINDING_NEGATIVE=100133
+GLU_TESS_WINDING_ABS_GEQ_TWO=100134
+GLU_TESS_WINDING_RULE=100140
+GLU_TESS_BOUNDARY_ONLY=100141
+GLU_TESS_TOLERANCE=100142
+GLU_TESS_NEED_COMBINE_CALLBACK=100156
+
+native=(GLU is None or environ.get('FS2XP_TESS')=='native')	# use the native tessellator?
+trace=None	# list to record each polygon in, as a Tess - see benchtess.py
+
+
+# Use the native tessellator, here and in worker processes started later
+def usenative(flag=True):
+    global native
+    native=flag or GLU is None
+    if flag:
+        environ['FS2XP_TESS']='native'
+    elif 'FS2XP_TESS' in environ:
+        del environ['FS2XP_TESS']
+
+
+# Error that GLU would report to the error callback
+class TessError(Exception): pass
+
+
+# A polygon being collected
+class Tess:
+    def __init__(self):
+        self.normal=(0,0,0)	# 0 = compute from the contours
+        self.rule=GLU_TESS_WINDING_ODD
+        self.boundary=False
+        self.callbacks={}
+        self.data=None
+        self.contours=[]	# [([x,y,z], vertex data)]
+        self.template=None	# copy of data at gluTessBeginPolygon, if tracing
+
+    # Call back with polygon data if a _DATA callback was given.
+    # Returns the callback's result, or None if there's no callback.
+    def call(self, which, *args):
+        if which+6 in self.callbacks:
+            return self.callbacks[which+6](*(args+(self.data,)))
+        elif which in self.callbacks:
+            return self.callbacks[which](*args)
+        return None
+
+
+def gluNewTess():
+    return Tess()
+
+def gluDeleteTess(tess):
+    pass
+
+def gluTessNormal(tess, x, y, z):
+    tess.normal=(x,y,z)
+
+def gluTessProperty(tess, which, value):
+    if which==GLU_TESS_WINDING_RULE:
+        tess.rule=value
+    elif which==GLU_TESS_BOUNDARY_ONLY:
+        tess.boundary=bool(value)
+
+def gluTessCallback(tess, which, fn):
+    tess.callbacks[which]=fn
+
+def gluTessBeginPolygon(tess, data):
+    tess.data=data
+    tess.contours=[]
+    if trace is not None: tess.template=deepcopy(data)
+
+def gluTessBeginContour(tess):
+    tess.contours.append([])
+
+def gluTessVertex(tess, coords, data):
+    tess.contours[-1].append(([float(coords[0]), float(coords[1]), float(coords[2])], data))
+
+def gluTessEndContour(tess):
+    pass
+
+def gluTessEndPolygon(tess):
+    if trace is not None: trace.append(copy(tess))
+    if native:
+        nativetess(tess)
+    else:
+        glutess(tess)
+
+
+# Tessellate the polygon collected in tess with PyOpenGL's GLU
+def glutess(tess):
+    tessObj=GLU.gluNewTess()
+    try:
+        GLU.gluTessNormal(tessObj, *tess.normal)
+        GLU.gluTessProperty(tessObj, GLU_TESS_WINDING_RULE, tess.rule)
+        GLU.gluTessProperty(tessObj, GLU_TESS_BOUNDARY_ONLY, tess.boundary and GL_TRUE or GL_FALSE)
+        for (which, fn) in tess.callbacks.iteritems():
+            GLU.gluTessCallback(tessObj, which, fn)
+        GLU.gluTessBeginPolygon(tessObj, tess.data)
+        for contour in tess.contours:
+            GLU.gluTessBeginContour(tessObj)
+            for (coords, data) in contour:
+                _gluTessVertex(tessObj, coords, data)
+            GLU.gluTessEndContour(tessObj)
+        GLU.gluTessEndPolygon(tessObj)
+    finally:
+        GLU.gluDeleteTess(tessObj)
+
+
+# Tessellate the polygon collected in tess natively, calling back as GLU does
+def nativetess(tess):
+    # Project onto the plane as GLU does. (s,t) is anticlockwise about the normal.
+    normal=tess.normal
+    computed=(normal==(0,0,0))
+    if computed:
+        normal=computenormal(tess.contours)
+    i=0
+    if abs(normal[1])>abs(normal[0]): i=1
+    if abs(normal[2])>abs(normal[i]): i=2
+    si=(i+1)%3
+    ti=(i+2)%3
+    tsign=normal[i]>0 and 1 or -1
+
+    # Points, merging any vertices that coincide
+    coords=[]	# [x,y,z] by point
+    datas=[]	# vertex data by point
+    st=[]	# (s,t) by point
+    index={}	# point by (s,t)
+    contours=[]	# [point]
+    for contour in tess.contours:
+        points=[]
+        for (xyz, data) in contour:
+            key=(xyz[si], tsign*xyz[ti])
+            p=index.get(key)
+            if p is None:
+                p=index[key]=len(st)
+                st.append(key)
+                coords.append(xyz)
+                datas.append(data)
+            else:
+                merged=tess.call(GLU_TESS_COMBINE, coords[p], [datas[p], data, None, None], [0.5, 0.5, 0.0, 0.0])
+                if merged is not None: datas[p]=merged
+            points.append(p)
+        contours.append(points)
+    if computed and sum([area(st, points) for points in contours])<0:
+        # GLU makes the contours anticlockwise overall
+        st=[(s,-t) for (s,t) in st]
+        index=dict([(st[p],p) for p in range(len(st))])
+
+    edges=[]	# (from, to)
+    for points in contours:
+        n=len(points)
+        for j in range(n):
+            if points[j]!=points[(j+1)%n]:
+                edges.append((points[j], points[(j+1)%n]))
+    if not edges: return
+
+    try:
+        segs=splitedges(tess, edges, st, coords, datas, index)
+    except TessError, e:
+        tess.call(GLU_TESS_ERROR, e.args[0])	# and no output, as GLU
+        return
+    loops=boundary(tess.rule, segs, st)
+    if tess.boundary:
+        for loop in loops:
+            tess.call(GLU_TESS_BEGIN, GL_LINE_LOOP)
+            for p in loop:
+                tess.call(GLU_TESS_VERTEX, datas[p])
+            tess.call(GLU_TESS_END)
+    else:
+        tris=[]
+        for poly in polygons(loops, st):
+            tris.extend(earclip(bridge(poly, st), st))
+        if not tris: return
+        edgeset=set([(loop[j-1], loop[j]) for loop in loops for j in range(len(loop))])
+        tess.call(GLU_TESS_BEGIN, GL_TRIANGLES)
+        flag=None
+        for tri in tris:
+            for j in range(3):
+                if GLU_TESS_EDGE_FLAG in tess.callbacks or GLU_TESS_EDGE_FLAG_DATA in tess.callbacks:
+                    edge=(tri[j], tri[(j+1)%3]) in edgeset
+                    if edge!=flag:
+                        tess.call(GLU_TESS_EDGE_FLAG, edge)
+                        flag=edge
+                tess.call(GLU_TESS_VERTEX, datas[tri[j]])
+        tess.call(GLU_TESS_END)
+
+
+# Normal as GLU computes it - from the points furthest apart along the
+# longest axis and the point furthest from the line between them
+def computenormal(contours):
+    points=[xyz for contour in contours for (xyz, data) in contour]
+    lo=[min(points, key=lambda v: v[j]) for j in range(3)]
+    hi=[max(points, key=lambda v: v[j]) for j in range(3)]
+    i=max(range(3), key=lambda j: hi[j][j]-lo[j][j])
+    if lo[i][i]>=hi[i][i]: return (0,0,1)
+    (v1,v2)=(lo[i],hi[i])
+    d1=[v1[j]-v2[j] for j in range(3)]
+    best=0
+    normal=None
+    for v in points:
+        d2=[v[j]-v2[j] for j in range(3)]
+        n=(d1[1]*d2[2]-d1[2]*d2[1], d1[2]*d2[0]-d1[0]*d2[2], d1[0]*d2[1]-d1[1]*d2[0])
+        l=n[0]*n[0]+n[1]*n[1]+n[2]*n[2]
+        if l>best: (best,normal)=(l,n)
+    if normal is None:
+        # all on a line
+        normal=[0,0,0]
+        normal[max(range(3), key=lambda j: abs(d1[j]))]=1
+    return normal
+
+
+# Twice the signed area of a loop of points. Positive = anticlockwise
+def area(st, loop):
+    a=0
+    n=len(loop)
+    for j in range(n):
+        (s0,t0)=st[loop[j]]
+        (s1,t1)=st[loop[(j+1)%n]]
+        a+=s0*t1-s1*t0
+    return a
+
+
+# Split edges where they cross or where a point lies on them. Crossings
+# become new points, whose data comes from the combine callback as in GLU.
+# Returns [(from, to, count)], combining edges that are the same.
+def splitedges(tess, edges, st, coords, datas, index):
+    P=array(st, float64)
+    tol=1e-10*max((P.max(0)-P.min(0)).max(), 1e-300)+4e-16*npabs(P).max()	# distance regarded as zero
+
+    # Merge points that are within rounding of each other
+    cell=4*tol
+    grid={}	# points by cell
+    merge={}
+    for p in range(len(st)):
+        (s,t)=st[p]
+        (gs, gt)=(int(s//cell), int(t//cell))
+        for q in [q for ds in (-1,0,1) for dt in (-1,0,1) for q in grid.get((gs+ds, gt+dt), [])]:
+            if abs(st[q][0]-s)<=tol and abs(st[q][1]-t)<=tol:
+                merge[p]=q
+                merged=tess.call(GLU_TESS_COMBINE, coords[q], [datas[q], datas[p], None, None], [0.5, 0.5, 0.0, 0.0])
+                if merged is not None: datas[q]=merged
+                break
+        else:
+            grid.setdefault((gs, gt), []).append(p)
+    if merge:
+        edges=[(merge.get(u,u), merge.get(v,v)) for (u,v) in edges]
+        edges=[(u,v) for (u,v) in edges if u!=v]
+        if not edges: return []
+
+    A=array([e[0] for e in edges])
+    B=array([e[1] for e in edges])
+    n=len(edges)
+    S0=P[A]
+    S1=P[B]
+    D=S1-S0
+    lens=(D[:,0]*D[:,0]+D[:,1]*D[:,1])**0.5
+    lo=minimum(S0, S1)
+    hi=maximum(S0, S1)
+
+    splits=[[] for e in edges]	# [(parameter, point)] by edge
+    (Al, Bl)=(A.tolist(), B.tolist())
+    block=max(1, 250000/n)
+    for i0 in range(0, n, block):
+        i1=min(n, i0+block)
+        I=arange(i0, i1)[:,None]
+        J=arange(n)[None,:]
+        # Candidate pairs - later edge, overlapping bounding boxes
+        cand=(J>I) & (lo[None,:,0]<=hi[i0:i1,None,0]+tol) & (lo[i0:i1,None,0]<=hi[None,:,0]+tol) & \
+              (lo[None,:,1]<=hi[i0:i1,None,1]+tol) & (lo[i0:i1,None,1]<=hi[None,:,1]+tol)
+        (ii, jj)=cand.nonzero()
+        if not len(ii): continue
+        ii+=i0
+        # Sides of each edge that the other's end points are on
+        di=D[ii]
+        dj=D[jj]
+        o1=cross(di, S0[jj]-S0[ii])
+        o2=cross(di, S1[jj]-S0[ii])
+        o3=cross(dj, S0[ii]-S0[jj])
+        o4=cross(dj, S1[ii]-S0[jj])
+        z1=npabs(o1)<=tol*lens[ii]
+        z2=npabs(o2)<=tol*lens[ii]
+        z3=npabs(o3)<=tol*lens[jj]
+        z4=npabs(o4)<=tol*lens[jj]
+
+        # Points lying on the other edge
+        for (z, e, f, Q) in [(z1, ii, jj, S0), (z2, ii, jj, S1), (z3, jj, ii, S0), (z4, jj, ii, S1)]:
+            k=z.nonzero()[0]
+            if not len(k): continue
+            (e, f)=(e[k], f[k])
+            u=dot(Q[f]-S0[e], D[e])/(lens[e]*lens[e])
+            margin=tol/lens[e]
+            ok=(u>margin) & (u<1-margin)
+            if Q is S0:
+                pts=A[f]
+            else:
+                pts=B[f]
+            for (edge, param, p) in zip(e[ok].tolist(), u[ok].tolist(), pts[ok].tolist()):
+                splits[edge].append((param, p))
+
+        # Crossings
+        k=(logical_not(z1|z2|z3|z4) & ((o1<0)!=(o2<0)) & ((o3<0)!=(o4<0))).nonzero()[0]
+        if not len(k): continue
+        for (e, f) in zip(ii[k].tolist(), jj[k].tolist()):
+            ends=[Al[e], Bl[e], Al[f], Bl[f]]
+            key=meet(st, *ends)
+            p=index.get(key)
+            if p is None:
+                # Where several edges cross at a point, or near an existing
+                # point, use the same point
+                (gs, gt)=(int(key[0]//cell), int(key[1]//cell))
+                for q in ends+[q for ds in (-1,0,1) for dt in (-1,0,1) for q in grid.get((gs+ds, gt+dt), [])]:
+                    if abs(st[q][0]-key[0])<=tol and abs(st[q][1]-key[1])<=tol:
+                        p=index[key]=q
+                        break
+                else:
+                    p=index[key]=crossing(tess, key, ends, st, coords, datas)
+                    grid.setdefault((gs, gt), []).append(p)
+            for g in [e,f]:
+                (s0,t0)=st[Al[g]]
+                (s1,t1)=st[Bl[g]]
+                splits[g].append((((key[0]-s0)*(s1-s0)+(key[1]-t0)*(t1-t0))/((s1-s0)*(s1-s0)+(t1-t0)*(t1-t0)), p))
+
+    segs={}	# count by (lower point, higher point)
+    for e in range(n):
+        if splits[e]:
+            points=[Al[e]]+[p for (param, p) in sorted(splits[e])]+[Bl[e]]
+        else:
+            points=[Al[e], Bl[e]]
+        for j in range(len(points)-1):
+            (u,v)=(points[j], points[j+1])
+            if u<v:
+                segs[(u,v)]=segs.get((u,v),0)+1
+            elif u>v:
+                segs[(v,u)]=segs.get((v,u),0)-1
+    return [(u, v, c) for ((u, v), c) in sorted(segs.items()) if c]
+
+
+# Where the lines through points a-b and c-d meet - the same whichever way
+# round they're given, so that coincident edges are split at the same point
+def meet(st, a, b, c, d):
+    if a>b: (a,b)=(b,a)
+    if c>d: (c,d)=(d,c)
+    if (c,d)<(a,b): (a,b,c,d)=(c,d,a,b)
+    ((sa,ta),(sb,tb),(sc,tc),(sd,td))=(st[a],st[b],st[c],st[d])
+    u=((sc-sa)*(td-tc)-(tc-ta)*(sd-sc))/((sb-sa)*(td-tc)-(tb-ta)*(sd-sc))
+    return (sa+u*(sb-sa), ta+u*(tb-ta))
+
+
+# New point where two edges cross. Returns its index.
+def crossing(tess, key, ends, st, coords, datas):
+    (s,t)=key
+    weights=[]
+    for j in [0,2]:
+        d0=abs(st[ends[j]][0]-s)+abs(st[ends[j]][1]-t)
+        d1=abs(st[ends[j+1]][0]-s)+abs(st[ends[j+1]][1]-t)
+        if d0+d1:
+            weights.extend([0.5*d1/(d0+d1), 0.5*d0/(d0+d1)])
+        else:
+            weights.extend([0.25, 0.25])
+    xyz=[sum([weights[j]*coords[ends[j]][k] for j in range(4)]) for k in range(3)]
+    data=tess.call(GLU_TESS_COMBINE, xyz, [datas[p] for p in ends], weights)
+    if data is None: raise TessError(GLU_TESS_NEED_COMBINE_CALLBACK)
+    st.append(key)
+    coords.append(xyz)
+    datas.append(data)
+    return len(st)-1
+
+
+def cross(a, b):
+    return a[:,0]*b[:,1]-a[:,1]*b[:,0]
+
+def dot(a, b):
+    return a[:,0]*b[:,0]+a[:,1]*b[:,1]
+
+
+# Edges that separate inside from outside under the winding rule, linked
+# into loops with the inside on the left. Returns [[point]]
+def boundary(rule, segs, st):
+    if not segs: return []
+    P=array(st, float64)
+    U=array([s[0] for s in segs])
+    V=array([s[1] for s in segs])
+    C=array([s[2] for s in segs])
+    n=len(segs)
+    P0=P[U]
+    P1=P[V]
+    M=(P0+P1)*0.5
+    horiz=(npabs(P1[:,1]-P0[:,1])<npabs(P1[:,0]-P0[:,0]))	# nearer parallel to s than to t
+
+    # Winding number just to the +s side of each edge, or the +t side for
+    # edges nearer parallel to s, counting crossings of a ray in that
+    # direction. The ray must cross the edge's line steeply, or rounding of
+    # the midpoint can put its start on the wrong side of the edge.
+    wind=empty(n, int)
+    block=max(1, 250000/n)
+    for i0 in range(0, n, block):
+        i1=min(n, i0+block)
+        (ms, mt)=(M[i0:i1,0:1], M[i0:i1,1:2])
+        (s0, t0, s1, t1)=(P0[None,:,0], P0[None,:,1], P1[None,:,0], P1[None,:,1])
+        notself=(arange(i0, i1)[:,None]!=arange(n)[None,:])
+        up=(t0<=mt) & (mt<t1)
+        down=(t1<=mt) & (mt<t0)
+        dt=where(t1==t0, 1, t1-t0)
+        right=(s0+(mt-t0)*(s1-s0)/dt)>ms
+        ws=(((up & right & notself)*C).sum(1)-((down & right & notself)*C).sum(1))
+        left=(s1<=ms) & (ms<s0)
+        rightw=(s0<=ms) & (ms<s1)
+        ds=where(s1==s0, 1, s1-s0)
+        above=(t0+(ms-s0)*(t1-t0)/ds)>mt
+        wt=(((left & above & notself)*C).sum(1)-((rightw & above & notself)*C).sum(1))
+        wind[i0:i1]=where(horiz[i0:i1], wt, ws)
+
+    # Winding numbers to the left and right of each edge. The +t side is on
+    # the left of edges nearer parallel to s that go +s, and the +s side is
+    # on the left of other edges that go -t.
+    plusleft=where(horiz, P1[:,0]>P0[:,0], P1[:,1]<P0[:,1])
+    wleft=where(plusleft, wind, wind+C)
+    wright=wleft-C
+    inleft=inside(rule, wleft)
+    inright=inside(rule, wright)
+
+    out={}	# [(angle, to)] by from
+    edges=[]
+    (Ul, Vl, inl)=(U.tolist(), V.tolist(), inleft.tolist())
+    for k in (inleft!=inright).nonzero()[0].tolist():
+        if inl[k]:
+            (u,v)=(Ul[k],Vl[k])
+        else:
+            (u,v)=(Vl[k],Ul[k])
+        edges.append((u,v))
+        out.setdefault(u,[]).append((atan2(st[v][1]-st[u][1], st[v][0]-st[u][0]), v))
+
+    # Link, taking the first edge clockwise from the way we came in, so
+    # regions that only touch at a point come out separately
+    used=set()
+    loops=[]
+    for (u0,v0) in edges:
+        if (u0,v0) in used: continue
+        loop=[u0]
+        used.add((u0,v0))
+        (u,v)=(u0,v0)
+        while v!=u0 or len(loop)<2:
+            back=atan2(st[u][1]-st[v][1], st[u][0]-st[v][0])
+            best=None
+            for (angle, w) in out.get(v, []):
+                if (v,w) in used and w!=u0: continue
+                turn=(back-angle)%(2*pi)
+                if turn>0 and (best is None or turn<best[0]): best=(turn, w)
+            if best is None: break	# shouldn't happen
+            loop.append(v)
+            (u,v)=(v,best[1])
+            if (u,v) in used: break
+            used.add((u,v))
+        if len(loop)>=3: loops.append(loop)
+    return loops
+
+
+# Whether winding numbers are inside the polygon under the winding rule
+def inside(rule, w):
+    if rule==GLU_TESS_WINDING_ODD:
+        return (w&1)==1
+    elif rule==GLU_TESS_WINDING_NONZERO:
+        return w!=0
+    elif rule==GLU_TESS_WINDING_POSITIVE:
+        return w>0
+    elif rule==GLU_TESS_WINDING_NEGATIVE:
+        return w<0
+    elif rule==GLU_TESS_WINDING_ABS_GEQ_TWO:
+        return npabs(w)>=2
+    raise GLUerror('Invalid winding rule')
+
+
+# Group loops into polygons [exterior, hole, ...]. Each hole goes with the
+# smallest exterior that contains it.
+def polygons(loops, st):
+    exteriors=[]
+    holes=[]
+    for loop in [l for loop in loops for l in simple(loop)]:
+        a=area(st, loop)
+        if a>0:
+            exteriors.append((a, [loop]))
+        elif a<0:
+            holes.append(loop)
+    exteriors.sort()
+    for hole in holes:
+        (s0,t0)=st[hole[0]]
+        (s1,t1)=st[hole[1]]
+        (s,t)=((s0+s1)*0.5, (t0+t1)*0.5)
+        for (a, poly) in exteriors:
+            if contains(poly[0], st, s, t):
+                poly.append(hole)
+                break
+    return [poly for (a, poly) in exteriors]
+
+
+# Split a loop where it touches itself. A loop can pass through a point
+# more than once where a region touches another region's hole, and the
+# parts needn't go in the same polygon.
+def simple(loop):
+    loops=[]
+    stack=[]
+    seen={}	# position in stack by point
+    for p in loop:
+        if p in seen:
+            i=seen[p]
+            loops.append(stack[i:])
+            for q in stack[i+1:]: del seen[q]
+            del stack[i+1:]
+        else:
+            seen[p]=len(stack)
+            stack.append(p)
+    loops.append(stack)
+    return [l for l in loops if len(l)>=3]
+
+
+# Whether (s,t) is inside a loop, by crossings
+def contains(loop, st, s, t):
+    c=False
+    n=len(loop)
+    for j in range(n):
+        (s0,t0)=st[loop[j-1]]
+        (s1,t1)=st[loop[j]]
+        if (t0<=t)!=(t1<=t) and s0+(t-t0)*(s1-s0)/(t1-t0)>s:
+            c=not c
+    return c
+
+
+# Join any holes into the exterior with zero-width bridges, giving a single
+# loop for earclip
+def bridge(poly, st):
+    loop=list(poly[0])
+    for hole in sorted(poly[1:], key=lambda h: -max([st[p][0] for p in h])):
+        # Join the hole's rightmost point to the nearest point that it can
+        # see, or splice it in where it touches
+        j=max(range(len(hole)), key=lambda j: st[hole[j]][0])
+        h=hole[j]
+        edges=[(loop[k-1], loop[k]) for k in range(len(loop))]+[(hole[k-1], hole[k]) for k in range(len(hole))]
+        best=None
+        for k in sorted(range(len(loop)), key=lambda k: (st[loop[k]][0]-st[h][0])**2+(st[loop[k]][1]-st[h][1])**2):
+            p=loop[k]
+            if p==h:
+                to=hole[(j+1)%len(hole)]
+            elif st[p][0]<st[h][0]:
+                continue
+            else:
+                to=None
+                for (a,b) in edges:
+                    if h not in (a,b) and p not in (a,b) and crosses(st[h], st[p], st[a], st[b]): break
+                else:
+                    to=h
+                if to is None: continue
+            # Where the loop passes through p more than once, join at the pass facing the hole
+            out=atan2(st[loop[(k+1)%len(loop)]][1]-st[p][1], st[loop[(k+1)%len(loop)]][0]-st[p][0])
+            back=atan2(st[loop[k-1]][1]-st[p][1], st[loop[k-1]][0]-st[p][0])
+            to=atan2(st[to][1]-st[p][1], st[to][0]-st[p][0])
+            if (to-out)%(2*pi)<(back-out)%(2*pi):
+                best=k
+                break
+        if best is None:
+            raise GLUerror("Can't join hole")
+        if loop[best]==h:
+            loop[best+1:best+1]=hole[j+1:]+hole[:j]+[h]
+        else:
+            loop[best+1:best+1]=hole[j:]+hole[:j]+[h, loop[best]]
+    return loop
+
+
+# Whether segments p0-p1 and q0-q1 cross or touch
+def crosses(p0, p1, q0, q1):
+    d1=(p1[0]-p0[0])*(q0[1]-p0[1])-(p1[1]-p0[1])*(q0[0]-p0[0])
+    d2=(p1[0]-p0[0])*(q1[1]-p0[1])-(p1[1]-p0[1])*(q1[0]-p0[0])
+    d3=(q1[0]-q0[0])*(p0[1]-q0[1])-(q1[1]-q0[1])*(p0[0]-q0[0])
+    d4=(q1[0]-q0[0])*(p1[1]-q0[1])-(q1[1]-q0[1])*(p1[0]-q0[0])
+    if d1*d2>0 or d3*d4>0: return False
+    if d1==0 and d2==0:
+        # collinear - touch if they overlap
+        return min(p0[0],p1[0])<=max(q0[0],q1[0]) and min(q0[0],q1[0])<=max(p0[0],p1[0]) and min(p0[1],p1[1])<=max(q0[1],q1[1]) and min(q0[1],q1[1])<=max(p0[1],p1[1])
+    return True
+
+
+# Triangulate an anticlockwise loop of points. Returns [(a,b,c)] anticlockwise
+def earclip(loop, st):
+    return Ring(loop, st).clip()
+
+
+# A loop being ear clipped. It's linked by position in the loop since a
+# point can appear more than once where a hole is joined on. Only points
+# that aren't convex can lie in an ear, so just those are kept in a grid
+# for the ear test, and clipping carries on round the loop from each ear
+# rather than starting again.
+class Ring:
+    def __init__(self, loop, st):
+        n=len(loop)
+        self.loop=list(loop)
+        self.st=st
+        self.prv=range(-1, n-1)	# previous position by position. None once clipped
+        self.prv[0]=n-1
+        self.nxt=range(1, n+1)	# next position by position. None once clipped
+        self.nxt[-1]=0
+        self.n=n	# positions left
+        ss=[st[p][0] for p in loop]
+        ts=[st[p][1] for p in loop]
+        self.tol=1e-12*(max(ss)-min(ss)+max(ts)-min(ts))**2	# points this near a side count as on it
+        self.uses={}	# number of positions by point
+        for p in loop: self.uses[p]=self.uses.get(p,0)+1
+        self.pinches=len([p for p in self.uses if self.uses[p]>1])	# points that the loop passes through more than once
+        (self.s0, self.t0)=(min(ss), min(ts))
+        self.cell=max(max(ss)-min(ss), max(ts)-min(ts))/int(n**0.5) or 1.0
+        self.size=int(max(max(ss)-min(ss), max(ts)-min(ts))/self.cell)	# last cell
+        self.grid={}	# set of positions that could lie in an ear by cell
+        self.cells={}	# cell by position, for positions in the grid
+        for k in range(n): self.index(k)
+
+    def clip(self):
+        tris=[]
+        spikes=range(self.n)	# positions to check for spikes
+        k=0
+        while self.n>3:
+            # Spike back along the same edge, left where a hole joins
+            while spikes:
+                j=spikes.pop()
+                if self.nxt[j] is not None and self.loop[self.prv[j]]==self.loop[self.nxt[j]]: break
+            else:
+                j=None
+            if j is not None:
+                k=self.prv[j]
+                self.remove(self.nxt[j])
+                self.remove(j)
+                self.index(k)
+                self.index(self.nxt[k])
+                spikes.extend([k, self.nxt[k]])
+                continue
+
+            # Where the loop touches itself prefer ears whose diagonal is inside
+            j=None
+            if self.pinches: j=self.findear(k, True)
+            if j is None: j=self.findear(k, False)
+            if j is not None:
+                tris.append((self.loop[self.prv[j]], self.loop[j], self.loop[self.nxt[j]]))
+                k=self.nxt[j]
+                self.remove(j)
+                self.index(k)
+                self.index(self.prv[k])
+                spikes.extend([k, self.prv[k]])
+                continue
+
+            # No ears - drop a degenerate point, or give up
+            for i in range(self.n):
+                if abs(self.turn(k))<=self.tol: break
+                k=self.nxt[k]
+            else:
+                raise GLUerror("Can't triangulate")
+            j=k
+            k=self.nxt[j]
+            self.remove(j)
+            self.index(k)
+            self.index(self.prv[k])
+            spikes.extend([k, self.prv[k]])
+        if self.n==3 and self.turn(k)>0:
+            tris.append((self.loop[self.prv[k]], self.loop[k], self.loop[self.nxt[k]]))
+        return tris
+
+    # Twice the area of the triangle made by the position k and its
+    # neighbours. Positive = convex
+    def turn(self, k):
+        st=self.st
+        ((sa,ta),(sb,tb),(sc,tc))=(st[self.loop[self.prv[k]]], st[self.loop[k]], st[self.loop[self.nxt[k]]])
+        return (sb-sa)*(tc-ta)-(tb-ta)*(sc-sa)
+
+    # Add the position k to the grid or take it out, as it's convex or not
+    def index(self, k):
+        if self.turn(k)<=self.tol or self.uses[self.loop[k]]>1:
+            if k in self.cells: return
+            (s,t)=self.st[self.loop[k]]
+            cell=(int((s-self.s0)/self.cell), int((t-self.t0)/self.cell))
+            self.cells[k]=cell
+            self.grid.setdefault(cell, set()).add(k)
+        elif k in self.cells:
+            self.grid[self.cells.pop(k)].discard(k)
+
+    def remove(self, k):
+        (prv, nxt)=(self.prv[k], self.nxt[k])
+        self.nxt[prv]=nxt
+        self.prv[nxt]=prv
+        self.prv[k]=self.nxt[k]=None
+        self.n-=1
+        p=self.loop[k]
+        self.uses[p]-=1
+        if self.uses[p]==1: self.pinches-=1
+        if k in self.cells: self.grid[self.cells.pop(k)].discard(k)
+
+    # Position of an ear, going round from position k, or None
+    def findear(self, k, pinched):
+        for i in range(self.n):
+            if self.isear(k, pinched): return k
+            k=self.nxt[k]
+        return None
+
+    def isear(self, k, pinched):
+        st=self.st
+        (a,b,c)=(self.loop[self.prv[k]], self.loop[k], self.loop[self.nxt[k]])
+        ((sa,ta),(sb,tb),(sc,tc))=(st[a],st[b],st[c])
+        if (sb-sa)*(tc-ta)-(tb-ta)*(sc-sa)<=0: return False	# reflex
+        # Points within tol of a side can be this far outside the bounds
+        margin=self.tol/min([((s1-s0)**2+(t1-t0)**2)**0.5 for ((s0,t0),(s1,t1)) in [((sa,ta),(sb,tb)), ((sb,tb),(sc,tc)), ((sc,tc),(sa,ta))]])
+        (lo, hi)=[max(0, min(self.size, int((v-self.s0)/self.cell))) for v in (min(sa,sb,sc)-margin, max(sa,sb,sc)+margin)]
+        (lot, hit)=[max(0, min(self.size, int((v-self.t0)/self.cell))) for v in (min(ta,tb,tc)-margin, max(ta,tb,tc)+margin)]
+        for gs in range(lo, hi+1):
+            for gt in range(lot, hit+1):
+                for q in self.grid.get((gs, gt), ()):
+                    p=self.loop[q]
+                    if p in (a,b,c): continue
+                    (s,t)=st[p]
+                    if (sb-sa)*(t-ta)-(tb-ta)*(s-sa)>=-self.tol and (sc-sb)*(t-tb)-(tc-tb)*(s-sb)>=-self.tol and (sa-sc)*(t-tc)-(ta-tc)*(s-sc)>=-self.tol:
+                        return False	# not an ear
+        # An empty ear's diagonal can only be outside where the loop passes
+        # through one of its points more than once
+        if not pinched or self.uses[a]==self.uses[b]==self.uses[c]==1: return True
+        loop=self.points(k)
+        if not contains(loop, st, (sa+sc)*0.5, (ta+tc)*0.5): return False
+        for j in range(len(loop)):
+            (p,q)=(loop[j-1], loop[j])
+            if a not in (p,q) and c not in (p,q) and crosses(st[a], st[c], st[p], st[q]): return False
+        return True
+
+    # The points left, going round from position k
+    def points(self, k):
+        loop=[]
+        for i in range(self.n):
+            loop.append(self.loop[k])
+            k=self.nxt[k]
+        return loop
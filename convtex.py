@@ -0,0 +1,405 @@
+#
+# Convert MSFS BMP & DDS textures to PNG & DDS in-process.
+#
+# Does the same job as the bmp2png and bmp2dds helpers:
+#  - BMP (8, 16, 24 & 32bit) & DDS -> PNG, with an optional transparent
+#    palette index as per "bmp2png -xbrqp<n>".
+#  - DXTn DDS & FS2004 DXTn BMP -> X-Plane DDS (ie flipped) with mipmaps,
+#    as per "bmp2dds". Missing mipmaps are generated.
+# Anything else raises Unsupported, so that the caller can fall back to
+# the helpers.
+#
+
+from struct import pack, unpack_from
+from zlib import compress, crc32
+
+from numpy import arange, clip, einsum, empty, fromstring, hstack, sqrt, uint8, uint32, uint64, where, zeros
+
+
+class Unsupported(Exception):
+    pass
+
+
+blocksizes={'DXT1':8, 'DXT3':16, 'DXT5':16}
+
+
+class Texture:
+
+    # data is the texture file's contents. palno is 1-based, 0=None
+    def __init__(self, data, palno=0):
+        self.rgba=None		# height x width x RGBA, top row first
+        self.index=None		# height x width palette indices
+        self.palette=None	# n x RGBA
+        self.fourcc=None	# DXTn
+        self.levels=[]		# DXTn blocks for each mipmap level, top row first
+        if data[:2]=='BM':
+            self.readbmp(data)
+        elif data[:4]=='DDS ':
+            self.readdds(data)
+        else:
+            raise Unsupported('Unrecognised file type')
+        if palno and self.palette is not None and palno<=len(self.palette):
+            self.palette[palno-1,3]=0
+
+    def readbmp(self, data):
+        (off,hdrsize)=unpack_from('<II', data, 10)
+        if hdrsize==12:		# OS/2
+            (width, height, planes, bpp)=unpack_from('<HHHH', data, 18)
+            compression=0
+            nclr=0
+            palsize=3
+        else:
+            (width, height, planes, bpp, compression, size, xppm, yppm, nclr)=unpack_from('<iiHHIIiiI', data, 18)
+            palsize=4
+        topdown=height<0
+        height=abs(height)
+        self.width=width
+        self.height=height
+
+        if compression in [0x31545844, 0x33545844, 0x35545844]:
+            # FS2004 DXTn BMP
+            self.fourcc=data[30:34]
+            self.readlevels(data, off, 1)
+            return
+        elif compression==3:	# BI_BITFIELDS
+            if hdrsize>=56:
+                masks=unpack_from('<4I', data, 54)
+            else:
+                masks=unpack_from('<3I', data, 54)+(0,)
+        elif compression!=0:
+            raise Unsupported('BMP compression %d' % compression)
+        elif bpp==16:
+            masks=(0x7c00, 0x3e0, 0x1f, 0)
+        elif bpp==24:
+            masks=(0xff0000, 0xff00, 0xff, 0)
+        elif bpp==32:
+            masks=(0xff0000, 0xff00, 0xff, 0xff000000)
+
+        stride=((width*bpp+31)/32)*4
+        rows=fromstring(data[off:off+stride*height], uint8)
+        if len(rows)!=stride*height: raise Unsupported('Truncated BMP')
+        rows=rows.reshape(height, stride)
+        if not topdown: rows=rows[::-1]
+
+        if bpp==8:
+            if not nclr: nclr=256
+            pal=fromstring(data[14+hdrsize:14+hdrsize+palsize*nclr], uint8).reshape(-1, palsize)
+            self.palette=empty((len(pal),4), uint8)
+            self.palette[:,:3]=pal[:,2::-1]
+            self.palette[:,3]=255
+            self.index=rows[:,:width]
+        elif bpp in [16, 24, 32]:
+            n=bpp/8
+            pixels=rows[:,:width*n].reshape(height, width, n).astype(uint32)
+            v=pixels[:,:,0]
+            for i in range(1,n):
+                v|=pixels[:,:,i]<<(8*i)
+            self.rgba=unmask(v, masks)
+        else:
+            raise Unsupported('BMP depth %d' % bpp)
+
+    def readdds(self, data):
+        (size, flags, height, width, pitch, depth, mipmaps)=unpack_from('<7I', data, 4)
+        (pfsize, pfflags, fourcc, bpp)=unpack_from('<II4sI', data, 76)
+        masks=unpack_from('<4I', data, 92)
+        self.width=width
+        self.height=height
+        if pfflags&4:		# DDPF_FOURCC
+            if fourcc not in blocksizes: raise Unsupported('DDS format %s' % fourcc)
+            self.fourcc=fourcc
+            if not flags&0x20000 or not mipmaps: mipmaps=1	# DDSD_MIPMAPCOUNT
+            self.readlevels(data, 128, mipmaps)
+        elif pfflags&0x40 and bpp in [16, 24, 32]:	# DDPF_RGB
+            n=bpp/8
+            pixels=fromstring(data[128:128+width*height*n], uint8)
+            if len(pixels)!=width*height*n: raise Unsupported('Truncated DDS')
+            pixels=pixels.reshape(height, width, n).astype(uint32)
+            v=pixels[:,:,0]
+            for i in range(1,n):
+                v|=pixels[:,:,i]<<(8*i)
+            if not pfflags&1: masks=masks[:3]+(0,)	# DDPF_ALPHAPIXELS
+            self.rgba=unmask(v, masks)
+        else:
+            raise Unsupported('DDS format')
+
+    def readlevels(self, data, off, count):
+        bs=blocksizes[self.fourcc]
+        (w,h)=(self.width, self.height)
+        for i in range(count):
+            size=((w+3)/4)*((h+3)/4)*bs
+            if off+size>len(data): break
+            self.levels.append(fromstring(data[off:off+size], uint8).reshape(-1, bs))
+            off+=size
+            if w==h==1: break
+            (w,h)=(max(1,w/2), max(1,h/2))
+        if not self.levels: raise Unsupported('Truncated %s' % self.fourcc)
+        self.rgba=dxtdecode(self.fourcc, self.levels[0], self.width, self.height)
+
+    def writepng(self, filename):
+        chunks=[]
+        if self.index is not None:
+            (height, width)=self.index.shape
+            pixels=self.index
+            colour=3
+            chunks.append(('PLTE', self.palette[:,:3].tostring()))
+            alpha=self.palette[:,3]
+            if (alpha!=255).any():
+                chunks.append(('tRNS', alpha[:where(alpha!=255)[0][-1]+1].tostring()))
+        else:
+            (height, width, n)=self.rgba.shape
+            if (self.rgba[:,:,3]==255).all():
+                pixels=self.rgba[:,:,:3]
+                colour=2
+            else:
+                pixels=self.rgba
+                colour=6
+        pixels=pixels.reshape(height,-1)
+        if colour==3:
+            rows=hstack((zeros((height,1), uint8), pixels))	# filter type None
+        else:
+            rows=empty((height, pixels.shape[1]+1), uint8)
+            rows[:,0]=2		# filter type Up
+            rows[0,1:]=pixels[0]
+            rows[1:,1:]=pixels[1:]-pixels[:-1]
+        chunks.insert(0, ('IHDR', pack('>IIBBBBB', width, height, 8, colour, 0, 0, 0)))
+        chunks.append(('IDAT', compress(rows.tostring())))
+        chunks.append(('IEND', ''))
+        f=file(filename, 'wb')
+        f.write('\x89PNG\r\n\x1a\n')
+        for (name, data) in chunks:
+            f.write(pack('>I', len(data)))
+            f.write(name+data)
+            f.write(pack('>I', crc32(name+data)&0xffffffff))
+        f.close()
+
+    # X-Plane DDSs are upside-down compared to DirectX
+    def writedds(self, filename):
+        if not self.fourcc: raise Unsupported('Not a DXTn file')
+        (w,h)=(self.width, self.height)
+        if w&(w-1) or h&(h-1): raise Unsupported('Width and/or height not a power of two')
+        levels=[]
+        for blocks in self.levels:
+            levels.append(dxtflip(self.fourcc, blocks, w, h))
+            (lw,lh)=(w,h)
+            (w,h)=(max(1,w/2), max(1,h/2))
+        count=1
+        size=max(self.width, self.height)
+        while size>1:
+            size/=2
+            count+=1
+        if len(levels)<count:
+            rgba=dxtdecode(self.fourcc, self.levels[-1], lw, lh)
+            while len(levels)<count:
+                rgba=halve(rgba)
+                levels.append(dxtencode(self.fourcc, rgba[::-1]))
+
+        f=file(filename, 'wb')
+        f.write(pack('<4s7I44x', 'DDS ', 124, 0xa1007, self.height, self.width,
+                     levels[0].size, 0, len(levels)))
+        f.write(pack('<II4s5I', 32, 4, self.fourcc, 0, 0, 0, 0, 0))
+        f.write(pack('<5I', 0x401008, 0, 0, 0, 0))
+        for level in levels:
+            f.write(level.tostring())
+        f.close()
+
+
+# Would Texture.writedds succeed? Only needs the file's header.
+def isdxt(header):
+    if header[:2]=='BM' and len(header)>=34:
+        (width, height)=unpack_from('<ii', header, 18)
+        fourcc=header[30:34]
+    elif header[:4]=='DDS ' and len(header)>=128 and unpack_from('<I', header, 80)[0]&4:
+        (height, width)=unpack_from('<II', header, 12)
+        fourcc=header[84:88]
+    else:
+        return False
+    height=abs(height)
+    return fourcc in blocksizes and width>0 and height>0 and not width&(width-1) and not height&(height-1)
+
+
+# Expand packed pixel values into height x width x RGBA
+def unmask(v, masks):
+    rgba=empty(v.shape+(4,), uint8)
+    for i in range(4):
+        mask=masks[i]
+        if not mask:
+            rgba[:,:,i]=255
+            continue
+        shift=0
+        while not (mask>>shift)&1: shift+=1
+        top=mask>>shift
+        rgba[:,:,i]=((v&mask)>>shift)*255/top
+    if masks[3] and not rgba[:,:,3].any():
+        rgba[:,:,3]=255		# 4th channel isn't alpha
+    return rgba
+
+
+# Box filter to next mipmap level
+def halve(rgba):
+    rgba=rgba.astype(uint32)
+    if rgba.shape[0]>1: rgba=(rgba[0::2]+rgba[1::2]+1)/2
+    if rgba.shape[1]>1: rgba=(rgba[:,0::2]+rgba[:,1::2]+1)/2
+    return rgba.astype(uint8)
+
+
+def rgb565(c):
+    rgb=empty(c.shape+(3,), uint32)
+    rgb[...,0]=(c>>11)&0x1f
+    rgb[...,1]=(c>>5)&0x3f
+    rgb[...,2]=c&0x1f
+    rgb[...,0]=(rgb[...,0]<<3)|(rgb[...,0]>>2)
+    rgb[...,1]=(rgb[...,1]<<2)|(rgb[...,1]>>4)
+    rgb[...,2]=(rgb[...,2]<<3)|(rgb[...,2]>>2)
+    return rgb
+
+
+# Returns blocks x 4 colour palettes
+def colourpalette(c0, c1, threecolour):
+    pal=empty((len(c0),4,4), uint32)
+    pal[:,0,:3]=rgb565(c0)
+    pal[:,1,:3]=rgb565(c1)
+    pal[:,:,3]=255
+    four=~threecolour
+    pal[:,2,:3]=where(four[:,None], (2*pal[:,0,:3]+pal[:,1,:3])/3, (pal[:,0,:3]+pal[:,1,:3])/2)
+    pal[:,3,:3]=where(four[:,None], (pal[:,0,:3]+2*pal[:,1,:3])/3, 0)
+    pal[:,3,3]=where(four, 255, 0)
+    return pal
+
+# Returns blocks x 8 alpha palettes
+def alphapalette(a0, a1):
+    pal=empty((len(a0),8), uint32)
+    pal[:,0]=a0
+    pal[:,1]=a1
+    eight=a0>a1
+    for i in range(1,7):
+        pal[:,i+1]=where(eight, ((7-i)*a0+i*a1)/7, ((5-i)*a0+i*a1)/5)
+    pal[:,6]=where(eight, pal[:,6], 0)
+    pal[:,7]=where(eight, pal[:,7], 255)
+    return pal
+
+def bits(v, width, count):
+    return (v[:,None]>>(width*arange(count, dtype=uint64)))&((1<<width)-1)
+
+def bytes2int(b):
+    v=zeros(len(b), uint64)
+    for i in range(b.shape[1]-1,-1,-1):
+        v=(v<<8)|b[:,i]
+    return v
+
+
+def dxtdecode(fourcc, blocks, width, height):
+    n=len(blocks)
+    colour=blocks[:,-8:]
+    c0=colour[:,0]|(colour[:,1].astype(uint32)<<8)
+    c1=colour[:,2]|(colour[:,3].astype(uint32)<<8)
+    pal=colourpalette(c0, c1, (c0<=c1) & (fourcc=='DXT1'))
+    idx=bits(bytes2int(colour[:,4:]), 2, 16)
+    pixels=pal[arange(n)[:,None], idx.astype(int)]
+    if fourcc=='DXT3':
+        pixels[:,:,3]=bits(bytes2int(blocks[:,:8]), 4, 16)*17
+    elif fourcc=='DXT5':
+        apal=alphapalette(blocks[:,0].astype(uint32), blocks[:,1].astype(uint32))
+        pixels[:,:,3]=apal[arange(n)[:,None], bits(bytes2int(blocks[:,2:8]), 3, 16).astype(int)]
+    bw=(width+3)/4
+    bh=(height+3)/4
+    rgba=pixels.reshape(bh, bw, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(bh*4, bw*4, 4)
+    return rgba[:height,:width].astype(uint8)
+
+
+def dxtencode(fourcc, rgba):
+    (height, width)=rgba.shape[:2]
+    bh=(height+3)/4
+    bw=(width+3)/4
+    if height%4 or width%4:	# pad small mipmaps by repetition
+        rgba=rgba[arange(bh*4)%height][:,arange(bw*4)%width]
+    pixels=rgba.reshape(bh, 4, bw, 4, 4).transpose(0, 2, 1, 3, 4).reshape(-1, 16, 4).astype(float)
+    n=len(pixels)
+    rgb=pixels[:,:,:3]
+    alpha=pixels[:,:,3]
+    if fourcc=='DXT1':
+        transparent=alpha<128
+    else:
+        transparent=zeros((n,16), bool)
+    threecolour=transparent.any(1)
+    weight=(~transparent).astype(float)
+    count=weight.sum(1)
+    count[count==0]=1
+
+    # endpoints at the extremes of the principal axis
+    mean=(rgb*weight[:,:,None]).sum(1)/count[:,None]
+    d=(rgb-mean[:,None])*weight[:,:,None]
+    cov=einsum('nij,nik->njk', d, d)
+    axis=d.max(1)-d.min(1)+1e-3
+    for i in range(4):
+        axis=einsum('njk,nk->nj', cov, axis)+1e-6
+        axis/=sqrt((axis*axis).sum(1))[:,None]
+    proj=(d*axis[:,None]).sum(2)
+    proj=where(transparent, proj.mean(), proj)
+    e0=rgb[arange(n), proj.argmax(1)]
+    e1=rgb[arange(n), proj.argmin(1)]
+    def quantise(e):
+        e=clip((e+0.5).astype(uint32), 0, 255)
+        return ((e[:,0]*31+127)/255<<11) | ((e[:,1]*63+127)/255<<5) | (e[:,2]*31+127)/255
+    c0=quantise(e0)
+    c1=quantise(e1)
+    # four colour blocks need c0>c1, three colour blocks c0<=c1
+    swap=where(threecolour, c0>c1, c0<c1)
+    (c0, c1)=(where(swap, c1, c0), where(swap, c0, c1))
+    pal=colourpalette(c0, c1, threecolour).astype(float)
+    dist=((rgb[:,:,None,:]-pal[:,None,:,:3])**2).sum(3)
+    dist[:,:,3]=where(threecolour[:,None], 1e12, dist[:,:,3])
+    idx=dist.argmin(2).astype(uint32)
+    idx=where(transparent, 3, idx)
+    idx=where(((c0==c1) & ~threecolour)[:,None], 0, idx)
+    colour=empty((n,8), uint8)
+    colour[:,0]=c0&0xff
+    colour[:,1]=c0>>8
+    colour[:,2]=c1&0xff
+    colour[:,3]=c1>>8
+    v=(idx<<(2*arange(16, dtype=uint32))).sum(1)
+    for i in range(4):
+        colour[:,4+i]=(v>>(8*i))&0xff
+
+    if fourcc=='DXT1':
+        return colour
+    blocks=empty((n,16), uint8)
+    blocks[:,8:]=colour
+    a=(alpha+0.5).astype(uint64)
+    if fourcc=='DXT3':
+        v=(((a*15+127)/255)<<(4*arange(16, dtype=uint64))).sum(1)
+        for i in range(8):
+            blocks[:,i]=(v>>uint64(8*i))&0xff
+    else:	# DXT5
+        a0=a.max(1)
+        a1=a.min(1)
+        apal=alphapalette(a0, a1).astype(float)
+        aidx=abs(alpha[:,:,None]-apal[:,None,:]).argmin(2).astype(uint64)
+        aidx=where((a0==a1)[:,None], 0, aidx)
+        blocks[:,0]=a0
+        blocks[:,1]=a1
+        v=(aidx<<(3*arange(16, dtype=uint64))).sum(1)
+        for i in range(6):
+            blocks[:,2+i]=(v>>uint64(8*i))&0xff
+    return blocks
+
+
+# Flip DXTn blocks vertically without re-encoding
+def dxtflip(fourcc, blocks, width, height):
+    bw=(width+3)/4
+    bh=(height+3)/4
+    rows=min(height, 4)	# pixel rows used in each block
+    blocks=blocks.reshape(bh, bw, -1)[::-1].reshape(-1, blocks.shape[1]).copy()
+    flip=range(rows-1,-1,-1)+range(rows,4)
+    colour=blocks[:,-4:]
+    colour[:]=colour[:,flip]
+    if fourcc=='DXT3':
+        alpha=blocks[:,:8].reshape(-1,4,2)
+        alpha[:]=alpha[:,flip]
+        blocks[:,:8]=alpha.reshape(-1,8)
+    elif fourcc=='DXT5':
+        v=bytes2int(blocks[:,2:8])
+        r=bits(v, 12, 4)[:,flip]
+        v=(r<<(12*arange(4, dtype=uint64))).sum(1)
+        for i in range(6):
+            blocks[:,2+i]=(v>>uint64(8*i))&0xff
+    return blocks
@@ -1,20 +1,26 @@
 from math import sin, cos, tan, asin, acos, atan, atan2, fmod, pi, degrees, radians, sqrt
 from locale import getpreferredencoding
+import marshal
 import os	# for startfile
-from os import listdir, mkdir, popen3, stat, unlink
-from os.path import abspath, basename, curdir, dirname, exists, isdir, join, normpath, splitext
+from os import listdir, mkdir, popen3, sep, stat, unlink
+from os.path import abspath, basename, curdir, dirname, exists, isdir, islink, join, normpath, splitext
 from shutil import copy2
-from struct import pack
+from mmap import mmap, ACCESS_READ
+from numpy import array, asarray, identity, where, sqrt as npsqrt
+import struct	# for struct.error
+from struct import pack, unpack_from, Struct
 from sys import maxint, platform
 from tempfile import gettempdir
 import types
 import unicodedata
+from zlib import crc32
 
 if not 'startfile' in dir(os):
     # Causes problems under py2exe & not needed
     from urllib import quote
     import webbrowser
 
+import convtex
 from version import appname, appversion
 
 banner="Converted by %s %4.2f\n" % (appname, appversion)
@@ -36,6 +42,7 @@ m2f=3.28084	# 1 metre [ft]
 
 groundfudge=0.22	# arbitrary: 0.124 used in UNNT, 0.172 in KBOS, 2.19 in LIRP
 planarfudge=0.1	# arbitrary
+simplifyfudge=0.1	# [m] points closer than this to a polygon's outline are dropped
 
 complexities=2		# We map to X-plane complexity 1-2 (default, a lot)
 
@@ -109,6 +116,197 @@ class FS2XError(Exception):
         self.msg=msg
 
 
+# Read-only BGL file with a file-like interface.
+# The file is memory-mapped, and values are unpacked in place.
+class BGLFile:
+    structs={}	# compiled formats
+
+    def __init__(self, filename, data=None):
+        self.filename=filename
+        self.pos=0
+        if data is not None:	# already in memory
+            self.data=data
+        else:
+            h=file(filename, 'rb')
+            try:
+                self.data=mmap(h.fileno(), 0, access=ACCESS_READ)
+            except (EnvironmentError, ValueError):	# eg 0-length file
+                self.data=h.read()
+            h.close()	# mapping stays valid
+        self.size=len(self.data)
+        self.code={}	# decoded scenery instructions by offset - see convbgl.ProcScen
+
+    def read(self, n=-1):
+        if n<0: n=self.size-self.pos
+        s=self.data[self.pos:self.pos+n]
+        self.pos+=len(s)
+        return s
+
+    # Equivalent to unpack(fmt, self.read(calcsize(fmt)))
+    def unpack(self, fmt):
+        s=self.structs.get(fmt)
+        if not s: s=self.structs[fmt]=Struct(fmt)
+        v=s.unpack_from(self.data, self.pos)
+        self.pos+=s.size
+        return v
+
+    # Like read, but doesn't copy the data
+    def view(self, n):
+        v=buffer(self.data, self.pos, max(n,0))
+        self.pos+=len(v)
+        return v
+
+    def seek(self, offset, whence=0):
+        if whence==1:
+            offset+=self.pos
+        elif whence==2:
+            offset+=self.size
+        if offset<0: raise IOError
+        self.pos=offset
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.data=''	# mapping is closed once any views are gone
+
+
+# Per-opcode profile of scenery interpretation, enabled with fs2xp -o.
+# Written as a text report and as a pstats dump that postprof.py can read.
+class OpProfile:
+    def __init__(self):
+        self.stats={}	# [count, time, bytes, vertices, polygons] by (srcfile, opcode, name)
+
+    def add(self, srcfile, opcode, name, t, size, vertices, polygons):
+        key=(srcfile, opcode, name)
+        s=self.stats.get(key)
+        if not s: s=self.stats[key]=[0, 0.0, 0, 0, 0]
+        s[0]+=1
+        s[1]+=t
+        s[2]+=size
+        s[3]+=vertices
+        s[4]+=polygons
+
+    # Add the stats from another OpProfile
+    def merge(self, stats):
+        for (key, (count, t, size, vertices, polygons)) in stats.iteritems():
+            s=self.stats.get(key)
+            if not s: s=self.stats[key]=[0, 0.0, 0, 0, 0]
+            s[0]+=count
+            s[1]+=t
+            s[2]+=size
+            s[3]+=vertices
+            s[4]+=polygons
+
+    def write(self, dirname):
+        items=sorted(self.stats.items(), key=lambda i: i[1][1], reverse=True)	# by self time
+        totals=[sum([s[i] for (key, s) in items]) for i in range(5)]
+        stats={}	# pstats format: (cc, nc, tt, ct, callers) by (file, line, function)
+        try:
+            h=file(join(dirname, 'opcodes.txt'), 'wt')
+            h.write("    Time(s)     Count       Bytes    Vertices    Polygons  Opcode\n")
+            for ((srcfile, opcode, name), (count, t, size, vertices, polygons)) in items:
+                srcfile=srcfile.encode('latin1','replace')
+                if isinstance(opcode, str):	# MDL chunk
+                    (op, line, function)=(opcode, 0, '%s %s' % (name, opcode))
+                else:
+                    (op, line, function)=('%02x' % opcode, opcode, name)
+                h.write("%11.3f %9d %11d %11d %11d  %-4s %-18s %s\n" % (t, count, size, vertices, polygons, op, name, srcfile))
+                # Different srcfiles can encode to the same name
+                (cc, nc, tt, ct, callers)=stats.get((srcfile, line, function), (0, 0, 0.0, 0.0, {}))
+                stats[(srcfile, line, function)]=(cc+count, nc+count, tt+t, ct+t, callers)
+            h.write("%11.3f %9d %11d %11d %11d  Total\n" % (totals[1], totals[0], totals[2], totals[3], totals[4]))
+            h.close()
+            h=file(join(dirname, 'opcodes.dmp'), 'wb')
+            marshal.dump(stats, h)
+            h.close()
+        except IOError, e:
+            raise FS2XError("Can't write opcode profile in %s: %s" % (dirname, e.strerror))
+
+
+# Snapshot of the MSFS scenery folders, taken once per run so that each
+# phase doesn't have to go back to the filesystem. Folders outside the
+# roots (eg Resources) are listed on first use and then remembered.
+class Inventory:
+    def __init__(self, roots):
+        self.roots=[]	# (root, [(path, dirs, files)]) in os.walk order
+        self.names={}	# listdir() by folder
+        self.folded={}	# set of foldname()s of the above by folder
+        self.stats={}	# stat() by filename, filled in on demand
+        self.texdicts={}	# maketexdict() by folder
+        for root in roots:
+            if root: self.roots.append((root, self.scan(root)))
+
+    # Like os.walk, but keeping the listdir order. Like os.walk, links to
+    # folders are listed but not followed, so that loops can't recurse.
+    def scan(self, top):
+        tree=[]
+        try:
+            names=listdir(top)
+        except EnvironmentError:
+            return tree
+        self.names[top]=names
+        dirs=[]
+        files=[]
+        for name in names:
+            if isdir(join(top, name)):
+                dirs.append(name)
+            else:
+                files.append(name)
+        tree.append((top, dirs, files))
+        for name in dirs:
+            if not islink(join(top, name)):
+                tree.extend(self.scan(join(top, name)))
+        return tree
+
+    def walk(self, top):
+        for (root, tree) in self.roots:
+            if top==root:
+                return tree
+            elif top.startswith(root+sep):
+                return [entry for entry in tree if entry[0]==top or entry[0].startswith(top+sep)]
+        return self.scan(top)
+
+    def listdir(self, path):
+        if path not in self.names:
+            self.names[path]=listdir(path)
+        return self.names[path]
+
+    # Case-insensitive lookup of a name in a folder. Returns None if missing.
+    def find(self, path, name):
+        name=foldname(name)
+        try:
+            for f in self.listdir(path):
+                if foldname(f)==name: return f
+        except EnvironmentError:
+            pass
+        return None
+
+    # Case-insensitive, like the Mac and Windows filesystems
+    def exists(self, filename):
+        path=dirname(filename)
+        try:
+            if path not in self.folded:
+                self.folded[path]=set([foldname(f) for f in self.listdir(path)])
+        except EnvironmentError:
+            return False
+        return foldname(basename(filename)) in self.folded[path]
+
+    # Returns None if the file can't be stat'ed
+    def stat(self, filename):
+        if filename not in self.stats:
+            try:
+                self.stats[filename]=stat(filename)
+            except EnvironmentError:
+                return None
+        return self.stats[filename]
+
+
+# Name to compare filenames by - normalized and case-folded
+def foldname(name):
+    return normalize(unicodeify(name)).lower()
+
+
 class Point:
     def __init__(self, lat, lon):
         self.lat=lat
@@ -182,36 +380,31 @@ class Point:
         return self
 
 
+# 4x4 matrix, row vectors on the left. Held as a NumPy array so that whole
+# vertex lists can be transformed at once. Arithmetic is done in the same order
+# as the scalar formulae so that results, and hence objdat keys, are unchanged.
 class Matrix:
     def __init__(self, v=None):
-        if v:
-            self.m=[]
-            # deep copy
-            for i in range(4):
-                x=[]
-                for j in range(4):
-                    x.append(v[i][j])
-                self.m.append(x)
+        if v is not None:
+            self.m=array(v, float)	# deep copy
         else:
-            self.m=[[1,0,0,0],
-                    [0,1,0,0],
-                    [0,0,1,0],
-                    [0,0,0,1]]
+            self.m=identity(4)
+        self.rows=self.m.tolist()	# self.m as lists, for scalar arithmetic. Don't modify either
 
     def transform(self, x, y, z):
-        m=self.m
+        m=self.rows
         return (m[0][0]*x + m[1][0]*y + m[2][0]*z + m[3][0],
                 m[0][1]*x + m[1][1]*y + m[2][1]*z + m[3][1],
                 m[0][2]*x + m[1][2]*y + m[2][2]*z + m[3][2])
 
     def rotate(self, x, y, z):
-        m=self.m
+        m=self.rows
         return (m[0][0]*x + m[1][0]*y + m[2][0]*z,
                 m[0][1]*x + m[1][1]*y + m[2][1]*z,
                 m[0][2]*x + m[1][2]*y + m[2][2]*z)
 
     def rotateAndNormalize(self, x, y, z):
-        m=self.m
+        m=self.rows
         x1=m[0][0]*x + m[1][0]*y + m[2][0]*z
         y1=m[0][1]*x + m[1][1]*y + m[2][1]*z
         z1=m[0][2]*x + m[1][2]*y + m[2][2]*z
@@ -221,12 +414,25 @@ class Matrix:
             hyp=1/sqrt(x1*x1 + y1*y1 + z1*z1)
             return x1*hyp, y1*hyp, z1*hyp
 
+    # Batched transform of an array of (x,y,z) rows
+    def transform_many(self, xyz):
+        xyz=asarray(xyz, float).reshape(-1,3)
+        return xyz[:,0:1]*self.m[0,0:3] + xyz[:,1:2]*self.m[1,0:3] + xyz[:,2:3]*self.m[2,0:3] + self.m[3,0:3]
+
+    # Batched rotate of an array of (x,y,z) rows, optionally normalizing
+    def rotate_many(self, xyz, normalize=False):
+        xyz=asarray(xyz, float).reshape(-1,3)
+        r=xyz[:,0:1]*self.m[0,0:3] + xyz[:,1:2]*self.m[1,0:3] + xyz[:,2:3]*self.m[2,0:3]
+        if normalize:
+            hyp=r[:,0]*r[:,0] + r[:,1]*r[:,1] + r[:,2]*r[:,2]
+            r*=(1/npsqrt(where(hyp==0, 1, hyp)))[:,None]	# zero vectors stay zero
+        return r
 
     # Matrix adjoint/adjugate for obtaining normals - see
     # http://www.worldserver.com/turk/computergraphics/NormalTransformations.pdf
     # Note that vectors produced using this matrix will need renormalizing
     def adjoint(self):
-        m=self.m
+        m=self.rows
         return Matrix([[m[1][1]*m[2][2] - m[1][2]*m[2][1],
                         m[1][2]*m[2][0] - m[1][0]*m[2][2],
                         m[1][0]*m[2][1] - m[1][1]*m[2][0], 0],
@@ -240,9 +446,10 @@ class Matrix:
 
     def heading(self):
         # Derive heading from matrix, assuming no pitch or bank
-        h=round(self.m[0][0]/self.m[1][1], 3)	# arbitrary - handle rounding errors
+        m=self.rows
+        h=round(m[0][0]/m[1][1], 3)	# arbitrary - handle rounding errors
         try:
-            if self.m[2][0]>=0:
+            if m[2][0]>=0:
                 return degrees(acos(h))
             else:
                 return 360-degrees(acos(h))
@@ -251,12 +458,12 @@ class Matrix:
 
     def scale(self):
         # Assumes no pitch or bank
-        return self.m[1][1]
+        return self.rows[1][1]
 
     def offset(self, x, y, z):
-        n=Matrix(self.m)
-        n.m[3]=[self.m[3][0]+x, self.m[3][1]+y, self.m[3][2]+z, 1]
-        return n
+        m=self.m.copy()
+        m[3]=[self.m[3,0]+x, self.m[3,1]+y, self.m[3,2]+z, 1]
+        return Matrix(m)
         
     def headed(self, angle):
         # about y axis
@@ -286,28 +493,22 @@ class Matrix:
         return t*self
 
     def __cmp__(self, o):
-        return cmp(self.m, o.m)
+        if not isinstance(o, Matrix): return cmp(id(self), id(o))
+        return cmp(self.rows, o.rows)
 
     def __hash__(self):
-        return hash(tuple([tuple(r) for r in self.m]))
+        return hash((self.m+0.0).tostring())	# +0.0 so that -0.0 hashes as 0.0
 
     def __mul__(self, other):
-        # self*other
+        # self*other. Each element summed over k in order, as the scalar loop did
         a=self.m
         b=other.m
-        n=Matrix([[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]])
-        for i in range(4):
-            for j in range(4):
-                x=0
-                for k in range(4):
-                    x += a[i][k] * b[k][j]
-                n.m[i][j]=x
-        return n
+        return Matrix(a[:,0:1]*b[0] + a[:,1:2]*b[1] + a[:,2:3]*b[2] + a[:,3:4]*b[3])
 
     def __str__(self):
         s=''
         for i in range(4):
-            s += ' [%8.3f %8.3f %8.3f %8.3f]\n' % (self.m[i][0], self.m[i][1], self.m[i][2], self.m[i][3])
+            s += ' [%8.3f %8.3f %8.3f %8.3f]\n' % tuple(self.rows[i])
         s='['+s[1:-1]+']'
         return s
 
@@ -411,6 +612,7 @@ class Object:
         self.vt=[]
         self.idx=[]
         self.mattri=[]			# [(Material, start, count)]
+        self.vtcrc=self.idxcrc=0	# running checksums of vt and idx, for digest()
 
     def __eq__(self, o):
         return (#self.name==o.name and		# don't care about name
@@ -424,6 +626,7 @@ class Object:
                 self.mattri==o.mattri)
 
     def addgeometry(self, mat, vt, idx):
+        (nvt, nidx)=(len(self.vt), len(self.idx))
         if not vt:		# re-using existing vertex table
             start=len(self.idx)
             count=len(idx)
@@ -439,6 +642,8 @@ class Object:
             count=len(idx)
             self.vt.extend([(round(x,3), round(y,3), round(z,3), round(nx,3), round(ny,3), round(nz,3), round(tu,3), round(tv,3)) for (x,y,z,nx,ny,nz,tu,tv) in vt])	# round to increase chance of detecting dupes
             self.idx.extend([base+i for i in idx])
+        self.vtcrc=crc32((asarray(self.vt[nvt:], float)+0.0).tostring(), self.vtcrc)	# +0.0 so that -0.0 matches 0.0
+        self.idxcrc=crc32(asarray(self.idx[nidx:], '<i4').tostring(), self.idxcrc)
         if not self.mattri:	# or __debug__:
             self.mattri.append((mat, start, count))
         else:
@@ -449,6 +654,13 @@ class Object:
             else:
                 self.mattri.append((mat, start, count))
 
+    # Digest of what __eq__ compares, plus indices, for finding duplicates by
+    # lookup. Doesn't depend on how the geometry was split between calls.
+    def digest(self):
+        return (len(self.vt), len(self.idx), self.vtcrc, self.idxcrc,
+                crc32(repr((self.tex and (self.tex.d or (None, self.tex.e)), self.layer, self.vlight, self.veffect,
+                            [(mat.s, mat.alpha, mat.shiny, mat.shadow, start, count) for (mat, start, count) in self.mattri]))))	# as Material.__eq__
+
     def filename(self, scale):
         assert not self.tex or (not self.tex.s and not self.tex.n and not self.tex.r)	# Naming scheme will need re-work
         if self.tex and (self.tex.d or self.tex.e):
@@ -630,6 +842,28 @@ class Object:
             raise FS2XError("Can't write \"%s\"" % objpath)
 
 
+# Run-wide store of generated Objects by content, so that identical geometry
+# from any source file shares one OBJ. Returns the output.objdat name to place
+# - that of an existing identical Object, or of obj which is added under name
+# or else its filename.
+def storeobj(obj, output, name=None):
+    digest=obj.digest()
+    for oldname in output.objstore.get(digest, []):
+        if output.objdat[oldname][0]==obj: return oldname
+    if not name:
+        while obj.filename(1) in output.objdat:
+            obj.name+='x'	# Hack - different matrices at same loc eg LIEE2008 faro_icav
+        name=obj.filename(1)
+    else:
+        while name in output.objdat:
+            # Different object with the same name, eg from a BGL with the same name in another folder
+            obj.name+='x'
+            name+='x'
+    output.objstore.setdefault(digest, []).append(name)
+    output.objdat[name]=[obj]
+    return name
+
+
 class Polygon:
     def __init__(self, name, tex, nowrap, scale, layer, paging=None):
         self.name=name
@@ -731,12 +965,12 @@ def maketex(src, dstdir, output, palno, substituteblank=False):
     if not ext in ['.dds', '.bmp', '.png']:
         tex+=ext	# For *.xAF etc
 
-    if not exists(src):
+    if not output.inventory.exists(src):
         if output.dds:
             tex += '.dds'
         else:
             tex += '.png'
-        for f in listdir('Resources'):
+        for f in output.inventory.listdir('Resources'):
             if f.lower()==tex.lower():
                 copy2(join(os.getcwdu(),'Resources',tex), dstdir)
                 output.donetex[src]=tex
@@ -756,18 +990,61 @@ def maketex(src, dstdir, output, palno, substituteblank=False):
     elif src in output.donetex:
         return output.donetex[src]
 
-    if output.dds and ext in ['.dds', '.bmp']:
-        dds=tex+'.dds'
-        dst=join(dstdir,dds)
-        x=helper(output.ddsexe, src, dst)
-        if exists(dst):
-            output.donetex[src]=dds
-            return dds
-        elif output.debug:
-            output.debug.write("DDS:\t%s:\t%s\n" % (src, x))
-
-    tex+='.png'
+    # Decide on the output format now so the name can be returned
+    # straight away, and convert in the background
+    try:
+        f=file(src, 'rb')
+        header=f.read(128)
+        f.close()
+    except IOError:
+        header=''
+    if output.dds and ext in ['.dds', '.bmp'] and convtex.isdxt(header):
+        tex+='.dds'
+    else:
+        tex+='.png'
+    output.donetex[src]=tex
     dst=join(dstdir,tex)
+    job=(src, dst, palno, output.pngexe, output.ddsexe, output.debug is not None)
+    if output.texpool:
+        # Textures with the same name in different folders would otherwise
+        # be written to the same file at the same time
+        if dst not in output.texdsts:
+            output.texdsts[dst]=src
+            output.texjobs.append((src, output.texpool.apply_async(converttex, (job,))))
+    else:
+        texevents(converttex(job), output)
+        tex=output.donetex[src]	# may have fallen back to PNG
+    return tex
+
+
+# Convert a texture to the file named by maketex.
+# Runs in a worker process, so returns log and debug messages as events
+# for texevents to replay.
+def converttex(job):
+    (src, dst, palno, pngexe, ddsexe, debug)=job
+    events=[]
+    try:
+        data=file(src, 'rb').read()
+        if 65536 <= len(data) < 65600 and data[:2]!='BM' and data[:4]!='DDS ':
+            # Not a BMP or DDS. Assume RAW and add standard BMP header
+            data=pack('<%dH' % len(rawbmphdr), *rawbmphdr)+data
+        t=convtex.Texture(data, palno)
+        if dst[-4:]=='.dds':
+            t.writedds(dst)
+        else:
+            t.writepng(dst)
+        return events
+    except (convtex.Unsupported, IOError, IndexError, ValueError, struct.error), e:
+        # Fall back to helpers
+        if debug: events.append(('debug', "Texture:\t%s:\t%s\n" % (src, e)))
+
+    dds=dst
+    if dst[-4:]=='.dds':
+        x=helper(ddsexe, src, dst)
+        if debug: events.append(('debug', "DDS:\t%s:\t%s\n" % (src, x)))
+        if exists(dst): return events
+        dst=dst[:-4]+'.png'	# Fall back to PNG
+
     try:
         newsrc=src
         if 65536 <= stat(src).st_size < 65600:
@@ -777,7 +1054,7 @@ def maketex(src, dstdir, output, palno, substituteblank=False):
             if c[:2]!='BM' and c!='DDS ':
                 # Not a BMP or DDS. Assume RAW and add standard BMP header
                 f.seek(0)
-                newsrc=join(gettempdir(), basename(src))
+                newsrc=join(gettempdir(), '%d-%s' % (os.getpid(), basename(src)))
                 t=file(newsrc, 'wb')
                 for x in rawbmphdr:
                     t.write(pack('<H',x))
@@ -786,20 +1063,34 @@ def maketex(src, dstdir, output, palno, substituteblank=False):
             f.close()
 
         if palno:
-            x=helper(output.pngexe, '-xbrqp%d' % (palno-1), '-o', dst, newsrc)
+            x=helper(pngexe, '-xbrqp%d' % (palno-1), '-o', dst, newsrc)
         else:
-            x=helper(output.pngexe, '-xbrq', '-o', dst, newsrc)
+            x=helper(pngexe, '-xbrq', '-o', dst, newsrc)
         if newsrc!=src: unlink(newsrc)
         if not exists(dst):
-            output.log("Can't convert texture %s\n%s" % (basename(src),x))
-        elif output.debug:
-            output.debug.write("PNG:\t%s:\t%s\n" % (src, x))
+            events.append(('log', "Can't convert texture %s\n%s" % (basename(src),x)))
+        else:
+            if debug: events.append(('debug', "PNG:\t%s:\t%s\n" % (src, x)))
+            if dst!=dds: events.append(('rename', (basename(dds), basename(dst))))
 
     except IOError:
-        output.log("Can't convert texture %s" % basename(src))
-
-    output.donetex[src]=tex
-    return tex
+        events.append(('log', "Can't convert texture %s" % basename(src)))
+    return events
+
+
+# Apply the events recorded by converttex
+def texevents(events, output):
+    for (typ, msg) in events:
+        if typ=='log':
+            output.log(msg)
+        elif typ=='rename':
+            # Texture was written as PNG instead of DDS - see Output.retexture
+            (old, new)=msg
+            for (src, tex) in output.donetex.items():
+                if tex==old: output.donetex[src]=new
+            output.texrenames[old]=new
+        elif output.debug:
+            output.debug.write(msg)
 
 
 # Uniquify list, retaining order. Assumes list items are hashable
@@ -848,6 +1139,164 @@ def helper(*cmds):
     return err
 
 
+# Decompress an FS2002/FS2004 compressed (MRCI2) BGL to dst.
+# Returns False if the file can't be decompressed, in which case the
+# caller should fall back to the bglunzip helper.
+def unzipbgl(src, dst):
+    try:
+        data=unzipbgldata(src)
+        if not data: return False
+        h=file(dst, 'wb')
+        h.write(data)
+        h.close()
+        return True
+    except:
+        if exists(dst): unlink(dst)
+        return False
+
+
+# Contents of an FS2002/FS2004 compressed BGL as unzipbgl would write them,
+# or None if it can't be decompressed. If size is given, stops once at
+# least that much of the file has been decompressed.
+def unzipbgldata(src, size=None):
+    try:
+        h=file(src, 'rb')
+        data=h.read()
+        h.close()
+        (magic,)=unpack_from('<I', data, 0x76)
+        if magic==0x87654321:
+            hdrsize=0xa8
+            if unpack_from('<I', data, 0x36)!=(0,) or unpack_from('<3I', data, 0x9c)!=(0,0,0):
+                return None
+        else:
+            hdrsize=0x80
+        (magic,total,checksum)=unpack_from('<3I', data, hdrsize)
+        if magic!=0xabcdef01: return None
+        # We don't know how the checksum is calculated, so instead mrci2
+        # checks that the data decompresses to exactly the right size using
+        # all the input, and we check that the result hangs together
+        if size is None or size-hdrsize>=total:
+            out=mrci2(data[hdrsize+20:], total)
+        else:
+            out=mrci2(data[hdrsize+20:], size-hdrsize, True)
+        if not out: return None
+        data=data[:122]+pack('<I', 0)+data[126:hdrsize]+out	# spare2: no longer compressed
+        if not unzippedok(data, hdrsize, hdrsize+total): return None
+        return data
+    except:
+        return None
+
+
+# Whether the sections in the header, and the objects in the library
+# directory, of decompressed BGL data lie within its decompressed size
+def unzippedok(data, hdrsize, size):
+    for off in [42,46,54,58,62,102,114]:
+        (base,)=unpack_from('<I', data, off)
+        if base and not hdrsize<=base<size: return False
+    (libbase,)=unpack_from('<I', data, 62)
+    pos=libbase
+    while libbase and pos+4<=len(data):
+        (off,)=unpack_from('<I', data, pos)
+        if not off: break
+        if not hdrsize<=libbase+off<size: return False
+        pos+=20
+    return True
+
+
+# MRCI2 decompressor. Input is a little-endian bitstream after a 4 byte
+# 'JM' signature. Returns None if the data is corrupt or truncated, or
+# doesn't use up the input. If part, stops at the first block end after
+# size bytes.
+def mrci2(data, size, part=False):
+    if len(data)<=4 or data[:2]!='JM': return None
+    src=bytearray(data[4:])
+    end=len(src)*8
+    src.extend('\0\0\0\0')	# so that refill can overrun the end
+    out=bytearray()
+    pos=0	# next input byte
+    acc=0	# bit buffer
+    n=0		# bits in buffer
+    try:
+        while True:
+            if n<32:
+                while n<=24:
+                    acc|=src[pos]<<n
+                    pos+=1
+                    n+=8
+                if pos*8-n>end: return None	# ran out of data
+            if not acc&1:			# 0: 7 bit literal
+                out.append((acc>>1)&0x7f)
+                acc>>=8
+                n-=8
+                continue
+            elif acc&2:			# 11: 7 bit literal + 0x80
+                out.append(((acc>>2)&0x7f)|0x80)
+                acc>>=9
+                n-=9
+                continue
+            if not acc&4:			# 100: 6 bit offset
+                off=(acc>>3)&0x3f
+                acc>>=9
+                n-=9
+            elif not acc&8:			# 1010: 8 bit offset
+                off=((acc>>4)&0xff)+0x40
+                acc>>=12
+                n-=12
+            else:				# 1011: 12 bit offset
+                off=((acc>>4)&0xfff)+0x140
+                acc>>=16
+                n-=16
+            if off==0x113f:			# end of block
+                if len(out)>=size: break
+                continue
+            if n<24:
+                while n<=24:
+                    acc|=src[pos]<<n
+                    pos+=1
+                    n+=8
+            # Length: k zero bits, a one bit, then k bits
+            k=0
+            while not acc&1:
+                k+=1
+                acc>>=1
+                n-=1
+                if k>12: return None
+            acc>>=1
+            n-=1
+            if k:
+                if n<k:
+                    while n<=24:
+                        acc|=src[pos]<<n
+                        pos+=1
+                        n+=8
+                length=(acc&((1<<k)-1))+(1<<k)+2
+                acc>>=k
+                n-=k
+            else:
+                length=3
+            if not off or off>len(out): return None
+            if off>=length:
+                start=len(out)-off
+                out.extend(out[start:start+length])
+            else:				# overlapping copy repeats the tail
+                out.extend((out[-off:]*(length/off+1))[:length])
+    except IndexError:	# ran off the end
+        return None
+    if pos*8-n>end or len(out)<size or (len(out)!=size and not part): return None
+    if end-(pos*8-n)>=32 and not part: return None	# more than padding left over
+    return str(out)
+
+
+# Pool of worker processes, or None to run serially
+def workerpool(workers):
+    if workers<=1: return None
+    try:
+        from multiprocessing import Pool
+    except ImportError:	# Python<2.6
+        return None
+    return Pool(workers)
+
+
 # View contents of file
 def viewer(filename):
     try:
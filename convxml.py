@@ -5,7 +5,7 @@ from sys import maxint
 import xml.parsers.expat
 from tempfile import gettempdir
 
-from convutil import m2f, complexity, asciify, AptNav, Object, Point, Matrix, FS2XError, D, T, E
+from convutil import m2f, complexity, asciify, AptNav, Object, Point, Matrix, FS2XError, storeobj, D, T, E
 from convobjs import makegenquad, makegenmulti
 from convtaxi import apronlayout, designators, surfaces, taxilayout, Node, Link
 from convatc  import atclayout
@@ -154,8 +154,8 @@ class SceneryObject:
                     parser.gencount += 1
                     name="%s-generic-%d" % (asciify(parser.filename[:-4]), parser.gencount)
                     obj=makegenmulti(name, output, *key)
+                    name=storeobj(obj, output, name)
                     parser.genmulticache[key]=name
-                    output.objdat[name]=[obj]
                 output.objplc.append((loc, heading, cmplx, name, 1))
                                 
             for m in l.pyramidalbuilding:
@@ -174,8 +174,8 @@ class SceneryObject:
                     parser.gencount += 1
                     name="%s-generic-%d" % (asciify(parser.filename[:-4]), parser.gencount)
                     obj=makegenquad(name, output, *key)
+                    name=storeobj(obj, output, name)
                     parser.genquadcache[key]=name
-                    output.objdat[name]=[obj]
                 output.objplc.append((loc, heading, cmplx, name, 1))
             for m in l.rectangularbuilding:
                 heights=[scale*float(m.sizeBottomY),
@@ -206,8 +206,8 @@ class SceneryObject:
                     parser.gencount += 1
                     name="%s-generic-%d" % (asciify(parser.filename[:-4]), parser.gencount)
                     obj=makegenquad(name, output, *key)
+                    name=storeobj(obj, output, name)
                     parser.genquadcache[key]=name
-                    output.objdat[name]=[obj]
                 output.objplc.append((loc, heading, cmplx, name, 1))
                 
         for l in self.libraryobject:
@@ -1321,6 +1321,15 @@ class Parse:
         self.genmulticache={}
         self.genquadcache={}
 
+        if isinstance(fd, list):
+            # pre-decoded elements from convfac
+            for (name, attrs) in fd:
+                if attrs is None:
+                    self.end_element(name)
+                else:
+                    self.start_element(name, attrs)
+            return
+
         parser=xml.parsers.expat.ParserCreate()
         parser.StartElementHandler = self.start_element
         parser.EndElementHandler = self.end_element
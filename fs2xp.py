@@ -38,8 +38,14 @@ import sys	# for path
 from sys import exit, argv, platform, version
 from traceback import print_exc
 
+try:
+    from multiprocessing import freeze_support
+except ImportError:	# Python<2.6
+    def freeze_support(): pass
+
 from convmain import Output
-from convutil import FS2XError, viewer
+from convtess import usenative
+from convutil import FS2XError, OpProfile, viewer
 
 # callbacks
 def status(percent, msg):
@@ -57,106 +63,139 @@ def refresh():
     pass
 
 def usage():
-    exit('\nUsage:\tfs2xp [options] "MSFS scenery location" "X-Plane scenery location"\noptions:\t-l "Additional MSFS library location"\n\t\t-s Spring|Summer|Autumn|Winter\n\t\t-x\n\t\t-8\n\t\t-9\n')
-
-
-# Path validation
-mypath=dirname(abspath(argv[0]))
-if not isdir(mypath):
-    exit('"%s" is not a folder' % mypath)
-if basename(mypath)=='MacOS':
-    chdir(normpath(join(mypath,pardir)))	# Starts in MacOS folder
-else:
-    chdir(mypath)
-
-
-# Arg validation
-lbpath=None
-season=0
-debug=False
-xpver=10
-dumplib=False
-prof=False
-try:
-    (opts, args) = getopt(argv[1:], 'l:s:d9px?h')
-except GetoptError, e:
-    print '\nError:\t'+e.msg
-    usage()
-for (opt, arg) in opts:
-    if opt in ['-?' or '-h']:
+    exit('\nUsage:\tfs2xp [options] "MSFS scenery location" "X-Plane scenery location"\noptions:\t-l "Additional MSFS library location"\n\t\t-s Spring|Summer|Autumn|Winter\n\t\t-j processes\n\t\t-n\n\t\t-o\n\t\t-r\n\t\t-t\n\t\t-x\n\t\t-z\n\t\t-8\n\t\t-9\n')
+
+
+# Not run when a worker process re-imports this module on Windows
+if __name__=='__main__':
+    freeze_support()	# for py2exe
+
+    # Path validation
+    mypath=dirname(abspath(argv[0]))
+    if not isdir(mypath):
+        exit('"%s" is not a folder' % mypath)
+    if basename(mypath)=='MacOS':
+        chdir(normpath(join(mypath,pardir)))	# Starts in MacOS folder
+    else:
+        chdir(mypath)
+
+
+    # Arg validation
+    lbpath=None
+    season=0
+    debug=False
+    xpver=10
+    dumplib=False
+    prof=False
+    workers=1
+    lazylibs=False
+    libcache=True
+    dsftool=False
+    opprof=False
+    nativetess=False
+    try:
+        (opts, args) = getopt(argv[1:], 'l:s:j:d9noprtxz?h')
+    except GetoptError, e:
+        print '\nError:\t'+e.msg
         usage()
-    elif opt=='-l':
-        lbpath=abspath(unicode(arg))
-    elif opt=='-d':
-        debug=True
-    elif opt=='-8':
-        xpver=8
-    elif opt=='-9':
-        xpver=9
-    elif opt=='-p':
-        prof=True
-    elif opt=='-x':
-        dumplib=True
-    elif opt=='-s':
-        seasons=['spring','summer','autumn','winter']
-        if arg.lower() not in seasons:
-            print '\nError:\tSeason %s not recognized' % arg
+    for (opt, arg) in opts:
+        if opt in ['-?' or '-h']:
             usage()
-        season=seasons.index(arg.lower())
-if len(args)!=2:
-    usage()
-if dumplib:
-    if lbpath:
-        exit("\nError:\tSpecify only one of -l and -x\n")
-    else:
-        fspath=None
-        lbpath=abspath(unicode(args[0]))
-else:
-    fspath=abspath(unicode(args[0]))
-xppath=abspath(unicode(args[1]))
-logname=abspath(join(xppath, 'summary.txt'))
-        
-
-# Main
-try:
-    output=Output(fspath, lbpath, xppath, dumplib, season, xpver,
-                  status, log, refresh, debug and not prof)
-    output.scanlibs()
-    if False:	# just list library uid/names
-        for (uid,(mdlformat, bglname, bglname, off, rcsize, name, scale)) in output.libobj.iteritems():
-            output.debug.write("%s\t%s\t%s\n" % (uid, name, bglname[len(lbpath):]))
-        raise IOError
-    if prof:
-        from profile import run
-        run('output.process()', join(xppath,'profile.dmp'))
-    else:
-        output.process()
-    output.proclibs()
-    output.procphotos()
-    output.export()
-    if output.debug:
-        output.debug.close()
-    elif exists(logname):
-        status(-1, 'Displaying summary "%s"' % logname)
-        viewer(logname)
-    status(-1, 'Done.')
-
-except FS2XError, e:
-    if __debug__: print_exc()
-    exit('Error:\t%s\n' % e.msg)
-
-except:
-    status(-1, 'Internal error')
-    print_exc()
-    if not debug:
-        if not isdir(dirname(logname)):
-            mkdir(dirname(logname))
-        logfile=file(logname, 'at')
-        logfile.write('\nInternal error\n')
-        print_exc(None, logfile)
-        logfile.close()
-        status(-1, 'Displaying error log "%s"' % logname)
-        viewer(logname)
+        elif opt=='-l':
+            lbpath=abspath(unicode(arg))
+        elif opt=='-d':
+            debug=True
+        elif opt=='-j':
+            try:
+                workers=int(arg)
+            except ValueError:
+                workers=0
+            if workers<1:
+                print '\nError:\tNumber of processes %s not recognized' % arg
+                usage()
+        elif opt=='-8':
+            xpver=8
+        elif opt=='-9':
+            xpver=9
+        elif opt=='-n':
+            nativetess=True
+        elif opt=='-o':
+            opprof=True
+        elif opt=='-p':
+            prof=True
+        elif opt=='-r':
+            libcache=False
+        elif opt=='-t':
+            dsftool=True
+        elif opt=='-x':
+            dumplib=True
+        elif opt=='-z':
+            lazylibs=True
+        elif opt=='-s':
+            seasons=['spring','summer','autumn','winter']
+            if arg.lower() not in seasons:
+                print '\nError:\tSeason %s not recognized' % arg
+                usage()
+            season=seasons.index(arg.lower())
+    if len(args)!=2:
+        usage()
+    if dumplib:
+        if lbpath:
+            exit("\nError:\tSpecify only one of -l and -x\n")
+        else:
+            fspath=None
+            lbpath=abspath(unicode(args[0]))
     else:
-        print
-    exit(1)
+        fspath=abspath(unicode(args[0]))
+    xppath=abspath(unicode(args[1]))
+    logname=abspath(join(xppath, 'summary.txt'))
+
+
+    # Main
+    if nativetess: usenative()
+    try:
+        output=Output(fspath, lbpath, xppath, dumplib, season, xpver,
+                      status, log, refresh, debug and not prof, workers, libcache, lazylibs)
+        output.dsftool=dsftool
+        if opprof: output.opprof=OpProfile()
+        output.scanlibs()
+        if False:	# just list library uid/names
+            for (uid,(mdlformat, bglname, bglname, off, rcsize, name, scale)) in output.libobj.iteritems():
+                output.debug.write("%s\t%s\t%s\n" % (uid, name, bglname[len(lbpath):]))
+            raise IOError
+        if prof:
+            from profile import run
+            run('output.process()', join(xppath,'profile.dmp'))
+        else:
+            output.process()
+        output.proclibs()
+        output.procphotos()
+        output.export()
+        if output.opprof:
+            output.opprof.write(xppath)
+        if output.debug:
+            output.debug.close()
+        elif exists(logname):
+            status(-1, 'Displaying summary "%s"' % logname)
+            viewer(logname)
+        status(-1, 'Done.')
+
+    except FS2XError, e:
+        if __debug__: print_exc()
+        exit('Error:\t%s\n' % e.msg)
+
+    except:
+        status(-1, 'Internal error')
+        print_exc()
+        if not debug:
+            if not isdir(dirname(logname)):
+                mkdir(dirname(logname))
+            logfile=file(logname, 'at')
+            logfile.write('\nInternal error\n')
+            print_exc(None, logfile)
+            logfile.close()
+            status(-1, 'Displaying error log "%s"' % logname)
+            viewer(logname)
+        else:
+            print
+        exit(1)